@@ -0,0 +1,34 @@
+import time
+import pandas as pd
+from .helpers import (
+    prepare_calculated_loan_details,
+    prepare_modified_loan_tape
+)
+from .portfolio import create_portfolio_amortization_schedule, create_portfolio_periodic_amortization
+from .exports import save_frame_npz
+
+
+def run_simplified_chunk(loans, path):
+    '''
+    Computes the schedules of a chunk of simplified loan records or compact tape and saves them
+    as one columnar npz file. Returns (loans, rows, seconds).
+    '''
+    started = time.perf_counter()
+    
+    schedule = create_portfolio_amortization_schedule(prepare_calculated_loan_details(loans))
+    save_frame_npz(path, schedule)
+    
+    return len(loans), len(schedule), time.perf_counter() - started
+
+
+def run_modified_chunk(loans, path):
+    '''
+    Computes the periodic schedules of a chunk of modified loan records or compact tape (with their `id`)
+    and saves them as one columnar npz file. Returns (loans, rows, seconds).
+    '''
+    started = time.perf_counter()
+    
+    schedule = create_portfolio_periodic_amortization(prepare_modified_loan_tape(loans)) if len(loans) else pd.DataFrame()
+    save_frame_npz(path, schedule)
+    
+    return len(loans), len(schedule), time.perf_counter() - started
@@ -0,0 +1,37 @@
+import numpy as np
+
+
+CENTS = 100
+
+
+def to_cents(amounts):
+    '''
+    Converts dollar amounts to int64 cents in bulk, with the result of `np.round(amount, 2)`:
+    `amount * 100` rounded half to even. The schedule helpers round numpy floats, which
+    round this way too, so already rounded schedule values convert exactly.
+    '''
+    return np.rint(np.asarray(amounts, dtype=float) * CENTS).astype(np.int64)
+
+
+def from_cents(cents):
+    '''
+    Converts int64 cents back to float dollars
+    '''
+    return np.asarray(cents) / CENTS
+
+
+def round_cents(amounts):
+    '''
+    Rounds dollar amounts to the cent in bulk, same result as `np.round(amount, 2)` on each.
+    NOTE: Not always `round(amount, 2)` on Python floats, which rounds the exact decimal value:
+    79740.425 gives 79740.42 here and 79740.43 there.
+    '''
+    return from_cents(to_cents(amounts))
+
+
+def sum_cents(amounts, axis=None):
+    '''
+    Sums dollar amounts to the cent: every amount is rounded to int64 cents before the
+    sum, so the total is exact whatever the number of amounts and their order
+    '''
+    return from_cents(to_cents(amounts).sum(axis=axis))
@@ -35,7 +35,8 @@ class DayOffset(Enum):
     SEMIMONTHLY = 15
     BIWEEKLY = 14
     WEEKLY = 7
-    
 
-    
-    
\ No newline at end of file
+
+# int8 codes of the frequencies in compact loan tapes, the position of each member
+PAYMENT_FREQUENCY_CODES = {frequency.name: code for code, frequency in enumerate(PaymentFrequency)}
+COMPOUND_FREQUENCY_CODES = {frequency.name: code for code, frequency in enumerate(CompoundFrequency)}
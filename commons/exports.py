@@ -0,0 +1,78 @@
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def iter_csv(frames):
+    '''
+    Yields a CSV file, header first, as each DataFrame chunk of `frames` is generated
+    '''
+    header = True
+    for df in frames:
+        yield df.to_csv(index=False, header=header).encode()
+        header = False
+
+
+def iter_xlsx(sheets):
+    '''
+    Writes `sheets`, a list of (sheet name, DataFrame chunks) pairs, with an
+    openpyxl write-only workbook and yields the finished file in blocks.
+    Rows are spooled to disk while the workbook is written, so memory stays flat,
+    but nothing is yielded before the last row: openpyxl only assembles the xlsx
+    zip when the workbook is saved.
+    '''
+    workbook = Workbook(write_only=True)
+
+    for name, frames in sheets:
+        worksheet = workbook.create_sheet(name)
+        header = True
+        for df in frames:
+            if header:
+                worksheet.append(list(df.columns))
+                header = False
+
+            for row in df.itertuples(index=False, name=None):
+                worksheet.append(row)
+
+    with tempfile.SpooledTemporaryFile(max_size=STREAM_BLOCK_SIZE * 16) as file:
+        workbook.save(file)
+        file.seek(0)
+
+        while block := file.read(STREAM_BLOCK_SIZE):
+            yield block
+
+
+def save_frame_npz(path, df):
+    '''
+    Saves a DataFrame column by column into an npz file, text columns as unicode arrays
+    '''
+    arrays = {f"column_{i}": np.asarray(df[column].to_numpy(), dtype=str)
+              if df[column].dtype == object else df[column].to_numpy()
+              for i, column in enumerate(df.columns)}
+
+    # Written next to the target and renamed, so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        np.savez(file, columns=np.asarray(df.columns, dtype=str), **arrays)
+
+    os.replace(tmp_path, path)
+
+
+def load_frame_npz(path):
+    '''
+    Loads a DataFrame saved with `save_frame_npz`
+    '''
+    with np.load(path, allow_pickle=False) as data:
+        df = pd.DataFrame({column: data[f"column_{i}"] for i, column in enumerate(data['columns'])})
+
+    for column in df.columns:
+        if df[column].dtype.kind == 'U':
+            df[column] = df[column].astype(object)
+
+    return df
@@ -3,14 +3,21 @@ import numpy as np
 import numpy_financial as npf
 import calendar
 import datetime
+import functools
+import openpyxl
 from datetime import timedelta
+from itertools import islice
 from typing import Iterator, Tuple
 from dateutil.relativedelta import relativedelta
 from dateutil.rrule import rrule, DAILY, WEEKLY, MONTHLY
 from amortization.amount import calculate_amortization_amount
 from .constants import CompoundFrequency, PaymentFrequency, MonthOffset, DayOffset
+from .tape import frequency_names
+from .cents import round_cents
+from .instrumentation import timed
 
 
+@timed()
 def conver_file_to_dataframe(file):
     '''
     Convert file into Pandas Dataframe
@@ -25,6 +32,67 @@ def conver_file_to_dataframe(file):
     return df
 
 
+def iter_file_chunks(file, chunk_size=10000):
+    '''
+    Reads an xlsx or csv file and yields it as Pandas Dataframes of at most `chunk_size` rows,
+    so the whole file is never held in memory.
+    '''
+    file_ext = str(file).split(".")[-1]
+    if file_ext == "xlsx":
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, ())
+            rows = (row for row in rows if any(value is not None for value in row))
+            
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                
+                yield pd.DataFrame(chunk, columns=header)
+        finally:
+            workbook.close()
+    
+    if file_ext == "csv":
+        yield from pd.read_csv(file, chunksize=chunk_size)
+
+
+def convert_loan_tape(df, fields):
+    '''
+    Converts an uploaded loan tape into model field columns in one pass per column.
+    `fields` maps each model field to a (file column, type) pair where type is one of
+    "int", "float", "date" or "str". Returns the converted dataframe and the number of
+    rejected rows (missing or invalid values).
+    '''
+    df = df.rename(columns=lambda column: str(column).strip())
+    converted = pd.DataFrame(index=df.index)
+
+    for field, (column, kind) in fields.items():
+        values = df[column.strip()] if column.strip() in df else pd.Series(np.nan, index=df.index)
+
+        if kind == "int":
+            values = pd.to_numeric(values, errors='coerce')
+            values = values.where(values % 1 == 0)
+        elif kind == "float":
+            values = pd.to_numeric(values, errors='coerce').astype(float)
+        elif kind == "date":
+            values = pd.to_datetime(values, errors='coerce').dt.date
+        else:
+            values = values.astype("string").str.strip().replace("", pd.NA)
+
+        converted[field] = values
+
+    valid = converted.notna().all(axis=1)
+    converted = converted[valid]
+
+    for field, (_, kind) in fields.items():
+        if kind == "int":
+            converted[field] = converted[field].astype(np.int64)
+
+    return converted, int((~valid).sum())
+
+
 def get_days_in_month(year, month):
     '''
     returns a tuple (weekday of first day, number of days in month)
@@ -41,10 +109,17 @@ def get_next_schedule_date(start_date: str, interval):
     return new_date_str
 
 
+@timed()
 def prepare_calculated_loan_details(loans):
 
-    loans_df = pd.DataFrame.from_records(loans)
-    
+    return calculate_loan_details(pd.DataFrame.from_records(loans))
+
+
+def calculate_loan_details(loans_df):
+    '''
+    Adds the calculated factors (monthly rate, pmt, SMM) to a DataFrame of saved
+    simplified loans, whose rates are converted to percents in place
+    '''
     loans_df['interest_rate'] = loans_df['interest_rate'] * 100
     loans_df['cpr'] = loans_df['cpr'] * 100
 
@@ -60,10 +135,12 @@ def prepare_calculated_loan_details(loans):
     return loans_df
 
 
-def make_payment(period, principal, pmt, mpr, smm, rate, start_date, interval):
+def make_payment(period, principal, pmt, mpr, smm, rate, monthly_rate, payment_date):
     '''
     Makes a 'payment' by subtracting and updated payment amount from the
-    principal. Returns the principal remaining, and the amount of principal and interest paid
+    principal. Returns the principal remaining, and the amount of principal and interest paid.
+    Only the remaining principal is rounded here, the other amounts are rounded to the
+    cent in bulk by `create_amortization_schedule`.
     '''
     closing_bal = principal
     current_interest_payment = principal * mpr
@@ -72,49 +149,29 @@ def make_payment(period, principal, pmt, mpr, smm, rate, start_date, interval):
     current_principal_payment = (payment + prepayment) - current_interest_payment
     principal -= current_principal_payment
     period += 1
-    
-    new_date_str = get_next_schedule_date(start_date, interval)
 
     return [period,
-            new_date_str,
-            round(closing_bal, 2),
+            payment_date,
+            closing_bal,
             payment,
             prepayment,
             rate,
-            round(mpr * 100,2),
-            round(current_interest_payment, 2),
-            round(current_principal_payment, 2), 
+            monthly_rate,
+            current_interest_payment,
+            current_principal_payment, 
             round(principal, 2)] 
 
 
+# Columns of the amortization rows rounded to the cent after the schedule is stepped
+ROUNDED_SCHEDULE_COLUMNS = [2, 7, 8]
+
+
+@timed()
 def create_amortization_schedule(loan_info):
     '''
     Returns an Amortization Table in the form of a DataFrame
     '''
-    principal = loan_info['loan_amount'].values[0]
-    term_remaining = loan_info['term'].values[0]
-    pmt = loan_info['pmt'].values[0]
-    mpr = loan_info['monthly_interest_rate'].values[0] / 100
-    smm = loan_info['smm'].values[0] / 100
-    rate = loan_info['interest_rate'].values[0]
-    start_date = loan_info['start_date'].values[0].strftime("%d/%m/%Y")
-    interval = loan_info['payment_frequency'].values[0].lower()
-
-    # Period 0 data
-    payments = [[0, start_date, 0, 0, 0, 0, 0, 0, 0, principal]]
-    total_interest = 0
-    period = 0
-    
-    while principal > 0 and term_remaining > 0:
-        payment = make_payment(period, principal, pmt, mpr, smm, rate, start_date, interval)
-        period=payment[0]
-        principal = payment[-1]
-        start_date = payment[1]
-        term_remaining -= 1
-        total_interest += payment[2]
-        payments.append(payment)
-
-    amortization_table = pd.DataFrame(data=payments,
+    amortization_table = pd.DataFrame(data=list(iter_amortization_schedule(loan_info)),
                                         columns=["Period",
                                                  "Date",
                                                 "Principal Remaining",
@@ -125,10 +182,40 @@ def create_amortization_schedule(loan_info):
                                                 "Interest",
                                                 "Principal",
                                                 "Closing Ballance"])
+    rounded = amortization_table.columns[ROUNDED_SCHEDULE_COLUMNS]
+    amortization_table[rounded] = round_cents(amortization_table[rounded])
+    amortization_table['Date'] = format_schedule_dates(amortization_table['Date'])
         
     return amortization_table
 
 
+def iter_amortization_schedule(loan_info):
+    '''
+    Yields the rows of `create_amortization_schedule`, before their opening balance,
+    interest and principal are rounded
+    '''
+    principal = loan_info['loan_amount'].values[0]
+    term_remaining = loan_info['term'].values[0]
+    pmt = loan_info['pmt'].values[0]
+    mpr = loan_info['monthly_interest_rate'].values[0] / 100
+    smm = loan_info['smm'].values[0] / 100
+    rate = loan_info['interest_rate'].values[0]
+    monthly_rate = round(mpr * 100, 2)
+    start_date = loan_info['start_date'].values[0]
+    interval = loan_info['payment_frequency'].values[0]
+    payment_dates = generate_schedule_dates(start_date, interval, term_remaining)
+
+    # Period 0 data
+    yield [0, to_date(start_date), 0, 0, 0, 0, 0, 0, 0, principal]
+    period = 0
+    
+    while principal > 0 and period < term_remaining:
+        payment = make_payment(period, principal, pmt, mpr, smm, rate, monthly_rate, payment_dates[period])
+        period = payment[0]
+        principal = payment[-1]
+        yield payment
+
+
 def generate_dates(start_date, interval='daily'):
     """
     Generate dates based on a starting date and interval type (daily or bi-weekly).
@@ -172,6 +259,96 @@ def generate_dates(start_date, interval='daily'):
     return current_date.strftime("%d/%m/%Y")
 
 
+def to_date(value):
+    '''
+    Normalizes a date, datetime, Timestamp or numpy datetime64 into a datetime.date
+    '''
+    if isinstance(value, np.datetime64):
+        return value.astype('datetime64[D]').item()
+    
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    
+    return value
+
+
+def get_frequency_name(frequency):
+    '''
+    Returns the enum member name of a frequency, e.g. "Semi-Monthly" -> "SEMIMONTHLY"
+    '''
+    if isinstance(frequency, PaymentFrequency):
+        return frequency.name
+    
+    # int8 code of a compact loan tape
+    if isinstance(frequency, (int, np.integer)):
+        return list(PaymentFrequency)[frequency].name
+    
+    return str(frequency).replace("-", "").upper()
+
+
+def generate_schedule_dates(start_date, frequency, n_periods):
+    '''
+    Returns the `n_periods` payment dates following `start_date` as a
+    read-only datetime64[D] array. Results are cached per
+    (start_date, frequency, n_periods).
+    '''
+    return _generate_schedule_dates(to_date(start_date), get_frequency_name(frequency), int(n_periods))
+
+
+@functools.lru_cache(maxsize=4096)
+def _generate_schedule_dates(start_date, frequency, n_periods):
+    if frequency not in PaymentFrequency.__members__:
+        raise ValueError(f"Invalid payment frequency '{frequency}'.")
+    
+    steps = np.arange(1, max(n_periods, 0) + 1)
+    start = np.datetime64(start_date, 'D')
+    month_offset = MonthOffset[frequency].value
+    day_offset = DayOffset[frequency].value
+    
+    # NOTE: generate_dates has always moved bi-weekly schedules one week at a time,
+    # keep it that way so both paths produce the same dates.
+    if frequency == PaymentFrequency.BIWEEKLY.name:
+        day_offset = 7
+
+    if month_offset:
+        # Adding months one period at a time clamps the day to the shortest month seen so far
+        months = start.astype('datetime64[M]') + steps * month_offset
+        days_in_month = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(int)
+        days = np.minimum.accumulate(np.minimum(days_in_month, start_date.day))
+        dates = months.astype('datetime64[D]') + (days - 1)
+    else:
+        dates = start + steps * day_offset
+    
+    dates.setflags(write=False)
+    return dates
+
+
+def format_schedule_dates(dates, date_format="%d/%m/%Y"):
+    '''
+    Formats an array of schedule dates into strings for display and export
+    '''
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    
+    # Formats made only of %Y, %m, %d and separators are assembled from the ISO
+    # date bytes, which is much faster than strftime on every date.
+    iso = np.datetime_as_string(dates, unit='D').astype('S10').view(np.uint8).reshape(-1, 10)
+    fields = {'Y': iso[:, 0:4], 'm': iso[:, 5:7], 'd': iso[:, 8:10]}
+    pieces = []
+    tokens = iter(date_format)
+    for token in tokens:
+        if token == '%':
+            token = next(tokens, '')
+            if token not in fields:
+                return pd.DatetimeIndex(dates).strftime(date_format).to_numpy(dtype=object)
+            pieces.append(fields[token])
+        else:
+            pieces.append(np.full((len(iso), 1), ord(token), dtype=np.uint8))
+    
+    formatted = np.ascontiguousarray(np.concatenate(pieces, axis=1))
+    return formatted.view(f"S{formatted.shape[1]}").ravel().astype(str).astype(object)
+
+
+@timed()
 def prepare_modified_calculated_loan_details(loans):
     '''
     Generate the calculated factors for modified loans
@@ -201,6 +378,50 @@ def prepare_modified_calculated_loan_details(loans):
     return loans_df, details_df
 
 
+@timed()
+def prepare_modified_loan_tape(loans):
+    '''
+    Batch version of `prepare_modified_calculated_loan_details`: returns the loans
+    (records or DataFrame) with their calculated factors as extra columns, all
+    loans computed in one pass per column
+    '''
+    tape_df = pd.DataFrame.from_records(loans)
+    if tape_df.empty:
+        return tape_df
+    
+    compounding_frequency = _frequency_values(_frequency_names(tape_df['compounding_frequency'], CompoundFrequency), CompoundFrequency)
+    payment_frequency = _frequency_names(tape_df['payment_frequency'], PaymentFrequency)
+    
+    tape_df['compounding_period'] = compounding_frequency
+    tape_df['periods_per_year'] = _frequency_values(payment_frequency, PaymentFrequency)
+    tape_df['interest_rate_perpayment'] = np.round(((1+( tape_df['interest_rate'] / tape_df['compounding_period'])) ** 
+                                                   (tape_df['compounding_period'] / tape_df['periods_per_year']))-1, 5) * 100
+    tape_df['renewal_period'] = (tape_df['mortgage_term_month']/12) * tape_df['periods_per_year']
+    tape_df['amortization_period'] = (tape_df['amortization_term_month']/12) * tape_df['compounding_period']
+    tape_df['payment_per_period'] = np.round(-npf.pmt( (tape_df['interest_rate'] / 12), tape_df['amortization_period'], tape_df['original_principal']), 2)
+    tape_df['smm'] = np.round(tape_df['cpr'] / tape_df['compounding_period'], 5) * 100
+    tape_df['month_offset'] = _frequency_values(payment_frequency, MonthOffset)
+    tape_df['day_offset'] = _frequency_values(payment_frequency, DayOffset)
+    
+    return tape_df
+
+
+def _frequency_names(frequencies, enum):
+    # NOTE: Compact loan tapes hold int8 codes, the position of the member in `enum`
+    if pd.api.types.is_integer_dtype(frequencies):
+        return pd.Series(frequency_names(frequencies.to_numpy(), enum), index=frequencies.index)
+    
+    return frequencies.str.replace("-", "").str.upper()
+
+
+def _frequency_values(frequencies, enum):
+    values = frequencies.map({name: member.value for name, member in enum.__members__.items()})
+    if values.isna().any():
+        raise ValueError(f"Invalid frequency '{frequencies[values.isna()].iloc[0]}'.")
+    
+    return values.astype(np.int64)
+
+
 def amortization_schedule(loans_info: pd.DataFrame, additional_details_df: pd.DataFrame) -> Iterator[Tuple[int, float, float, float, float]]:
     """
     Generates amortization schedule
@@ -210,7 +431,7 @@ def amortization_schedule(loans_info: pd.DataFrame, additional_details_df: pd.Da
     :param payment_frequency: Payment frequency per year
     :return: Rows containing period, amount, interest, principal, balance, etc
     """
-    start_date = loans_info['start_date'].values[0].strftime("%d/%m/%Y")
+    start_date = loans_info['start_date'].values[0]
     principal = loans_info['original_principal'].values[0]
     interest_rate = loans_info['interest_rate'].values[0]
     period = loans_info['amortization_term_month'].values[0]
@@ -224,12 +445,13 @@ def amortization_schedule(loans_info: pd.DataFrame, additional_details_df: pd.Da
     payment = amortization_amount
     adjusted_interest = interest_rate / frequency.value
     balance = principal
+    payment_dates = generate_schedule_dates(start_date, frequency, period)
     
     for number in range(1, period + 1):
         interest = round(balance * adjusted_interest, 2)
         opening_balance = balance
         if balance > 0:
-            next_schedule_str = get_next_schedule_date(start_date, payment_frequency.lower())
+            payment_date = payment_dates[number - 1]
             amortization_amount = min(amortization_amount, opening_balance)
             prepayment = 0 if payment  > amortization_amount else balance * smm
             principal = amortization_amount - interest if opening_balance > amortization_amount else opening_balance
@@ -237,11 +459,11 @@ def amortization_schedule(loans_info: pd.DataFrame, additional_details_df: pd.Da
             balance -= principal_amount
             payment = min(amortization_amount, (principal + interest))
             maturity = 0 if number != renewal_period else balance 
-            start_date = next_schedule_str
             
-            yield number, next_schedule_str, opening_balance, amortization_amount, interest, prepayment, principal_amount, balance, maturity
+            yield number, payment_date, opening_balance, amortization_amount, interest, prepayment, principal_amount, balance, maturity
             
             
+@timed()
 def create_periodic_amortization(loans_df, additional_details_df):
     '''
     Generate the period schedule of the loan.
@@ -249,90 +471,79 @@ def create_periodic_amortization(loans_df, additional_details_df):
     table = (x for x in amortization_schedule(loans_df, additional_details_df))
     
     t = list(table)
-    f = [0, loans_df['start_date'].values[0].strftime("%d/%m/%Y"), 0, 0, 0, 0, 0, loans_df['original_principal'].values[0], 0 ]
+    f = [0, to_date(loans_df['start_date'].values[0]), 0, 0, 0, 0, 0, loans_df['original_principal'].values[0], 0 ]
     t.insert(0, f)
     df = pd.DataFrame(t, columns=["Period", "Date", "Opening Balance",  "Amount", "Interest", "Prepayment" , "Principal", "Closing Balance", "Maturity"])
+    df['Date'] = format_schedule_dates(df['Date'])
     df['Principal'] = df['Principal'] - df['Prepayment']    
     
     return df.head(int(additional_details_df['renewal_period'].values) + 1 )
 
 
+@timed()
 def convert_to_monthly_amortization(df, additional_df):
     df['payment_frequency'] = 'Monthly'
     return create_periodic_amortization(df, additional_df)
     
 
+@timed()
 def convert_to_daily_amortization(df):
-    # List to hold the transformed rows
-    daily_schedule = []
-    date_obj = df["Date"].values[0]
-    
-    # Start date of the first period
-    start_date = datetime.datetime.strptime(date_obj, "%d/%m/%Y")
-    days_in_month = get_days_in_month(start_date. year, start_date.month)
-    
-    # Iterate over each period in the original dataframe
-    for idx, row in df.iterrows():
-        # Period and opening balance from original dataframe
-        period = row['Period']
-        opening_balance = row['Opening Balance']
-        
-        # Payment, interest, principal, prepayment, and closing balance from the original row
-        amount = row['Amount']
-        interest = row['Interest']
-        prepayment = row['Prepayment']
-        principal = row['Principal']
-        closing_balance = row['Closing Balance']
-        
-        # Iterate over the days in this period (start from 0, as we create daily rows)
-        for day in range(days_in_month + 1):  # assuming a 30-day period for simplicity; adjust based on real periods
-            date = start_date + timedelta(days=day)
-            
-            # Day of the month
-            day_of_month = date.day
-            
-            # Calculate Year-Month format (e.g., '2024-01')
-            year_month = date.strftime("%Y-%m")
-            
-            # Calculate closing balance after applying principal and prepayment (after the last period)
-            if day == days_in_month:  # last day of this period
-                closing_balance = opening_balance - (principal + prepayment)
+    '''
+    Expands a periodic amortization schedule into one row per calendar day.
+    Period p runs from its payment date up to the next payment date, where the next
+    period's payment, interest, principal and prepayment are shown.
+    '''
+    return _expand_daily_amortization(df, first_period=True)
 
-            # Calculate maturity for the last day
-            maturity = 0 if closing_balance <= 0 else closing_balance
-            
-            # Create a daily entry for the amortization schedule
-            if day == days_in_month:
-                index = idx + 1 if idx + 1 < len(df) else idx
-                row = df.iloc[index].to_dict()
-                amount = row['Amount']
-                interest = row['Interest']
-                prepayment = row['Prepayment']
-                principal = row['Principal']
-                closing_balance = row['Closing Balance']
-
-            daily_schedule.append({
-                'Period': period,
-                'Day': day,
-                'Year-Month': year_month,
-                'date': date.strftime("%m/%d/%Y"),
-                'opening_balance': opening_balance,
-                'payment': amount if day == days_in_month else 0,  # only show payment on last day of the period
-                'interest': interest if day == days_in_month else 0,  # interest only on last day
-                'principal': principal if day == days_in_month else 0,  # principal only on last day
-                'prepayment': prepayment if day == days_in_month else 0,  # prepayment only on last day
-                'new_origination': 0,  # Assuming no new origination in the example
-                'maturity': maturity,
-                'closing_balance': closing_balance
-            })
-            
-            # Update the opening balance for the next day (based on the amount paid)
-            opening_balance = closing_balance
-            
-        # Move the start date to the next period
-        start_date = date + timedelta(days=1)
+
+def iter_daily_amortization(df, chunk_periods=120):
+    '''
+    Yields the daily amortization schedule `chunk_periods` periods at a time
+    '''
+    for start in range(0, max(len(df) - 1, 0), chunk_periods):
+        yield _expand_daily_amortization(df.iloc[start:start + chunk_periods + 1], first_period=start == 0)
+
+
+def _expand_daily_amortization(df, first_period):
+    dates = pd.to_datetime(df['Date'], format="%d/%m/%Y").to_numpy().astype('datetime64[D]')
+    periods = len(df) - 1
+    
+    # Day 0 of the first period is the start date, later periods start the day after a payment
+    starts = dates[:-1] + ((np.arange(periods) > 0) | (not first_period))
+    lengths = np.maximum((dates[1:] - starts).astype(np.int64) + 1, 0)
+    
+    index = np.repeat(np.arange(periods), lengths)
+    day = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    last_day = day == lengths[index] - 1
+    days = starts[index] + day
+    
+    current = df.iloc[:-1]
+    following = df.iloc[1:]
+    
+    def column(frame, name):
+        return frame[name].to_numpy()[index]
+    
+    opening_balance = np.where(day == 0, column(current, 'Opening Balance'), column(current, 'Closing Balance'))
+    closing_balance = np.where(last_day, column(following, 'Closing Balance'), column(current, 'Closing Balance'))
+    
+    # NOTE: On the last day the maturity is the opening balance less the period's principal and prepayment
+    maturity = np.where(last_day, 
+                        opening_balance - (column(current, 'Principal') + column(current, 'Prepayment')),
+                        column(current, 'Closing Balance'))
     
-    # Convert the list of daily entries to a DataFrame
-    daily_df = pd.DataFrame(daily_schedule)
+    daily_df = pd.DataFrame({
+        'Period': column(current, 'Period'),
+        'Day': day,
+        'Year-Month': format_schedule_dates(days, "%Y-%m"),
+        'date': format_schedule_dates(days, "%m/%d/%Y"),
+        'opening_balance': opening_balance,
+        'payment': np.where(last_day, column(following, 'Amount'), 0),  # only show payment on last day of the period
+        'interest': np.where(last_day, column(following, 'Interest'), 0),  # interest only on last day
+        'principal': np.where(last_day, column(following, 'Principal'), 0),  # principal only on last day
+        'prepayment': np.where(last_day, column(following, 'Prepayment'), 0),  # prepayment only on last day
+        'new_origination': 0,  # Assuming no new origination in the example
+        'maturity': np.where(maturity > 0, maturity, 0),
+        'closing_balance': closing_balance
+    })
     
     return daily_df
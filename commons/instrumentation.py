@@ -0,0 +1,179 @@
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+
+
+# Durations kept per stage for the percentiles
+SAMPLES_PER_STAGE = 1000
+
+_enabled = False
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def configure(enabled):
+    '''
+    Turns the recording of stages on or off. When off, `stage` and `timed` cost one flag check.
+    '''
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+class StageMetrics():
+    '''
+    Process-wide durations and row counts of every stage, the last
+    SAMPLES_PER_STAGE durations of each kept for the percentiles
+    '''
+
+    def __init__(self, samples=SAMPLES_PER_STAGE) -> None:
+        self.samples = samples
+        self._stages = {}
+        self._lock = threading.Lock()
+
+
+    def record(self, name, seconds, rows=None):
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {'count': 0, 'rows': 0, 'durations': deque(maxlen=self.samples)}
+            stage['count'] += 1
+            stage['rows'] += rows or 0
+            stage['durations'].append(seconds)
+
+
+    def summary(self):
+        '''
+        Returns {stage: {count, rows, p50_ms, p95_ms, max_ms}}
+        '''
+        # NOTE: Imported here, timing the stages must not load numpy at startup
+        import numpy as np
+
+        with self._lock:
+            stages = {name: (stage['count'], stage['rows'], np.asarray(stage['durations']))
+                      for name, stage in self._stages.items()}
+
+        summary = {}
+        for name, (count, rows, durations) in sorted(stages.items()):
+            p50, p95 = np.percentile(durations, [50, 95]) * 1000
+            summary[name] = {'count': count,
+                             'rows': rows,
+                             'p50_ms': round(float(p50), 3),
+                             'p95_ms': round(float(p95), 3),
+                             'max_ms': round(float(durations.max()) * 1000, 3)}
+        return summary
+
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+
+metrics = StageMetrics()
+
+
+class stage():
+    '''
+    Context manager timing a block as stage `name`. Set `.rows` inside the block
+    to record how many rows it handled.
+
+        with stage('to_html') as timing:
+            html = df.to_html()
+            timing.rows = len(df)
+    '''
+    __slots__ = ('name', 'rows', 'started')
+
+    def __init__(self, name, rows=None) -> None:
+        self.name = name
+        self.rows = rows
+        self.started = None
+
+
+    def __enter__(self):
+        if _enabled:
+            self.started = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        if self.started is not None:
+            record_stage(self.name, time.perf_counter() - self.started, self.rows)
+
+
+def timed(name=None):
+    '''
+    Decorator recording every call of a function as a stage, by default named
+    <module>.<qualified name>, with the length of the returned table as rows
+    '''
+    def decorator(function):
+        stage_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+
+            started = time.perf_counter()
+            result = function(*args, **kwargs)
+            record_stage(stage_name, time.perf_counter() - started, _count_rows(result))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def record_stage(name, seconds, rows=None):
+    metrics.record(name, seconds, rows)
+
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds, rows))
+
+
+def start_request():
+    '''
+    Starts collecting the stages of the current request (or task), returns the token for `finish_request`
+    '''
+    return _request_stages.set([])
+
+
+def finish_request(token):
+    '''
+    Stops collecting and returns the stages of the request as {name: (seconds, rows, calls)}
+    '''
+    stages = _request_stages.get() or []
+    _request_stages.reset(token)
+
+    totals = {}
+    for name, seconds, rows in stages:
+        total_seconds, total_rows, calls = totals.get(name, (0, None, 0))
+        if rows is not None:
+            total_rows = (total_rows or 0) + rows
+        totals[name] = (total_seconds + seconds, total_rows, calls + 1)
+    return totals
+
+
+def server_timing(stages):
+    '''
+    Formats request stages as a Server-Timing header value
+    '''
+    entries = []
+    for name, (seconds, rows, calls) in stages.items():
+        description = f"calls={calls}" if rows is None else f"rows={rows} calls={calls}"
+        entries.append(f'{name};dur={seconds * 1000:.2f};desc="{description}"')
+    return ", ".join(entries)
+
+
+def _count_rows(result):
+    # Methods returning (table, label) pairs count the table
+    if isinstance(result, tuple) and result:
+        result = result[0]
+
+    if isinstance(result, (str, bytes, dict)) or not hasattr(result, '__len__'):
+        return None
+    return len(result)
@@ -0,0 +1,232 @@
+'''
+Single-loan schedule kernel in plain Python. Only the standard library is imported,
+pandas is loaded when a caller asks for a DataFrame (`Schedule.to_frame`).
+Results are the same numbers as `create_amortization_schedule` and
+`create_periodic_amortization`, which build them through DataFrames.
+'''
+import calendar
+import datetime
+from array import array
+from .constants import PaymentFrequency, CompoundFrequency, MonthOffset, DayOffset
+
+
+def round_to(value, decimals=2):
+    '''
+    Rounds like `np.round`: scaled, rounded half to even, scaled back
+    '''
+    scale = 10.0 ** decimals
+    return round(value * scale) / scale
+
+
+def pmt(rate, nper, pv):
+    '''
+    `numpy_financial.pmt` for one loan, same floating point operations
+    '''
+    if rate == 0:
+        return -pv / nper
+
+    temp = (1 + rate) ** nper
+    fact = (1 + rate * 0) * (temp - 1) / rate
+    return -(0 + pv * temp) / fact
+
+
+def frequency_name(frequency):
+    '''
+    Returns the PaymentFrequency member name of a frequency name, code or member
+    '''
+    if isinstance(frequency, PaymentFrequency):
+        return frequency.name
+
+    if isinstance(frequency, int):
+        return list(PaymentFrequency)[frequency].name
+
+    name = str(frequency).replace("-", "").upper()
+    if name not in PaymentFrequency.__members__:
+        raise ValueError(f"Invalid payment frequency '{frequency}'.")
+
+    return name
+
+
+def schedule_dates(start_date, frequency, n_periods):
+    '''
+    Returns the `n_periods` payment dates following `start_date`, as `generate_schedule_dates`
+    '''
+    name = frequency_name(frequency)
+    month_offset = MonthOffset[name].value
+    # NOTE: Bi-weekly schedules move one week at a time, as generate_dates always did
+    day_offset = 7 if name == PaymentFrequency.BIWEEKLY.name else DayOffset[name].value
+
+    if not month_offset:
+        return [start_date + datetime.timedelta(days=day_offset * step) for step in range(1, n_periods + 1)]
+
+    # Adding months one period at a time clamps the day to the shortest month seen so far
+    dates = []
+    day = start_date.day
+    for step in range(1, n_periods + 1):
+        year, month = divmod(start_date.month - 1 + step * month_offset, 12)
+        year += start_date.year
+        day = min(day, calendar.monthrange(year, month + 1)[1])
+        dates.append(datetime.date(year, month + 1, day))
+
+    return dates
+
+
+class ScheduleRow():
+    '''
+    One period of a schedule. Subclasses name the fields in `__slots__` and the
+    matching DataFrame columns in `columns`.
+    '''
+    __slots__ = ()
+    columns = ()
+
+    def __init__(self, *values) -> None:
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class AmortizationRow(ScheduleRow):
+    __slots__ = ('period', 'date', 'principal_remaining', 'payment', 'prepayment', 'interest_rate',
+                 'monthly_interest_rate', 'interest', 'principal', 'closing_balance')
+    columns = ("Period", "Date", "Principal Remaining", "Payment", "Prepayment", "Interest Rate",
+               "Monthly Interest Rate", "Interest", "Principal", "Closing Ballance")
+
+
+class PeriodicRow(ScheduleRow):
+    __slots__ = ('period', 'date', 'opening_balance', 'amount', 'interest', 'prepayment',
+                 'principal', 'closing_balance', 'maturity')
+    columns = ("Period", "Date", "Opening Balance", "Amount", "Interest", "Prepayment",
+               "Principal", "Closing Balance", "Maturity")
+
+
+class Schedule():
+    '''
+    Rows of one loan's schedule. Columns are available as typed arrays, and as a
+    DataFrame (dates formatted dd/mm/yyyy) only when `to_frame` is called.
+    '''
+
+    def __init__(self, row_type, rows) -> None:
+        self.row_type = row_type
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def column(self, name):
+        '''
+        Values of a field, amounts as an array('d'), periods as an array('q')
+        '''
+        values = [getattr(row, name) for row in self.rows]
+        if name == 'date':
+            return values
+
+        return array('q' if name == 'period' else 'd', values)
+
+    def to_frame(self):
+        import pandas as pd
+
+        df = pd.DataFrame([list(row) for row in self.rows], columns=list(self.row_type.columns))
+        df['Date'] = [date.strftime("%d/%m/%Y") for date in df['Date']]
+        return df
+
+
+def simplified_schedule(loan_amount, interest_rate, start_date, term, payment_frequency, cpr,
+                        first_period=0, last_period=None, **loan):
+    '''
+    Returns the amortization schedule of a simplified loan from its saved fields
+    (rates as fractions), rows `first_period` to `last_period` only when given
+    '''
+    # Calculated factors of prepare_calculated_loan_details
+    rate = interest_rate * 100
+    monthly_interest_rate = round_to(rate / 12)
+    payment_amount = round_to(-pmt((rate / 100) / 12, term, loan_amount))
+    smm = round_to((1 - ((1 - (cpr * 100) / 100) ** (1 / 12))) * 100)
+
+    principal = loan_amount
+    mpr = monthly_interest_rate / 100
+    smm = smm / 100
+    monthly_rate = round_to(mpr * 100)
+    last_period = term if last_period is None else min(last_period, term)
+    dates = schedule_dates(start_date, payment_frequency, last_period)
+    rows = []
+
+    # Period 0 data
+    if first_period <= 0:
+        rows.append(AmortizationRow(0, start_date, 0, 0, 0, 0, 0, 0, 0, principal))
+    period = 0
+
+    while principal > 0 and period < last_period:
+        interest = principal * mpr
+        payment = min(payment_amount, (principal + interest))
+        prepayment = 0 if payment < payment_amount else principal * smm
+        principal_payment = (payment + prepayment) - interest
+        opening = principal
+        principal = round_to(principal - principal_payment)
+        period += 1
+
+        if period >= first_period:
+            rows.append(AmortizationRow(period, dates[period - 1], round_to(opening), payment, prepayment, rate,
+                                        monthly_rate, round_to(interest), round_to(principal_payment), principal))
+
+    return Schedule(AmortizationRow, rows)
+
+
+def modified_schedule(start_date, original_principal, amortization_term_month, mortgage_term_month, interest_rate,
+                      compounding_frequency, payment_frequency, cpr, first_period=0, last_period=None, **loan):
+    '''
+    Returns the periodic schedule of a modified loan, up to its renewal period,
+    from its saved fields, rows `first_period` to `last_period` only when given
+    '''
+    # Calculated factors of prepare_modified_calculated_loan_details
+    compounding_period = CompoundFrequency[compounding_frequency.replace("-", "").upper()].value
+    frequency = PaymentFrequency[payment_frequency.replace("-", "").upper()]
+    renewal_period = (mortgage_term_month / 12) * frequency.value
+    smm = (round_to(cpr / compounding_period, 5) * 100) / 100
+
+    # calculate_amortization_amount
+    adjusted_interest = interest_rate / frequency.value
+    x = (1 + adjusted_interest) ** amortization_term_month
+    amortization_amount = round_to(original_principal * (adjusted_interest * x) / (x - 1))
+
+    last_period = min(int(renewal_period), amortization_term_month, amortization_term_month if last_period is None else last_period)
+    dates = schedule_dates(start_date, frequency, last_period)
+    payment = amortization_amount
+    balance = original_principal
+    rows = []
+
+    # Period 0 data
+    if first_period <= 0:
+        rows.append(PeriodicRow(0, start_date, 0, 0, 0, 0, 0, original_principal, 0))
+
+    for number in range(1, last_period + 1):
+        if balance <= 0:
+            break
+
+        interest = round_to(balance * adjusted_interest)
+        opening_balance = balance
+        amortization_amount = min(amortization_amount, opening_balance)
+        prepayment = 0 if payment > amortization_amount else balance * smm
+        principal = amortization_amount - interest if opening_balance > amortization_amount else opening_balance
+        balance -= (principal + prepayment)
+        payment = min(amortization_amount, (principal + interest))
+        maturity = 0 if number != renewal_period else balance
+
+        if number >= first_period:
+            rows.append(PeriodicRow(number, dates[number - 1], opening_balance, amortization_amount, interest,
+                                    prepayment, (principal + prepayment) - prepayment, balance, maturity))
+
+    return Schedule(PeriodicRow, rows)
@@ -0,0 +1,527 @@
+import numpy as np
+import pandas as pd
+from .helpers import generate_schedule_dates, format_schedule_dates, to_date
+from .instrumentation import timed
+from .cents import to_cents, from_cents
+
+
+SCHEDULE_COLUMNS = ["Period",
+                    "Date",
+                    "Principal Remaining",
+                    "Payment",
+                    "Prepayment",
+                    "Interest Rate",
+                    "Monthly Interest Rate",
+                    "Interest",
+                    "Principal",
+                    "Closing Ballance"]
+
+
+def _step_portfolio(principal, term, pmt, mpr, smm):
+    '''
+    Steps every loan forward one period at a time following the rules of
+    `make_payment`. Yields, per period, the index of the loans still paying
+    and their (opening balance, payment, prepayment, interest, principal paid,
+    closing balance) arrays.
+    '''
+    balance = principal.astype(float)
+    active = np.flatnonzero((balance > 0) & (term > 0))
+    period = 0
+
+    while active.size:
+        period += 1
+        opening = balance[active]
+        loan_pmt = pmt[active]
+
+        interest = opening * mpr[active]
+        payment = np.minimum(loan_pmt, opening + interest)
+        prepayment = np.where(payment < loan_pmt, 0.0, opening * smm[active])
+        principal_payment = (payment + prepayment) - interest
+        closing = np.round(opening - principal_payment, 2)
+        balance[active] = closing
+
+        yield period, active, opening, payment, prepayment, interest, principal_payment, closing
+
+        active = active[(closing > 0) & (term[active] > period)]
+
+
+def _schedule_date_strings(start_dates, frequencies, counts):
+    '''
+    Formatted dates of every schedule row, origination first, for loans with
+    `counts` rows each. Dates only depend on the start date, frequency and number
+    of rows, so loans sharing those are built and formatted once.
+    '''
+    date_strings = {}
+    dates = []
+    for start_date, frequency, count in zip(start_dates, frequencies, counts):
+        key = (start_date, frequency, count)
+        if key not in date_strings:
+            payment_dates = generate_schedule_dates(start_date, frequency, count - 1)
+            date_strings[key] = format_schedule_dates(np.insert(payment_dates, 0, np.datetime64(to_date(start_date), 'D')))
+        dates.extend(date_strings[key])
+
+    return dates
+
+
+@timed()
+def create_portfolio_amortization_schedule(loans_df):
+    '''
+    Returns the amortization tables of every loan in a
+    `prepare_calculated_loan_details` dataframe as one long-format DataFrame,
+    with a leading `loan_number` column. Each loan's rows match the output of
+    `create_amortization_schedule`.
+    '''
+    n_loans = len(loans_df)
+    principal = loans_df['loan_amount'].to_numpy(dtype=float)
+    term = loans_df['term'].to_numpy(dtype=np.int64)
+    pmt = loans_df['pmt'].to_numpy(dtype=float)
+    mpr = loans_df['monthly_interest_rate'].to_numpy(dtype=float) / 100
+    smm = loans_df['smm'].to_numpy(dtype=float) / 100
+    rate = loans_df['interest_rate'].to_numpy(dtype=float)
+
+    # Period 0 data
+    loan_index = [np.arange(n_loans)]
+    periods = [np.zeros(n_loans, dtype=np.int64)]
+    zeros = np.zeros(n_loans)
+    columns = [[zeros], [zeros], [zeros], [zeros], [zeros], [zeros], [zeros], [principal]]
+
+    for period, active, opening, payment, prepayment, interest, principal_payment, closing in \
+            _step_portfolio(principal, term, pmt, mpr, smm):
+        loan_index.append(active)
+        periods.append(np.full(active.size, period, dtype=np.int64))
+        values = (np.round(opening, 2), payment, prepayment, rate[active],
+                  np.round(mpr[active] * 100, 2), np.round(interest, 2),
+                  np.round(principal_payment, 2), closing)
+        for column, value in zip(columns, values):
+            column.append(value)
+
+    loan_index = np.concatenate(loan_index)
+    periods = np.concatenate(periods)
+    order = np.argsort(loan_index, kind='stable')
+    loan_index = loan_index[order]
+    periods = periods[order]
+    counts = np.bincount(loan_index, minlength=n_loans)
+
+    dates = _schedule_date_strings(loans_df['start_date'].to_numpy(), loans_df['payment_frequency'].to_numpy(), counts)
+
+    schedule = pd.DataFrame({'loan_number': loans_df['loan_number'].to_numpy()[loan_index],
+                             SCHEDULE_COLUMNS[0]: periods,
+                             SCHEDULE_COLUMNS[1]: dates})
+    for name, column in zip(SCHEDULE_COLUMNS[2:], columns):
+        schedule[name] = np.concatenate(column)[order]
+
+    return schedule
+
+
+def portfolio_schedule_arrays(loans_df):
+    '''
+    Column arrays of `create_portfolio_amortization_schedule` without the DataFrame:
+    each row's loan index (sorted, so a loan's rows are contiguous), period, payment
+    day as days since epoch and the amounts of CONSOLIDATED_COLUMNS
+    '''
+    n_loans = len(loans_df)
+    principal = loans_df['loan_amount'].to_numpy(dtype=float)
+    term = loans_df['term'].to_numpy(dtype=np.int64)
+    pmt = loans_df['pmt'].to_numpy(dtype=float)
+    mpr = loans_df['monthly_interest_rate'].to_numpy(dtype=float) / 100
+    smm = loans_df['smm'].to_numpy(dtype=float) / 100
+    loan_dates, date_group = _portfolio_dates(loans_df)
+
+    # Period 0 data
+    loan_index = [np.arange(n_loans)]
+    periods = [np.zeros(n_loans, dtype=np.int64)]
+    zeros = np.zeros(n_loans)
+    columns = [[zeros], [zeros], [zeros], [zeros], [zeros], [principal]]
+
+    for period, active, opening, payment, prepayment, interest, principal_payment, closing in \
+            _step_portfolio(principal, term, pmt, mpr, smm):
+        loan_index.append(active)
+        periods.append(np.full(active.size, period, dtype=np.int64))
+        values = (np.round(opening, 2), payment, prepayment, np.round(interest, 2), np.round(principal_payment, 2), closing)
+        for column, value in zip(columns, values):
+            column.append(value)
+
+    loan_index = np.concatenate(loan_index)
+    order = np.argsort(loan_index, kind='stable')
+    loan_index = loan_index[order]
+    periods = np.concatenate(periods)[order]
+
+    arrays = {'loan_index': loan_index,
+              'period': periods,
+              'date': loan_dates[date_group[loan_index], periods]}
+    for name, column in zip(CONSOLIDATED_COLUMNS, columns):
+        arrays[name] = np.concatenate(column)[order]
+
+    return arrays
+
+
+def split_portfolio_schedule(schedule):
+    '''
+    Splits a long-format portfolio schedule into a dict of
+    {loan_number: amortization table}
+    '''
+    return {loan_number: table.drop('loan_number', axis=1).reset_index(drop=True)
+            for loan_number, table in schedule.groupby('loan_number', sort=False)}
+
+
+CONSOLIDATED_COLUMNS = ["Principal Remaining",
+                        "Payment",
+                        "Prepayment",
+                        "Interest",
+                        "Principal",
+                        "Closing Ballance"]
+
+
+@timed()
+def consolidate_portfolio_cash_flows(loans_df, until=None):
+    '''
+    Returns the cash flows of every loan in a `prepare_calculated_loan_details`
+    dataframe summed by payment date, without building each loan's schedule.
+    When `until` is given, loans are only simulated up to that date.
+    '''
+    if not len(loans_df):
+        return pd.DataFrame(columns=['Date'] + CONSOLIDATED_COLUMNS)
+
+    first_day, n_days = portfolio_day_range(loans_df)
+    totals = np.zeros((1, len(CONSOLIDATED_COLUMNS), n_days), dtype=np.int64)
+    payments = np.zeros((1, n_days), dtype=np.int64)
+    add_portfolio_cash_flows(totals, payments, loans_df, first_day, until=until)
+
+    return cash_flow_frame(totals[0], payments[0], first_day)
+
+
+def portfolio_day_range(loans_df):
+    '''
+    Returns the first payment day (days since epoch) of a portfolio and the
+    number of days up to its last scheduled payment
+    '''
+    loan_dates, _ = _portfolio_dates(loans_df)
+    scheduled = loan_dates[loan_dates < np.iinfo(np.int64).max]
+
+    return scheduled.min(), scheduled.max() - scheduled.min() + 1
+
+
+def add_portfolio_cash_flows(totals, payments, loans_df, first_day, groups=None, until=None):
+    '''
+    Steps every loan of a `prepare_calculated_loan_details` dataframe and adds
+    its cash flows to the (group, CONSOLIDATED_COLUMNS, day) int64 cents `totals`
+    and the (group, day) payment counts, days counted from `first_day`. Loans go to
+    group 0 unless `groups` gives each loan's group.
+    Amounts are rounded to the cent (`to_cents`) before they are added, so the totals
+    are exactly the sums of the schedules' cents however many loans are added.
+    '''
+    principal = loans_df['loan_amount'].to_numpy(dtype=float)
+    term = loans_df['term'].to_numpy(dtype=np.int64)
+    pmt = loans_df['pmt'].to_numpy(dtype=float)
+    mpr = loans_df['monthly_interest_rate'].to_numpy(dtype=float) / 100
+    smm = loans_df['smm'].to_numpy(dtype=float) / 100
+    groups = np.zeros(len(loans_df), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+
+    # Period k date of loan i is loan_dates[date_group[i], k], in days since epoch
+    loan_dates, date_group = _portfolio_dates(loans_df)
+
+    if until is not None:
+        # NOTE: Periods paid after `until` never reach the accumulators, so stop the loans there
+        until = np.datetime64(until, 'D').astype(np.int64)
+        term = np.minimum(term, (loan_dates <= until).sum(axis=1)[date_group] - 1)
+
+    # Accumulated through flat views, index of (group, column, day) is (group * columns + column) * days + day
+    n_columns, n_days = totals.shape[1:]
+    flat_totals = totals.reshape(-1)
+    flat_payments = payments.reshape(-1)
+
+    # Period 0 data
+    included = np.flatnonzero(term >= 0)
+    day = loan_dates[date_group[included], 0] - first_day
+    np.add.at(flat_totals, (groups[included] * n_columns + n_columns - 1) * n_days + day, to_cents(principal[included]))
+    np.add.at(flat_payments, groups[included] * n_days + day, 1)
+
+    for period, active, opening, payment, prepayment, interest, principal_payment, closing in \
+            _step_portfolio(principal, term, pmt, mpr, smm):
+        day = loan_dates[date_group[active], period] - first_day
+        index = groups[active] * n_columns * n_days + day
+        values = (opening, payment, prepayment, interest, principal_payment, closing)
+        for column, value in enumerate(values):
+            np.add.at(flat_totals, index + column * n_days, to_cents(value))
+        np.add.at(flat_payments, groups[active] * n_days + day, 1)
+
+
+def portfolio_cash_flow_changes(loans_df, new):
+    '''
+    Compares the cash flows of two versions of the same loans, stacked in one
+    `prepare_calculated_loan_details` dataframe with `new` telling the new rows from
+    the old ones. Returns the payment days (since epoch) where they differ, with the
+    (CONSOLIDATED_COLUMNS, day) differences in cents and the difference in payment counts.
+    Only these loans are stepped, so the cost does not depend on the rest of the portfolio.
+    '''
+    if not len(loans_df):
+        return np.zeros(0, dtype=np.int64), np.zeros((len(CONSOLIDATED_COLUMNS), 0), dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    first_day, n_days = portfolio_day_range(loans_df)
+    totals = np.zeros((2, len(CONSOLIDATED_COLUMNS), n_days), dtype=np.int64)
+    payments = np.zeros((2, n_days), dtype=np.int64)
+    add_portfolio_cash_flows(totals, payments, loans_df, first_day, groups=np.asarray(new, dtype=np.int64))
+
+    changes = totals[1] - totals[0]
+    payment_changes = payments[1] - payments[0]
+    days = np.flatnonzero(changes.any(axis=0) | (payment_changes != 0))
+
+    return days + first_day, changes[:, days], payment_changes[days]
+
+
+def cash_flow_frame(totals, payments, first_day):
+    '''
+    DataFrame of the (CONSOLIDATED_COLUMNS, day) cents `totals` on the days with payments, in dollars
+    '''
+    days = np.flatnonzero(payments)
+    consolidated = pd.DataFrame({'Date': format_schedule_dates(days + first_day, "%Y/%m/%d")})
+    for name, total in zip(CONSOLIDATED_COLUMNS, totals):
+        consolidated[name] = from_cents(total[days])
+
+    return consolidated
+
+
+def _portfolio_dates(loans_df):
+    '''
+    Returns the payment days (since epoch) of every period, one row per distinct
+    (start date, frequency, term), padded with the largest day, and each loan's row
+    '''
+    term = loans_df['term'].to_numpy(dtype=np.int64)
+    start_dates = loans_df['start_date'].to_numpy()
+    frequencies = loans_df['payment_frequency'].to_numpy()
+    groups = {}
+    date_group = np.empty(len(loans_df), dtype=np.int64)
+    for i, key in enumerate(zip(start_dates, frequencies, term)):
+        date_group[i] = groups.setdefault(key, len(groups))
+
+    # Padded with the largest day so missing periods never fall before `until`
+    loan_dates = np.full((len(groups), max(term.max(), 0) + 1), np.iinfo(np.int64).max)
+    for (start_date, frequency, periods), group in groups.items():
+        start = np.datetime64(to_date(start_date), 'D')
+        dates = np.insert(generate_schedule_dates(start, frequency, periods), 0, start)
+        loan_dates[group, :len(dates)] = dates.astype(np.int64)
+
+    return loan_dates, date_group
+
+
+# Periods before the end of the full-payment phase that are stepped exactly
+PAYOFF_MARGIN = 2
+
+
+def _closed_form_balance(principal, pmt, growth, periods):
+    '''
+    Balance after `periods` full payments: B_j = a^j * B_0 - pmt * (a^j - 1) / (a - 1),
+    with a = 1 + mpr - smm the per-period growth of the balance once the
+    interest is added and the constant SMM share is prepaid.
+    '''
+    rate = growth - 1
+    power = np.power(growth, periods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity = np.where(np.abs(rate) > 1e-12, np.expm1(periods * np.log(growth)) / rate, periods)
+
+    return power * principal - pmt * annuity
+
+
+def _full_payment_periods(principal, pmt, mpr, growth):
+    '''
+    Number of balances B_0..B_J, minus one, large enough for a full `pmt` payment,
+    i.e. the closed form holds for periods 1..J+1. Loans that never leave the
+    full-payment phase get a very large J.
+    '''
+    threshold = pmt / (1 + mpr)
+    rate = growth - 1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fixed_point = pmt / rate
+        ratio = (threshold - fixed_point) / (principal - fixed_point)
+        periods = np.where(np.abs(rate) > 1e-12,
+                           np.log(ratio) / np.log(growth),
+                           (principal - threshold) / pmt)
+
+    valid = np.isfinite(periods) & ((ratio > 0) | (np.abs(rate) <= 1e-12))
+    periods = np.where(valid, periods, np.inf)
+    periods = np.where(principal < threshold, -1, periods)
+
+    return np.floor(np.minimum(periods, np.iinfo(np.int32).max)).astype(np.int64)
+
+
+def portfolio_rows_at_periods(loans_df, periods, exact=False):
+    '''
+    Returns the schedule row (as in `create_amortization_schedule`) of period
+    `periods[i]` of every loan in a `prepare_calculated_loan_details` dataframe,
+    or of its last period if the loan ends before. Balances jump straight to
+    the period with the closed-form annuity balance under a constant SMM, and
+    only the last periods before payoff are stepped with the `make_payment` rules.
+    The closed form does not round the balance to cents every period, so
+    results can differ from the stepped schedule by a few cents (up to a dollar
+    or two late in a 30 year loan); `exact` steps every period instead.
+    '''
+    n_loans = len(loans_df)
+    principal = loans_df['loan_amount'].to_numpy(dtype=float)
+    term = loans_df['term'].to_numpy(dtype=np.int64)
+    pmt = loans_df['pmt'].to_numpy(dtype=float)
+    mpr = loans_df['monthly_interest_rate'].to_numpy(dtype=float) / 100
+    smm = loans_df['smm'].to_numpy(dtype=float) / 100
+    rate = loans_df['interest_rate'].to_numpy(dtype=float)
+    periods = np.minimum(np.asarray(periods, dtype=np.int64), np.maximum(term, 0))
+    growth = 1 + mpr - smm
+
+    # Jump to a period still safely inside the full-payment phase, then step exactly
+    start = np.clip(np.minimum(periods - 1, _full_payment_periods(principal, pmt, mpr, growth) - PAYOFF_MARGIN), 0, None)
+    if exact:
+        start = np.zeros(n_loans, dtype=np.int64)
+    balance = np.where(start > 0, np.round(_closed_form_balance(principal, pmt, growth, start), 2), principal)
+    period = start.copy()
+
+    rows = {column: np.zeros(n_loans) for column in SCHEDULE_COLUMNS[2:]}
+    rows['Closing Ballance'] = principal.copy()
+    rows['Period'] = np.zeros(n_loans, dtype=np.int64)
+
+    active = np.flatnonzero((periods > 0) & (balance > 0))
+    while active.size:
+        opening = balance[active]
+        loan_pmt = pmt[active]
+
+        interest = opening * mpr[active]
+        payment = np.minimum(loan_pmt, opening + interest)
+        prepayment = np.where(payment < loan_pmt, 0.0, opening * smm[active])
+        principal_payment = (payment + prepayment) - interest
+        closing = np.round(opening - principal_payment, 2)
+        balance[active] = closing
+        period[active] += 1
+
+        # Record the row of the target period, or of the payoff period
+        row = (period[active] == periods[active]) | (closing <= 0)
+        loans = active[row]
+        values = (np.round(opening, 2), payment, prepayment, rate[active], np.round(mpr[active] * 100, 2),
+                  np.round(interest, 2), np.round(principal_payment, 2), closing)
+        for name, value in zip(SCHEDULE_COLUMNS[2:], values):
+            rows[name][loans] = value[row]
+        rows['Period'][loans] = period[loans]
+
+        active = active[~row]
+
+    return rows
+
+
+@timed()
+def portfolio_positions(loans_df, date, exact=False):
+    '''
+    Returns, for every loan in a `prepare_calculated_loan_details` dataframe that
+    started on or before `date`, its schedule row at `date`: the last payment made
+    on or before it (period 0 before the first payment). Rows dated `date` are
+    that day's cash flows.
+    '''
+    date = np.datetime64(date, 'D')
+    columns = ['loan_number'] + SCHEDULE_COLUMNS
+
+    start_dates = np.asarray([np.datetime64(to_date(start_date), 'D') for start_date in loans_df['start_date']],
+                             dtype='datetime64[D]')
+    loans_df = loans_df[start_dates <= date]
+    if loans_df.empty:
+        return pd.DataFrame(columns=columns)
+
+    # Period of each loan at `date`, from its payment dates (shared by loans with the same dates)
+    schedule_dates = {}
+    keys = list(zip(loans_df['start_date'], loans_df['payment_frequency'], loans_df['term']))
+    for key in keys:
+        if key not in schedule_dates:
+            schedule_dates[key] = generate_schedule_dates(*key)
+    periods = np.asarray([np.searchsorted(schedule_dates[key], date, side='right') for key in keys])
+
+    rows = portfolio_rows_at_periods(loans_df, periods, exact)
+
+    dates = np.asarray([schedule_dates[key][period - 1] if period else np.datetime64(to_date(key[0]), 'D')
+                        for key, period in zip(keys, rows['Period'])], dtype='datetime64[D]')
+
+    positions = pd.DataFrame({'loan_number': loans_df['loan_number'].to_numpy(),
+                              'Period': rows.pop('Period'),
+                              'Date': format_schedule_dates(dates)})
+    for name in SCHEDULE_COLUMNS[2:]:
+        positions[name] = rows[name]
+
+    return positions[columns]
+
+
+PERIODIC_COLUMNS = ["Period",
+                    "Date",
+                    "Opening Balance",
+                    "Amount",
+                    "Interest",
+                    "Prepayment",
+                    "Principal",
+                    "Closing Balance",
+                    "Maturity"]
+
+
+@timed()
+def create_portfolio_periodic_amortization(tape_df):
+    '''
+    Returns the periodic schedules of every loan in a `prepare_modified_loan_tape`
+    dataframe as one long-format DataFrame with a leading `loan_id` column (the
+    loans' `id`). Each loan's rows match `create_periodic_amortization`: the
+    `amortization_schedule` rules applied to all loans at once, one period at a time.
+    '''
+    n_loans = len(tape_df)
+    principal = tape_df['original_principal'].to_numpy(dtype=float)
+    term = tape_df['amortization_term_month'].to_numpy(dtype=np.int64)
+    renewal_period = tape_df['renewal_period'].to_numpy(dtype=float)
+    periods_per_year = tape_df['periods_per_year'].to_numpy(dtype=np.int64)
+    interest_rate = tape_df['interest_rate'].to_numpy(dtype=float)
+    smm = tape_df['smm'].to_numpy(dtype=float) / 100
+
+    # calculate_amortization_amount, for every loan
+    adjusted_interest = interest_rate / periods_per_year
+    growth = (1 + adjusted_interest) ** term
+    amount = np.round(principal * (adjusted_interest * growth) / (growth - 1), 2)
+
+    # NOTE: create_periodic_amortization keeps the periods up to the renewal only
+    last_period = np.minimum(term, renewal_period.astype(np.int64))
+    balance = principal.copy()
+    payment = amount.copy()
+
+    # Period 0 data
+    loan_index = [np.arange(n_loans)]
+    periods = [np.zeros(n_loans, dtype=np.int64)]
+    zeros = np.zeros(n_loans)
+    columns = [[zeros], [zeros], [zeros], [zeros], [zeros], [principal], [zeros]]
+
+    active = np.flatnonzero((balance > 0) & (last_period > 0))
+    number = 0
+    while active.size:
+        number += 1
+        opening = balance[active]
+        interest = np.round(opening * adjusted_interest[active], 2)
+        amount[active] = np.minimum(amount[active], opening)
+        loan_amount = amount[active]
+        prepayment = np.where(payment[active] > loan_amount, 0.0, opening * smm[active])
+        principal_paid = np.where(opening > loan_amount, loan_amount - interest, opening)
+        principal_amount = principal_paid + prepayment
+        closing = opening - principal_amount
+        balance[active] = closing
+        payment[active] = np.minimum(loan_amount, principal_paid + interest)
+        maturity = np.where(number == renewal_period[active], closing, 0)
+
+        loan_index.append(active)
+        periods.append(np.full(active.size, number, dtype=np.int64))
+        values = (opening, loan_amount, interest, prepayment, principal_amount - prepayment, closing, maturity)
+        for column, value in zip(columns, values):
+            column.append(value)
+
+        active = active[(closing > 0) & (last_period[active] > number)]
+
+    loan_index = np.concatenate(loan_index)
+    periods = np.concatenate(periods)
+    order = np.argsort(loan_index, kind='stable')
+    loan_index = loan_index[order]
+    counts = np.bincount(loan_index, minlength=n_loans)
+
+    dates = _schedule_date_strings(tape_df['start_date'].to_numpy(), tape_df['payment_frequency'].to_numpy(), counts)
+
+    schedule = pd.DataFrame({'loan_id': tape_df['id'].to_numpy()[loan_index],
+                             PERIODIC_COLUMNS[0]: periods[order],
+                             PERIODIC_COLUMNS[1]: dates})
+    for name, column in zip(PERIODIC_COLUMNS[2:], columns):
+        schedule[name] = np.concatenate(column)[order]
+
+    return schedule
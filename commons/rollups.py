@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+from .helpers import format_schedule_dates
+from .portfolio import CONSOLIDATED_COLUMNS
+from .cents import to_cents, from_cents
+
+
+GRANULARITIES = ('day', 'month', 'quarter', 'year')
+
+# How the bucket of each granularity is shown in the 'Date' column
+BUCKET_FORMATS = {'day': "%Y/%m/%d", 'month': "%Y/%m", 'year': "%Y"}
+
+# Balances are not summed over a bucket, they are the balances of every loan at its start and end
+OPENING_COLUMN = CONSOLIDATED_COLUMNS.index("Principal Remaining")
+CLOSING_COLUMN = CONSOLIDATED_COLUMNS.index("Closing Ballance")
+
+
+def bucket_dates(days, granularity):
+    '''
+    Returns the first day of the bucket of each day (days since epoch or dates), as datetime64[D]
+    '''
+    dates = np.asarray(days).astype('datetime64[D]')
+
+    if granularity == 'day':
+        return dates
+    if granularity == 'month':
+        return dates.astype('datetime64[M]').astype('datetime64[D]')
+    if granularity == 'quarter':
+        # Months since 1970-01, so multiples of 3 are January, April, July and October
+        months = dates.astype('datetime64[M]').astype(np.int64)
+        return (months - months % 3).astype('datetime64[M]').astype('datetime64[D]')
+    if granularity == 'year':
+        return dates.astype('datetime64[Y]').astype('datetime64[D]')
+
+    raise ValueError(f"Invalid granularity '{granularity}', expected one of {', '.join(GRANULARITIES)}.")
+
+
+def rollup(days, totals, payments, granularity):
+    '''
+    Rolls the (CONSOLIDATED_COLUMNS, day) cents `totals` and the `payments` counts of
+    sorted `days`, from the first payment of the portfolio, up into buckets. The flows
+    and counts are summed. 'Principal Remaining' and 'Closing Ballance' are the balances
+    of every loan at the start and end of the bucket, paying in it or not.
+    Days are their own buckets: their rows are returned as they are.
+    Returns the buckets' first days, totals and counts.
+    '''
+    buckets = bucket_dates(days, granularity)
+    if not len(buckets) or granularity == 'day':
+        return buckets, totals, payments
+
+    # Days are sorted, so every bucket is a run of consecutive days
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    rolled = np.add.reduceat(totals, starts, axis=1)
+
+    # NOTE: Every schedule row opens with the closing balance of the loan's previous row (0 for the
+    # origination), so closing minus opening summed over a day is the change of the portfolio balance
+    changes = rolled[CLOSING_COLUMN] - rolled[OPENING_COLUMN]
+    rolled[CLOSING_COLUMN] = np.cumsum(changes)
+    rolled[OPENING_COLUMN] = rolled[CLOSING_COLUMN] - changes
+
+    return buckets[starts], rolled, np.add.reduceat(payments, starts)
+
+
+class CashFlowCube():
+    '''
+    Portfolio cash flows in int64 cents rolled up (see `rollup`) by day, month, quarter and year.
+    Built once from the daily totals, every level is then read without recomputing.
+    '''
+
+    def __init__(self, levels) -> None:
+        # {granularity: (bucket first days, (CONSOLIDATED_COLUMNS, bucket) totals, payments per bucket)}
+        self.levels = levels
+
+
+    @classmethod
+    def from_daily(cls, days, totals, payments):
+        '''
+        Builds every level from the totals of the sorted payment `days`
+        '''
+        return cls({granularity: rollup(days, totals, payments, granularity) for granularity in GRANULARITIES})
+
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            return cls({granularity: (saved[f"{granularity}_buckets"], saved[f"{granularity}_totals"],
+                                      saved[f"{granularity}_payments"])
+                        for granularity in GRANULARITIES})
+
+
+    def save(self, path):
+        arrays = {}
+        for granularity, (buckets, totals, payments) in self.levels.items():
+            arrays.update({f"{granularity}_buckets": buckets, f"{granularity}_totals": totals,
+                           f"{granularity}_payments": payments})
+
+        with open(path, 'wb') as file:
+            np.savez(file, **arrays)
+
+
+    def frame(self, granularity='day', date=None):
+        '''
+        Returns the cash flows of a level in the format of `consolidate_portfolio_cash_flows`,
+        only the bucket holding `date` when given
+        '''
+        if granularity not in self.levels:
+            raise ValueError(f"Invalid granularity '{granularity}', expected one of {', '.join(GRANULARITIES)}.")
+
+        buckets, totals, payments = self.levels[granularity]
+        if date is not None:
+            selected = buckets == bucket_dates([np.datetime64(date, 'D')], granularity)[0]
+            buckets, totals = buckets[selected], totals[:, selected]
+
+        consolidated = pd.DataFrame({'Date': bucket_labels(buckets, granularity)})
+        for name, total in zip(CONSOLIDATED_COLUMNS, totals):
+            consolidated[name] = from_cents(total)
+
+        return consolidated
+
+
+def bucket_labels(buckets, granularity):
+    '''
+    Formats the first days of buckets for display: 2024/01/31, 2024/01, 2024/Q1 or 2024
+    '''
+    if granularity != 'quarter':
+        return format_schedule_dates(buckets, BUCKET_FORMATS[granularity])
+
+    months = buckets.astype('datetime64[M]').astype(np.int64)
+    return [f"{1970 + month // 12}/Q{month % 12 // 3 + 1}" for month in months.tolist()]
+
+
+def rollup_cash_flows(consolidated, granularity, date=None):
+    '''
+    Rolls a `consolidate_portfolio_cash_flows` DataFrame (one row per day) up into buckets
+    (see `rollup`), only the bucket holding `date` when given
+    '''
+    days = np.array(consolidated['Date'].str.replace('/', '-'), dtype='datetime64[D]')
+    totals = to_cents(consolidated[CONSOLIDATED_COLUMNS].to_numpy(dtype=float).T)
+    payments = np.ones(len(days), dtype=np.int64)
+
+    return CashFlowCube({granularity: rollup(days, totals, payments, granularity)}).frame(granularity, date)
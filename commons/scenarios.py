@@ -0,0 +1,64 @@
+from itertools import product
+import numpy as np
+import pandas as pd
+from .helpers import calculate_loan_details
+from .instrumentation import timed
+from .portfolio import (
+    portfolio_day_range,
+    add_portfolio_cash_flows,
+    cash_flow_frame,
+    CONSOLIDATED_COLUMNS
+)
+
+
+def scenario_loans(loans_df, scenarios):
+    '''
+    Repeats the loans (as saved, before `calculate_loan_details`) once
+    per (CPR multiplier, rate shock) scenario with the CPR scaled (capped at 100%)
+    and the interest rate shifted (floored at 0), then prepares them with the
+    usual pmt/SMM formulas. Returns the loans and each row's scenario index.
+    '''
+    n_loans = len(loans_df)
+    multipliers = np.repeat([multiplier for multiplier, _ in scenarios], n_loans)
+    shocks = np.repeat([shock for _, shock in scenarios], n_loans)
+
+    shocked = pd.concat([loans_df] * len(scenarios), ignore_index=True)
+    shocked['cpr'] = np.clip(shocked['cpr'].to_numpy(dtype=float) * multipliers, 0, 1)
+    shocked['interest_rate'] = np.maximum(shocked['interest_rate'].to_numpy(dtype=float) + shocks, 0)
+
+    return calculate_loan_details(shocked), np.repeat(np.arange(len(scenarios)), n_loans)
+
+
+@timed()
+def scenario_cash_flows(loans, cpr_multipliers=(1,), rate_shocks=(0,), chunk_size=1000):
+    '''
+    Runs the loans (records or DataFrame as saved, e.g. LoanInput values) under every
+    combination of CPR multiplier and rate shock (added to the annual rate, 0.01 = +100bp)
+    and returns the cash flows summed by scenario and payment date.
+    Loans are processed `chunk_size` at a time, all scenarios of a chunk stepped together,
+    so memory depends on the chunk size and the number of days, not on the portfolio size.
+    '''
+    loans_df = loans.copy() if isinstance(loans, pd.DataFrame) else pd.DataFrame.from_records(loans)
+    scenarios = list(product(cpr_multipliers, rate_shocks))
+    columns = ['cpr_multiplier', 'rate_shock', 'Date'] + CONSOLIDATED_COLUMNS
+
+    if loans_df.empty or not scenarios:
+        return pd.DataFrame(columns=columns)
+
+    # Shocks change the amounts, never the payment dates, so every scenario shares the day range
+    first_day, n_days = portfolio_day_range(loans_df)
+    totals = np.zeros((len(scenarios), len(CONSOLIDATED_COLUMNS), n_days), dtype=np.int64)
+    payments = np.zeros((len(scenarios), n_days), dtype=np.int64)
+
+    for start in range(0, len(loans_df), chunk_size):
+        chunk_df, groups = scenario_loans(loans_df.iloc[start:start + chunk_size], scenarios)
+        add_portfolio_cash_flows(totals, payments, chunk_df, first_day, groups)
+
+    curves = []
+    for (multiplier, shock), scenario_totals, scenario_payments in zip(scenarios, totals, payments):
+        curve = cash_flow_frame(scenario_totals, scenario_payments, first_day)
+        curve.insert(0, 'rate_shock', shock)
+        curve.insert(0, 'cpr_multiplier', multiplier)
+        curves.append(curve)
+
+    return pd.concat(curves, ignore_index=True)[columns]
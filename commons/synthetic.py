@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+
+# Name -> weight mixes used when none are given
+SIMPLIFIED_FREQUENCIES = {'Monthly': 0.7, 'Semimonthly': 0.1, 'Biweekly': 0.1, 'Weekly': 0.1}
+MODIFIED_FREQUENCIES = {'Monthly': 0.5, 'Semi-Monthly': 0.15, 'Bi-Weekly': 0.15, 'Weekly': 0.15, 'Quarterly': 0.05}
+COMPOUND_FREQUENCIES = {'Monthly': 0.7, 'Quarterly': 0.1, 'Semi-Annual': 0.1, 'Annually': 0.1}
+TERMS = {12: 0.1, 36: 0.2, 60: 0.3, 120: 0.2, 360: 0.2}
+CPRS = {0.0: 0.2, 0.05: 0.5, 0.1: 0.2, 0.2: 0.1}
+INTEREST_RATES = {0.03: 0.1, 0.05: 0.3, 0.08: 0.4, 0.12: 0.2}
+
+
+def _choice(rng, mix, size):
+    values = list(mix)
+    weights = np.asarray([mix[value] for value in values], dtype=float)
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=size, p=weights / weights.sum())]
+
+
+def _start_dates(rng, size, first_date, last_date):
+    first_date = np.datetime64(first_date, 'D')
+    days = (np.datetime64(last_date, 'D') - first_date).astype(np.int64) + 1
+    return pd.to_datetime(first_date + rng.integers(0, days, size=size))
+
+
+def generate_simplified_tape(n_loans, seed=0, frequencies=None, terms=None, cprs=None, interest_rates=None,
+                             first_date='2023-01-01', last_date='2024-12-31'):
+    '''
+    Returns a synthetic simplified loan tape of `n_loans` rows laid out like the upload file.
+    Frequency, term, CPR and interest rate mixes are {value: weight} dicts.
+    '''
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        'loan number': np.arange(1, n_loans + 1),
+        'loan amount': rng.integers(50, 5000, size=n_loans) * 100,
+        'interest_rate': _choice(rng, interest_rates or INTEREST_RATES, n_loans).astype(float),
+        'start_date': _start_dates(rng, n_loans, first_date, last_date),
+        'term ': _choice(rng, terms or TERMS, n_loans).astype(np.int64),
+        'payment frequency': _choice(rng, frequencies or SIMPLIFIED_FREQUENCIES, n_loans),
+        'CPR (Conditional Prepayment Rate)': _choice(rng, cprs or CPRS, n_loans).astype(float),
+    })
+
+
+def generate_modified_tape(n_loans, seed=0, frequencies=None, compound_frequencies=None, terms=None,
+                           cprs=None, interest_rates=None, first_date='2023-01-01', last_date='2024-12-31'):
+    '''
+    Returns a synthetic modified loan tape of `n_loans` rows laid out like the upload file.
+    The mortgage term is drawn from the terms no longer than the amortization term.
+    '''
+    rng = np.random.default_rng(seed)
+    amortization_terms = _choice(rng, terms or TERMS, n_loans).astype(np.int64)
+    mortgage_terms = np.minimum(_choice(rng, terms or TERMS, n_loans).astype(np.int64), amortization_terms)
+
+    return pd.DataFrame({
+        'start_date': _start_dates(rng, n_loans, first_date, last_date),
+        'original_principal': rng.integers(50, 5000, size=n_loans) * 100,
+        'amortization_term_months': amortization_terms,
+        'mortgage_term_months': mortgage_terms,
+        'interest_rate': _choice(rng, interest_rates or INTEREST_RATES, n_loans).astype(float),
+        'compounding_frequency': _choice(rng, compound_frequencies or COMPOUND_FREQUENCIES, n_loans),
+        'payment_frequency': _choice(rng, frequencies or MODIFIED_FREQUENCIES, n_loans),
+        'cpr': _choice(rng, cprs or CPRS, n_loans).astype(float),
+    })
@@ -0,0 +1,74 @@
+import numpy as np
+from .constants import PaymentFrequency, PAYMENT_FREQUENCY_CODES, COMPOUND_FREQUENCY_CODES
+
+
+# One fixed-size record per loan, frequencies as int8 codes (see constants)
+SIMPLIFIED_TAPE_DTYPE = np.dtype([('loan_number', np.int64),
+                                  ('loan_amount', np.float64),
+                                  ('interest_rate', np.float64),
+                                  ('start_date', 'datetime64[D]'),
+                                  ('term', np.int32),
+                                  ('payment_frequency', np.int8),
+                                  ('cpr', np.float64)])
+
+MODIFIED_TAPE_DTYPE = np.dtype([('id', np.int64),
+                                ('start_date', 'datetime64[D]'),
+                                ('original_principal', np.float64),
+                                ('amortization_term_month', np.int32),
+                                ('mortgage_term_month', np.int32),
+                                ('interest_rate', np.float64),
+                                ('compounding_frequency', np.int8),
+                                ('payment_frequency', np.int8),
+                                ('cpr', np.float64)])
+
+
+def payment_frequency_code(frequency):
+    '''
+    Returns the int8 code of a payment frequency name such as "Semi-Monthly"
+    '''
+    return PAYMENT_FREQUENCY_CODES[frequency.replace("-", "").upper()]
+
+
+def compound_frequency_code(frequency):
+    return COMPOUND_FREQUENCY_CODES[frequency.replace("-", "").upper()]
+
+
+def simplified_tape(rows, count=-1):
+    '''
+    Builds a compact simplified loan tape from (loan_number, loan_amount, interest_rate,
+    start_date, term, payment_frequency, cpr) tuples, e.g. an ORM `values_list`.
+    Rows are converted one at a time, so no per-loan objects are kept.
+    '''
+    codes = {}
+
+    def encode(row):
+        frequency = row[5]
+        if frequency not in codes:
+            codes[frequency] = payment_frequency_code(frequency)
+        return row[:5] + (codes[frequency], row[6])
+
+    return np.fromiter((encode(row) for row in rows), dtype=SIMPLIFIED_TAPE_DTYPE, count=count)
+
+
+def modified_tape(rows, count=-1):
+    '''
+    Builds a compact modified loan tape from (id, start_date, original_principal,
+    amortization_term_month, mortgage_term_month, interest_rate, compounding_frequency,
+    payment_frequency, cpr) tuples
+    '''
+    codes = {}
+
+    def encode(row):
+        frequencies = row[6:8]
+        if frequencies not in codes:
+            codes[frequencies] = (compound_frequency_code(frequencies[0]), payment_frequency_code(frequencies[1]))
+        return row[:6] + codes[frequencies] + (row[8],)
+
+    return np.fromiter((encode(row) for row in rows), dtype=MODIFIED_TAPE_DTYPE, count=count)
+
+
+def frequency_names(codes, enum=PaymentFrequency):
+    '''
+    Decodes int8 frequency codes back into enum member names
+    '''
+    return np.asarray([member.name for member in enum])[codes]
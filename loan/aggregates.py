@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from .models import LoanInput, PortfolioCashFlow, PortfolioCashFlowState
+from commons.helpers import prepare_calculated_loan_details, format_schedule_dates
+from commons.portfolio import portfolio_cash_flow_changes, CONSOLIDATED_COLUMNS
+from commons.cents import from_cents
+from commons.rollups import CashFlowCube, rollup
+from commons.instrumentation import timed
+
+
+SIMPLIFIED_LOAN_FIELDS = ('loan_number', 'loan_amount', 'interest_rate', 'start_date', 'term', 'payment_frequency', 'cpr')
+
+# PortfolioCashFlow amount fields, in the order of CONSOLIDATED_COLUMNS
+CASH_FLOW_FIELDS = ('principal_remaining', 'payment', 'prepayment', 'interest', 'principal', 'closing_balance')
+
+
+def is_stale():
+    stale = PortfolioCashFlowState.objects.filter(pk=1).values_list('stale', flat=True).first()
+    return stale is None or stale
+
+
+def state_version():
+    '''
+    Returns the time of the last rebuild or mark_stale, None when the stored cash flows are stale
+    '''
+    state = PortfolioCashFlowState.objects.filter(pk=1).values_list('stale', 'updated_at').first()
+    return None if state is None or state[0] else state[1]
+
+
+def mark_stale():
+    '''
+    Flags the stored portfolio cash flows for a rebuild on the next read. Used for
+    every change that does not go through `track_simplified_changes`.
+    '''
+    PortfolioCashFlowState.objects.update_or_create(pk=1, defaults={'stale': True})
+
+
+def track_simplified_changes(loan_numbers):
+    '''
+    Called with the loan numbers of an upload chunk before it is saved. Keeps the
+    previous version of those loans and returns the function to call with the saved
+    loan numbers, which merges the difference into the stored cash flows.
+    Returns None when the stored cash flows are stale anyway.
+    '''
+    version = state_version()
+    if version is None:
+        return None
+
+    previous = list(LoanInput.objects.filter(loan_number__in=loan_numbers).values(*SIMPLIFIED_LOAN_FIELDS))
+
+    def merge(saved_loan_numbers):
+        current = list(LoanInput.objects.filter(loan_number__in=saved_loan_numbers).values(*SIMPLIFIED_LOAN_FIELDS))
+        merge_cash_flow_changes(previous, current, version)
+
+    return merge
+
+
+@timed()
+def merge_cash_flow_changes(previous, current, version):
+    '''
+    Subtracts the cash flows of the `previous` loan records and adds those of the
+    `current` ones, only touching the dates where they differ. `version` is the
+    `state_version()` read with the previous records: if the cash flows were rebuilt
+    or marked stale since, nothing is merged and they are left stale.
+    '''
+    if not previous and not current:
+        return
+
+    loans_df = prepare_calculated_loan_details(previous + current)
+    days, changes, payment_changes = portfolio_cash_flow_changes(loans_df, [False] * len(previous) + [True] * len(current))
+    if not len(days):
+        return
+
+    dates = days.astype('datetime64[D]').tolist()
+
+    with transaction.atomic():
+        # NOTE: Merges and rebuilds lock the state row first, so they are applied one at a time. Without it,
+        # two merges adding to a date missing from both their reads would each insert it and one would be lost
+        state = PortfolioCashFlowState.objects.select_for_update().filter(pk=1).first()
+        if state is None or state.stale:
+            return
+        if state.updated_at != version:
+            # Rebuilt since the previous records were read, it may already hold the current ones
+            state.stale = True
+            state.save()
+            return
+
+        rows = {row.payment_date: row for row in
+                PortfolioCashFlow.objects.select_for_update().filter(payment_date__range=(dates[0], dates[-1]))}
+        changed, emptied = [], []
+
+        for date, amounts, payments in zip(dates, changes.T.tolist(), payment_changes.tolist()):
+            row = rows.get(date) or PortfolioCashFlow(payment_date=date)
+            row.payments += payments
+            for field, amount in zip(CASH_FLOW_FIELDS, amounts):
+                setattr(row, field, getattr(row, field) + amount)
+            
+            if row.payments:
+                changed.append(row)
+            elif row.pk is not None:
+                emptied.append(row.pk)
+
+        # NOTE: Upserted on the date, bulk_update builds a CASE per row and is far slower
+        PortfolioCashFlow.objects.bulk_create(changed, update_conflicts=True, unique_fields=['payment_date'],
+                                              update_fields=('payments',) + CASH_FLOW_FIELDS)
+        PortfolioCashFlow.objects.filter(pk__in=emptied).delete()
+
+
+@timed()
+def rebuild_cash_flows():
+    '''
+    Recomputes the stored cash flows from every simplified loan
+    '''
+    with transaction.atomic():
+        # NOTE: Marked fresh first, so a change saved while rebuilding marks it stale again.
+        # update_or_create locks the state row, merges wait for the rebuild to commit
+        PortfolioCashFlowState.objects.update_or_create(pk=1, defaults={'stale': False})
+        PortfolioCashFlow.objects.all().delete()
+
+        loans = list(LoanInput.objects.values(*SIMPLIFIED_LOAN_FIELDS))
+        if not loans:
+            return
+
+        days, totals, payments = portfolio_cash_flow_changes(prepare_calculated_loan_details(loans), [True] * len(loans))
+        PortfolioCashFlow.objects.bulk_create([
+            PortfolioCashFlow(payment_date=date, payments=count, **dict(zip(CASH_FLOW_FIELDS, amounts)))
+            for date, amounts, count in zip(days.astype('datetime64[D]').tolist(), totals.T.tolist(), payments.tolist())
+        ], batch_size=1000)
+
+
+@timed()
+def portfolio_cash_flows(until=None):
+    '''
+    Returns the stored cash flows of the whole Simplify portfolio in the format of
+    `consolidate_portfolio_cash_flows`, only the `until` date when given.
+    Rebuilds them first if they are stale.
+    '''
+    rows = stored_cash_flows()
+    if until is not None:
+        rows = rows.filter(payment_date=until)
+
+    rows = list(rows.values_list('payment_date', *CASH_FLOW_FIELDS))
+    if not rows:
+        return pd.DataFrame(columns=['Date'] + CONSOLIDATED_COLUMNS)
+
+    dates, *amounts = zip(*rows)
+    consolidated = pd.DataFrame({'Date': format_schedule_dates(np.array(dates, dtype='datetime64[D]'), "%Y/%m/%d")})
+    for name, column in zip(CONSOLIDATED_COLUMNS, amounts):
+        consolidated[name] = from_cents(np.array(column, dtype=np.int64))
+
+    return consolidated
+
+
+@timed()
+def portfolio_rollup(granularity, date=None):
+    '''
+    Rolls the stored cash flows of the whole Simplify portfolio up by month, quarter or
+    year (see `rollup`), only the bucket holding `date` when given.
+    Rebuilds them first if they are stale.
+    '''
+    rows = list(stored_cash_flows().values_list('payment_date', 'payments', *CASH_FLOW_FIELDS))
+    days = np.array([row[0] for row in rows], dtype='datetime64[D]')
+    totals = np.array([row[2:] for row in rows], dtype=np.int64).reshape(len(rows), len(CASH_FLOW_FIELDS)).T
+    payments = np.array([row[1] for row in rows], dtype=np.int64)
+
+    return CashFlowCube({granularity: rollup(days, totals, payments, granularity)}).frame(granularity, date)
+
+
+def stored_cash_flows():
+    '''
+    Returns the PortfolioCashFlow rows by date, rebuilt first if they are stale
+    '''
+    if is_stale():
+        rebuild_cash_flows()
+
+    return PortfolioCashFlow.objects.order_by('payment_date')
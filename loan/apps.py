@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class LoanConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'loan'
+    
+    def ready(self):
+        from django.conf import settings
+        from commons import instrumentation
+        from . import signals
+
+        instrumentation.configure(settings.LOAN_INSTRUMENTATION)
@@ -0,0 +1,72 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from .models import DatasetVersion
+
+
+def dataset_version():
+    '''
+    Returns a token that changes on every write to the loans and the time of the last
+    write. (None, None) when the version row is missing, e.g. after a flush.
+    '''
+    row = DatasetVersion.objects.filter(pk=1).values_list('version', 'updated_at').first()
+    if row is None:
+        return None, None
+
+    version, updated_at = row
+    # NOTE: The creation time tells apart databases whose counters reached the same value
+    return f"{version}.{int(updated_at.timestamp() * 1000000)}", updated_at
+
+
+def bump_dataset_version():
+    '''
+    Counts a write to LoanInput or LoanTape. Called by the model signals, and by
+    the uploads, whose bulk_create sends none.
+    '''
+    now = timezone.now()
+    if not DatasetVersion.objects.filter(pk=1).update(version=F('version') + 1, updated_at=now):
+        DatasetVersion.objects.get_or_create(pk=1, defaults={'version': 1, 'updated_at': now})
+
+
+def request_dataset_version(request):
+    '''
+    `dataset_version()` read once per request, shared by the validators and the page cache
+    '''
+    if not hasattr(request, '_dataset_version'):
+        request._dataset_version = dataset_version()
+
+    return request._dataset_version
+
+
+def request_etag(request, *args, **kwargs):
+    '''
+    ETag of a loan view: the dataset version, the URL and the submitted form, CSRF token aside
+    '''
+    token, _ = request_dataset_version(request)
+    if token is None:
+        return None
+
+    options = sorted((name, value) for name, value in request.POST.items() if name != 'csrfmiddlewaretoken')
+    return hashlib.sha256(f"{token}|{request.get_full_path()}|{options}".encode()).hexdigest()[:32]
+
+
+def cached_page(request, name, options, build):
+    '''
+    Returns `build()`, cached in LOAN_PAGE_CACHE under the dataset version, `name` and the
+    `options` it depends on. Writes to the loans change the version, so entries are never stale.
+    '''
+    token, _ = request_dataset_version(request)
+    if token is None:
+        return build()
+
+    key = f"{name}:{token}:{hashlib.sha256(repr(sorted(options.items())).encode()).hexdigest()[:32]}"
+    page_cache = caches[settings.LOAN_PAGE_CACHE]
+
+    value = page_cache.get(key)
+    if value is None:
+        value = build()
+        page_cache.set(key, value)
+
+    return value
@@ -31,3 +31,5 @@ class FilterLoanForm(forms.Form):
                                      widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm'}))
     consolidate = forms.BooleanField(required=False)
     date = forms.DateField(required=False, widget=forms.widgets.DateInput(attrs={'type': 'date'}))
+    granularity = forms.ChoiceField(required=False, initial='day',
+                                    choices=[('day', 'Day'), ('month', 'Month'), ('quarter', 'Quarter'), ('year', 'Year')])
@@ -0,0 +1,106 @@
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import IngestionJob
+
+
+def enqueue_upload(upload_type, file):
+    '''
+    Stores an uploaded tape under MEDIA_ROOT and queues it for the ingestion workers
+    '''
+    if upload_type not in dict(IngestionJob.TYPES):
+        raise ValueError(f"Invalid upload type '{upload_type}'.")
+
+    return IngestionJob.objects.create(type=upload_type, file=file)
+
+
+def claim_next_job(worker):
+    '''
+    Marks the oldest queued job as running for `worker` and returns it, or None.
+    The status is changed with a conditional UPDATE, so when several workers race
+    for the same job only one of them gets it.
+    '''
+    requeue_stale_jobs()
+
+    for job_id in IngestionJob.objects.filter(status=IngestionJob.QUEUED).order_by('id').values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        claimed = IngestionJob.objects.filter(pk=job_id, status=IngestionJob.QUEUED).update(
+            status=IngestionJob.RUNNING, worker=worker, started_at=now, heartbeat_at=now)
+        if claimed:
+            return IngestionJob.objects.get(pk=job_id)
+
+    return None
+
+
+def requeue_stale_jobs():
+    '''
+    Queues again the running jobs whose worker recorded no progress for
+    LOAN_INGESTION_HEARTBEAT_TIMEOUT seconds, as after a crash. Modified tapes that
+    saved rows already fail instead: they have no unique key, a rerun would save those rows twice.
+    '''
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.LOAN_INGESTION_HEARTBEAT_TIMEOUT)
+    stale = IngestionJob.objects.filter(Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+                                        status=IngestionJob.RUNNING)
+
+    stale.filter(Q(type=IngestionJob.SIMPLIFIED) | Q(rows_processed=0)).update(
+        status=IngestionJob.QUEUED, worker='', started_at=None, heartbeat_at=None)
+    stale.update(status=IngestionJob.FAILED, finished_at=now,
+                 error="Worker stopped before finishing, rows saved so far are kept")
+
+
+def run_job(job, batch_size=None, chunk_size=None):
+    '''
+    Saves the tape of a claimed job, recording the counts after every chunk
+    '''
+    # NOTE: Imported here, so workers start without loading pandas until they get a job
+    from .loans_lib import LoansTape
+
+    lt = LoansTape()
+    upload = lt.upload_simplify_file if job.type == IngestionJob.SIMPLIFIED else lt.upload_modified_file
+
+    def progress(summary):
+        IngestionJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now(), **_job_counts(summary))
+
+    try:
+        with job.file.open('rb') as file:
+            summary = upload(file, batch_size=batch_size, chunk_size=chunk_size, progress=progress)
+    except Exception:
+        # NOTE: Chunks saved before the error stay saved, rows_processed tells how far the job got
+        IngestionJob.objects.filter(pk=job.pk).update(status=IngestionJob.FAILED, error=traceback.format_exc(),
+                                                      finished_at=timezone.now())
+    else:
+        IngestionJob.objects.filter(pk=job.pk).update(status=IngestionJob.DONE, finished_at=timezone.now(),
+                                                      **_job_counts(summary))
+
+    job.refresh_from_db()
+    return job
+
+
+def job_status(job):
+    '''
+    JSON friendly progress of a job
+    '''
+    return {'id': job.pk,
+            'type': job.get_type_display(),
+            'status': job.status,
+            'rows_processed': job.rows_processed,
+            'inserted': job.inserted,
+            'updated': job.updated,
+            'rejected': job.rejected,
+            'rows_per_second': job.rows_per_second,
+            'error': job.error,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'heartbeat_at': job.heartbeat_at,
+            'finished_at': job.finished_at}
+
+
+def _job_counts(summary):
+    return {'rows_processed': summary['inserted'] + summary['updated'] + summary['rejected'],
+            'inserted': summary['inserted'],
+            'updated': summary['updated'],
+            'rejected': summary['rejected'],
+            'rows_per_second': summary['rows_per_second']}
@@ -1,14 +1,73 @@
+import time
+import datetime
+from contextlib import nullcontext
+import numpy as np
 import pandas as pd
-from .models import LoanInput, LoanTape
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from .models import LoanInput, LoanTape, LoanSchedule, LoanTapeSchedule
 from commons.helpers import (
     prepare_calculated_loan_details, 
-    create_amortization_schedule, 
-    conver_file_to_dataframe,
+    iter_file_chunks,
     prepare_modified_calculated_loan_details,
-    create_periodic_amortization,
+    prepare_modified_loan_tape,
     convert_to_daily_amortization,
-    convert_to_monthly_amortization
+    iter_daily_amortization,
+    convert_to_monthly_amortization,
+    convert_loan_tape,
+    to_date
 )
+from commons.portfolio import (
+    create_portfolio_amortization_schedule,
+    create_portfolio_periodic_amortization,
+    consolidate_portfolio_cash_flows,
+    portfolio_positions,
+    CONSOLIDATED_COLUMNS
+)
+from commons.scenarios import scenario_cash_flows
+from commons.kernel import simplified_schedule, modified_schedule
+from commons.rollups import rollup_cash_flows
+from commons.tape import simplified_tape, modified_tape, SIMPLIFIED_TAPE_DTYPE, MODIFIED_TAPE_DTYPE
+from commons.instrumentation import timed
+from commons.cents import round_cents, sum_cents
+from .schedule_cache import schedule_cache
+from .schedule_store import schedule_store
+from .aggregates import track_simplified_changes, portfolio_cash_flows, portfolio_rollup
+from .dataset import bump_dataset_version
+
+
+# Model field -> (upload file column, type)
+SIMPLIFIED_UPLOAD_FIELDS = {
+    'loan_number': ('loan number', 'int'),
+    'loan_amount': ('loan amount', 'float'),
+    'interest_rate': ('interest_rate', 'float'),
+    'start_date': ('start_date', 'date'),
+    'term': ('term ', 'int'),
+    'payment_frequency': ('payment frequency', 'str'),
+    'cpr': ('CPR (Conditional Prepayment Rate)', 'float'),
+}
+
+MODIFIED_UPLOAD_FIELDS = {
+    'start_date': ('start_date', 'date'),
+    'original_principal': ('original_principal', 'float'),
+    'amortization_term_month': ('amortization_term_months', 'int'),
+    'mortgage_term_month': ('mortgage_term_months', 'int'),
+    'interest_rate': ('interest_rate', 'float'),
+    'compounding_frequency': ('compounding_frequency', 'str'),
+    'payment_frequency': ('payment_frequency', 'str'),
+    'cpr': ('cpr', 'float'),
+}
+
+MATERIALIZED_SCHEDULE_FIELDS = ('period', 'payment_date', 'opening_balance', 'payment', 'interest',
+                                'principal', 'prepayment', 'closing_balance')
+
+# JSON keys of the schedule API rows, in the order the schedule helpers build them
+SCHEDULE_PAGE_COLUMNS = ('period', 'date', 'principal_remaining', 'payment', 'prepayment', 'interest_rate',
+                         'monthly_interest_rate', 'interest', 'principal', 'closing_balance')
+
+PERIODIC_PAGE_COLUMNS = ('period', 'date', 'opening_balance', 'amount', 'interest', 'prepayment',
+                         'principal', 'closing_balance', 'maturity')
 
 class Simplify():
     
@@ -29,6 +88,7 @@ class LoansTape():
         pass
     
     
+    @timed()
     def get_simplified_loan_list(self):
         loans = LoanInput.objects.all().values('loan_number', 'loan_amount', 
                                                 'interest_rate', 'start_date',
@@ -37,52 +97,275 @@ class LoansTape():
         return prepare_calculated_loan_details(loans)
         
     
-    def get_simplified_loan_by_loan_number(self, df, loan_number):
+    @timed()
+    def get_simplified_tape(self):
+        '''
+        Returns every simplified loan as a compact structured array (SIMPLIFIED_TAPE_DTYPE),
+        read straight from the database cursor
+        '''
+        loans = LoanInput.objects.order_by('loan_number').values_list(*SIMPLIFIED_TAPE_DTYPE.names)
         
+        return simplified_tape(loans.iterator(chunk_size=settings.LOAN_UPLOAD_BATCH_SIZE))
+    
+    
+    @timed()
+    def get_modified_tape(self):
+        '''
+        Returns every modified loan as a compact structured array (MODIFIED_TAPE_DTYPE)
+        '''
+        loans = LoanTape.objects.order_by('id').values_list(*MODIFIED_TAPE_DTYPE.names)
+        
+        return modified_tape(loans.iterator(chunk_size=settings.LOAN_UPLOAD_BATCH_SIZE))
+    
+    
+    def get_simplified_loan(self, loan_number):
+        '''
+        Returns the saved fields of one simplified loan, None if there is no such loan
+        '''
+        return LoanInput.objects.filter(loan_number=loan_number).values('loan_number', 'loan_amount', 
+                                                                         'interest_rate', 'start_date',
+                                                                         'term', 'payment_frequency', 'cpr',).first()
+    
+    
+    @timed()
+    def get_simplified_loan_by_loan_number(self, loan_number):
+        '''
+        Returns the amortization schedule of one simplified loan and the page label.
+        Only that loan is read, an empty DataFrame if there is no such loan.
+        '''
         loan_number = int(loan_number)
         
-        # Filter by loan number and display the amortization scheduler
-        loan_info = df[df['loan_number'] == loan_number]
-        label = f"No Information for Loan Number {loan_number}"
+        loan = self.get_simplified_loan(loan_number)
+        if loan is None:
+            return pd.DataFrame(), f"No Information for Loan Number {loan_number}"
+        
+        # NOTE: Same schedule as create_amortization_schedule, the DataFrame is only built to render it
+        df = schedule_cache.get_or_create(f"loaninput-{loan_number}", 'periodic', loan,
+                                          lambda: simplified_schedule(**loan).to_frame())
+        
+        return df, "Amortization Schedule"
+    
+    @timed()
+    def get_consolidated_simplified_loans(self, df=None, date=None, granularity='day'):
+        '''
+        Returns the cash flows of the loans in `df` summed by date, only `date` when given.
+        Without `df`, those of the whole portfolio, read from the stored aggregates
+        when LOAN_PORTFOLIO_AGGREGATES is on, otherwise from the schedule store.
+        granularity: 'month', 'quarter' or 'year' rolls them up by bucket instead, only the
+        bucket holding `date` when given
+        '''
+        # NOTE: If date is given, loans are only simulated up to that date and filtered by it
+        until = datetime.date.fromisoformat(date) if date else None
         
-        if not loan_info.empty:
-            label = "Amortization Schedule"
+        if granularity != 'day':
+            # NOTE: The whole portfolio is rolled up from the stored aggregates, or read from the
+            # rollup cube stored with the tape version
+            if df is None:
+                if settings.LOAN_PORTFOLIO_AGGREGATES:
+                    return portfolio_rollup(granularity, until)
+                return self.get_schedule_store().rollup(granularity, until)
+            return rollup_cash_flows(consolidate_portfolio_cash_flows(df), granularity, until)
+        
+        if df is None:
+            if settings.LOAN_PORTFOLIO_AGGREGATES:
+                return portfolio_cash_flows(until)
+            return self.get_schedule_store().cash_flows(until)
+        
+        if until and settings.LOAN_MATERIALIZE_SCHEDULES:
+            # NOTE: A subset of the loans only sums their own stored rows
+            loan_numbers = None if len(df) == LoanInput.objects.count() else df['loan_number'].tolist()
             
-            # Amortization Schedule
-            df =  create_amortization_schedule(loan_info)
-        
-        return df, label
-    
-    def get_consolidated_simplified_loans(self, df, date=None):
-        
-        loans_list = []
-        for index, d in df.iterrows():
-            loans_list.append(create_amortization_schedule(pd.DataFrame([d]))
-        )
-        
-        df = pd.concat(loans_list)
-        
-        df['Date'] = pd.to_datetime(df['Date'])
-        df = df.drop('Period', axis=1)
-        df['Date'] = df['Date'].dt.strftime('%Y/%d/%m')
-        df = df.groupby('Date').agg({'Principal Remaining':'sum','Payment':'sum',
-                                                'Prepayment':'sum','Interest':'sum', 
-                                                'Principal': 'sum', 'Closing Ballance': 'sum'}).reset_index()
-        
-        # NOTE: If date is given, filters dataframe by date
-        if date:
-            date_obj = date.split('-')
-            year = date_obj[0]
-            month = date_obj[1]
-            day = date_obj[2]
-            date = f"{year}/{month}/{day}"
-            df = df[df['Date'] == date]
+            # NOTE: Loans saved before materializing was on have no stored rows until materialize_schedules runs
+            if self.has_materialized_schedules(loan_numbers):
+                return self.get_materialized_cash_flows(until, loan_numbers)
+        
+        df = consolidate_portfolio_cash_flows(df, until=until)
+        
+        if until:
+            df = df[df['Date'] == until.strftime('%Y/%m/%d')]
 
         return df 
     
     
+    @timed()
+    def get_simplified_positions(self, df, date, exact=False):
+        '''
+        Returns every simplified loan's schedule row at `date` (see `portfolio_positions`)
+        and the portfolio totals: outstanding balance and the cash flows paid on `date`
+        '''
+        date = datetime.date.fromisoformat(date) if isinstance(date, str) else date
+        positions = portfolio_positions(df, date, exact)
+        paid = positions[positions['Date'] == date.strftime('%d/%m/%Y')]
+        
+        # NOTE: Summed in cents, so the totals reconcile with the consolidated cash flows
+        totals = {'loans': len(positions),
+                  'balance': float(sum_cents(positions['Closing Ballance'])),
+                  'payment': float(sum_cents(paid['Payment'])),
+                  'prepayment': float(sum_cents(paid['Prepayment'])),
+                  'interest': float(sum_cents(paid['Interest'])),
+                  'principal': float(sum_cents(paid['Principal']))}
+        
+        return positions, totals
+    
+    
+    @timed()
+    def get_simplified_scenario_cash_flows(self, cpr_multipliers, rate_shocks, chunk_size=None):
+        '''
+        Returns the consolidated cash flows of every simplified loan under each
+        (CPR multiplier, rate shock) scenario, see `scenario_cash_flows`
+        '''
+        return scenario_cash_flows(self.get_simplified_tape(), cpr_multipliers, rate_shocks, 
+                                   chunk_size or settings.LOAN_SCENARIO_CHUNK_SIZE)
+    
+    
+    @timed()
+    def get_schedule_store(self):
+        '''
+        Returns the stored (memory-mapped) schedules of the current simplified tape,
+        computing them first when this version of the tape has not been stored
+        '''
+        return schedule_store.get_or_build(self.get_simplified_tape(), settings.LOAN_SCHEDULE_STORE['CHUNK_SIZE'])
+    
+    
+    def has_materialized_schedules(self, loan_numbers=None):
+        '''
+        True when every simplified loan, or every one of `loan_numbers`, has its schedule in LoanSchedule
+        '''
+        loans = LoanInput.objects.filter(schedule__isnull=True)
+        if loan_numbers is not None:
+            loans = loans.filter(loan_number__in=loan_numbers)
+        
+        return not loans.exists()
+    
+    
+    @timed()
+    def get_materialized_cash_flows(self, date, loan_numbers=None):
+        '''
+        Sums the materialized schedules of every simplified loan paying on `date`,
+        only those of `loan_numbers` when given
+        '''
+        rows = LoanSchedule.objects.filter(payment_date=date)
+        if loan_numbers is not None:
+            rows = rows.filter(loan__loan_number__in=loan_numbers)
+        
+        totals = rows.aggregate(
+            payments=Count('id'),
+            opening_balance=Sum('opening_balance'),
+            payment=Sum('payment'),
+            prepayment=Sum('prepayment'),
+            interest=Sum('interest'),
+            principal=Sum('principal'),
+            closing_balance=Sum('closing_balance'))
+        
+        if not totals.pop('payments'):
+            return pd.DataFrame(columns=['Date'] + CONSOLIDATED_COLUMNS)
+        
+        return pd.DataFrame([[date.strftime('%Y/%m/%d')] + list(totals.values())], 
+                            columns=['Date'] + CONSOLIDATED_COLUMNS)
+    
+    
+    @timed()
+    def get_materialized_schedule(self, loan_number, first_period=0, last_period=None):
+        '''
+        Returns the stored schedule rows of a simplified loan between two periods
+        '''
+        rows = LoanSchedule.objects.filter(loan__loan_number=loan_number, period__gte=first_period)
+        if last_period is not None:
+            rows = rows.filter(period__lte=last_period)
+        
+        return pd.DataFrame(list(rows.order_by('period').values(*MATERIALIZED_SCHEDULE_FIELDS)))
+    
+    
+    @timed()
+    def get_simplified_loans_page(self, after=None, limit=100):
+        '''
+        Returns the simplified loans (with their calculated factors) whose loan number
+        follows `after`, and the loan number to continue from (None on the last page)
+        '''
+        loans = LoanInput.objects.order_by('loan_number').values('loan_number', 'loan_amount', 
+                                                                'interest_rate', 'start_date',
+                                                                'term', 'payment_frequency', 'cpr',)
+        if after is not None:
+            loans = loans.filter(loan_number__gt=after)
+        
+        # NOTE: One extra row tells whether there is a next page
+        loans = list(loans[:limit + 1])
+        next_after = loans[limit - 1]['loan_number'] if len(loans) > limit else None
+        if not loans:
+            return pd.DataFrame(), next_after
+        
+        return prepare_calculated_loan_details(loans[:limit]), next_after
+    
+    
+    @timed()
+    def get_simplified_schedule_page(self, loan_number, after=None, limit=100):
+        '''
+        Returns the schedule rows of a simplified loan whose period follows `after`,
+        and the period to continue from. Only the periods up to the page end are computed.
+        Returns None if the loan does not exist.
+        '''
+        loan = self.get_simplified_loan(loan_number)
+        if loan is None:
+            return None
+        
+        first_period = 0 if after is None else after + 1
+        rows = [list(row) for row in simplified_schedule(**loan, first_period=first_period,
+                                                         last_period=first_period + limit)]
+        
+        return self._schedule_page(rows, SCHEDULE_PAGE_COLUMNS, limit)
+    
+    
+    @timed()
+    def get_modified_schedule_page(self, loan_id, after=None, limit=100):
+        '''
+        Returns the periodic schedule rows of a modified loan whose period follows `after`,
+        and the period to continue from. Periods after the page end are never computed.
+        Returns None if the loan does not exist.
+        '''
+        loan = self.get_modified_loan(loan_id)
+        if loan is None:
+            return None
+        
+        first_period = 0 if after is None else after + 1
+        rows = [list(row) for row in modified_schedule(**loan, first_period=first_period,
+                                                       last_period=first_period + limit)]
+        
+        return self._schedule_page(rows, PERIODIC_PAGE_COLUMNS, limit)
+    
+    
+    def _schedule_page(self, rows, columns, limit):
+        # NOTE: Rows are computed one past the page to tell whether there is a next page
+        next_after = rows[limit - 1][0] if len(rows) > limit else None
+        
+        return [dict(zip(columns, self._json_row(row))) for row in rows[:limit]], next_after
+    
+    
+    def _json_row(self, row):
+        return [to_date(value) if isinstance(value, np.datetime64) else value.item() if isinstance(value, np.generic) else value
+                for value in row]
+    
+    
+    @timed()
+    def get_modified_loans_page(self, after=None, limit=100):
+        '''
+        Returns the modified loans whose id follows `after`, and the id to continue from
+        '''
+        loans = LoanTape.objects.order_by('id').values('id', 'start_date', 'original_principal', 
+                                                       'amortization_term_month', 'mortgage_term_month',
+                                                       'interest_rate', 'compounding_frequency', 
+                                                       'payment_frequency', 'cpr',)
+        if after is not None:
+            loans = loans.filter(id__gt=after)
+        
+        loans = list(loans[:limit + 1])
+        next_after = loans[limit - 1]['id'] if len(loans) > limit else None
+        
+        return loans[:limit], next_after
+    
+    
+    @timed()
     def get_modified_loan_list(self):
-        loans = LoanTape.objects.all().values('start_date', 'original_principal', 
+        loans = LoanTape.objects.all().values('id', 'start_date', 'original_principal', 
                                                 'amortization_term_month', 'mortgage_term_month',
                                                 'interest_rate', 'compounding_frequency', 
                                                 'payment_frequency', 'cpr',)
@@ -90,71 +373,290 @@ class LoansTape():
         return pd.DataFrame(list(loans))
     
     
-    def get_modified_loan_by_id(self, df, loan_number):
-        loan_number = int(loan_number)
+    def get_modified_loan(self, loan_id):
+        '''
+        Returns the saved fields of one modified loan, None if there is no such loan
+        '''
+        return LoanTape.objects.filter(pk=loan_id).values('start_date', 'original_principal', 
+                                                           'amortization_term_month', 'mortgage_term_month',
+                                                           'interest_rate', 'compounding_frequency', 
+                                                           'payment_frequency', 'cpr',).first()
+    
+    
+    @timed()
+    def get_modified_loan_by_id(self, loan_id):
+        '''
+        Fetches one modified loan by primary key and prepares its calculated factors.
+        Returns empty DataFrames if there is no such loan.
+        '''
+        loan_id = int(loan_id)
         
-        # Filter by loan number and display the amortization scheduler
-        loan_info = df.iloc[loan_number - 1]
-        label = f"No Information for Loan Number {loan_number}"
+        loan_info = self.get_modified_loan(loan_id)
         
-        if not loan_info.empty:
-            label = "Amortization Information"
+        if loan_info is None:
+            return pd.DataFrame(), pd.DataFrame(), f"No Information for Loan Number {loan_id}"
             
-            loans_df, details_df = prepare_modified_calculated_loan_details(loan_info)
+        loans_df, details_df = prepare_modified_calculated_loan_details(loan_info)
             
-        return loans_df, details_df, label
+        return loans_df, details_df, "Amortization Information"
+    
     
+    @timed()
+    def get_modified_schedule(self, loan_id):
+        '''
+        Returns the periodic schedule of one modified loan, None if there is no such loan
+        '''
+        loan_id = int(loan_id)
+        
+        loan = self.get_modified_loan(loan_id)
+        if loan is None:
+            return None
+        
+        return self._periodic_schedule(loan_id, loan)
+    
+    
+    def _periodic_schedule(self, loan_id, loan):
+        # NOTE: Same schedule as create_periodic_amortization, the DataFrame is only built to render it
+        return schedule_cache.get_or_create(f"loantape-{loan_id}", 'periodic', loan,
+                                            lambda: modified_schedule(**loan).to_frame())
     
-    def create_periodic_amortization(self, loans_df, details_df):
-        return create_periodic_amortization(loans_df, details_df)
     
+    def _require_modified_loan(self, loan_id):
+        loan_id = int(loan_id)
+        
+        loan = self.get_modified_loan(loan_id)
+        if loan is None:
+            raise LoanTape.DoesNotExist(f"No Information for Loan Number {loan_id}")
+        
+        return loan_id, loan
+    
+    
+    @timed()
     def download_amortization_schedule(self, loan_id):
         
-        loans = self.get_modified_loan_list()
-        loans_df, details_df, label= self.get_modified_loan_by_id(loans, loan_id)
-        periodic_df = self.create_periodic_amortization(loans_df, details_df)
+        loan_id, loan = self._require_modified_loan(loan_id)
+        loans_df, details_df = prepare_modified_calculated_loan_details(loan)
+        periodic_df = self._periodic_schedule(loan_id, loan)
         
-        daily_df = convert_to_daily_amortization(periodic_df)
-        monthly_df = convert_to_monthly_amortization(loans_df, details_df)
+        # NOTE: The calculated factors derive from the saved fields, which key every cached schedule
+        daily_df = schedule_cache.get_or_create(f"loantape-{loan_id}", 'daily', loan,
+                                                lambda: convert_to_daily_amortization(periodic_df))
+        monthly_df = schedule_cache.get_or_create(f"loantape-{loan_id}", 'monthly', loan,
+                                                  lambda: convert_to_monthly_amortization(loans_df, details_df))
 
         return periodic_df, daily_df, monthly_df
+    
+    
+    def stream_amortization_schedule(self, loan_id, chunk_periods=None):
+        '''
+        Returns the periodic, daily and monthly schedules of a loan as lists of
+        DataFrame chunks, the daily one generated lazily while it is consumed.
+        '''
+        loan_id, loan = self._require_modified_loan(loan_id)
+        loans_df, details_df = prepare_modified_calculated_loan_details(loan)
+        periodic_df = self._periodic_schedule(loan_id, loan)
+        monthly_df = convert_to_monthly_amortization(loans_df, details_df)
         
+        return {'periodic': [periodic_df],
+                'daily': iter_daily_amortization(periodic_df, chunk_periods or settings.LOAN_EXPORT_CHUNK_PERIODS),
+                'monthly': [monthly_df]}
+    
     
-    def upload_simplify_file(self, file):
+    @timed()
+    def upload_simplify_file(self, file, batch_size=None, chunk_size=None, progress=None):
         
         file.seek(0)
     
-        df = conver_file_to_dataframe(file)
+        chunks = iter_file_chunks(file, chunk_size or settings.LOAN_UPLOAD_CHUNK_SIZE)
 
-        for index, row in df.iterrows():
-            obj = LoanInput(
-                            loan_number=row['loan number'],
-                            loan_amount=row['loan amount'],
-                            interest_rate=row['interest_rate'],
-                            start_date=row['start_date'],
-                            term=row['term '],
-                            payment_frequency=row['payment frequency'],
-                            cpr=row['CPR (Conditional Prepayment Rate)']
-                            )
-            
-            obj.save()
+        on_saved = self.materialize_simplified_schedules if settings.LOAN_MATERIALIZE_SCHEDULES else None
+        track_changes = track_simplified_changes if settings.LOAN_PORTFOLIO_AGGREGATES else None
+
+        return self._bulk_upload(LoanInput, chunks, SIMPLIFIED_UPLOAD_FIELDS, batch_size, 
+                                 unique_field='loan_number', on_saved=on_saved, progress=progress,
+                                 track_changes=track_changes)
         
     
-    def upload_modified_file(self, file):
+    @timed()
+    def upload_modified_file(self, file, batch_size=None, chunk_size=None, progress=None):
         file.seek(0)
     
-        df = conver_file_to_dataframe(file)
+        chunks = iter_file_chunks(file, chunk_size or settings.LOAN_UPLOAD_CHUNK_SIZE)
 
-        for index, row in df.iterrows():
-            obj = LoanTape(
-                            start_date=row['start_date'],
-                            original_principal=row['original_principal'],
-                            amortization_term_month=row['amortization_term_months'],
-                            mortgage_term_month=row['mortgage_term_months'],
-                            interest_rate=row['interest_rate'],
-                            compounding_frequency = row['compounding_frequency'],
-                            payment_frequency=row['payment_frequency'],
-                            cpr=row['cpr']
-                            )
+        on_saved = self.materialize_modified_schedules if settings.LOAN_MATERIALIZE_SCHEDULES else None
+
+        return self._bulk_upload(LoanTape, chunks, MODIFIED_UPLOAD_FIELDS, batch_size, on_saved=on_saved, 
+                                 progress=progress)
+    
+    
+    def _bulk_upload(self, model, chunks, fields, batch_size=None, unique_field=None, on_saved=None, progress=None,
+                     track_changes=None):
+        '''
+        Saves the chunks of an uploaded tape with `bulk_create` inside one transaction.
+        When `unique_field` is given, existing rows are updated instead of failing
+        on the unique constraint. `on_saved` is called with the keys (unique field or
+        primary key) of every saved chunk. Returns the inserted/updated/rejected counts.
+        
+        `track_changes` is called with the keys of a chunk before it is saved and may
+        return a function, called with the saved keys once the chunk is saved.
+        
+        With a `progress` callback, each chunk is committed on its own and the callback
+        gets the counts so far, so progress is visible to other connections.
+        '''
+        started = time.perf_counter()
+        batch_size = batch_size or settings.LOAN_UPLOAD_BATCH_SIZE
+        inserted = updated = rejected = 0
+        
+        with transaction.atomic() if progress is None else nullcontext():
+            for df in chunks:
+                with transaction.atomic():
+                    rows, chunk_rejected = convert_loan_tape(df, fields)
+                    rejected += chunk_rejected
+                    
+                    if unique_field:
+                        # NOTE: The last row wins when a tape repeats a key
+                        duplicated = rows.duplicated(unique_field, keep='last')
+                        rejected += int(duplicated.sum())
+                        rows = rows[~duplicated]
+                    
+                    changed = track_changes(rows[unique_field].tolist()) if track_changes and len(rows) else None
+                    
+                    chunk_inserted, chunk_updated, keys = self._bulk_save(model, rows.to_dict('records'), 
+                                                                          fields, batch_size, unique_field)
+                    inserted += chunk_inserted
+                    updated += chunk_updated
+                    
+                    if on_saved and keys:
+                        on_saved(keys)
+                    
+                    if changed and keys:
+                        changed(keys)
+                    
+                    # NOTE: bulk_create sends no signals, the loan pages key their caches on this version
+                    if keys:
+                        bump_dataset_version()
+                
+                if progress:
+                    progress(self._upload_summary(inserted, updated, rejected, started))
+        
+        return self._upload_summary(inserted, updated, rejected, started)
+    
+    
+    def _upload_summary(self, inserted, updated, rejected, started):
+        seconds = time.perf_counter() - started
+        
+        return {'inserted': inserted, 
+                'updated': updated, 
+                'rejected': rejected,
+                'seconds': round(seconds, 3),
+                'rows_per_second': round((inserted + updated) / seconds, 1) if seconds else 0}
+    
+    
+    def _bulk_save(self, model, records, fields, batch_size, unique_field=None):
+        inserted = updated = 0
+        saved = []
+        
+        for start in range(0, len(records), batch_size):
+            objs = [model(**record) for record in records[start:start + batch_size]]
             
-            obj.save()
\ No newline at end of file
+            if unique_field:
+                keys = [getattr(obj, unique_field) for obj in objs]
+                existing = model.objects.filter(**{f"{unique_field}__in": keys}).count()
+                update_fields = [field for field in fields if field != unique_field]
+                model.objects.bulk_create(objs, update_conflicts=True, 
+                                          unique_fields=[unique_field], 
+                                          update_fields=update_fields)
+                updated += existing
+                inserted += len(objs) - existing
+                saved += keys
+            else:
+                model.objects.bulk_create(objs)
+                inserted += len(objs)
+                saved += [obj.pk for obj in objs if obj.pk is not None]
+        
+        return inserted, updated, saved
+    
+    
+    @timed()
+    def materialize_simplified_schedules(self, loan_numbers=None, batch_size=None):
+        '''
+        Computes and stores the schedules of the given (default all) simplified loans
+        in LoanSchedule, replacing their previous rows.
+        '''
+        batch_size = batch_size or settings.LOAN_UPLOAD_BATCH_SIZE
+        fields = ('id', 'loan_number', 'loan_amount', 'interest_rate', 'start_date', 'term', 'payment_frequency', 'cpr')
+        
+        with transaction.atomic():
+            for loans in self._fetch_in_batches(LoanInput, 'loan_number', loan_numbers, fields, batch_size):
+                loan_ids = {loan['loan_number']: loan['id'] for loan in loans}
+                LoanSchedule.objects.filter(loan_id__in=loan_ids.values()).delete()
+                
+                schedule = create_portfolio_amortization_schedule(prepare_calculated_loan_details(loans))
+                # NOTE: Stored to the cent, so the SQL sums match `consolidate_portfolio_cash_flows`
+                rows = zip(schedule['loan_number'].map(loan_ids), 
+                           schedule['Period'], 
+                           pd.to_datetime(schedule['Date'], format="%d/%m/%Y").dt.date,
+                           schedule['Principal Remaining'], 
+                           round_cents(schedule['Payment']), 
+                           schedule['Interest'],
+                           schedule['Principal'], 
+                           round_cents(schedule['Prepayment']), 
+                           schedule['Closing Ballance'])
+                
+                LoanSchedule.objects.bulk_create([
+                    LoanSchedule(loan_id=loan_id, period=period, payment_date=payment_date, 
+                                 opening_balance=opening_balance, payment=payment, interest=interest, 
+                                 principal=principal, prepayment=prepayment, closing_balance=closing_balance)
+                    for loan_id, period, payment_date, opening_balance, payment, interest, principal, prepayment, closing_balance in rows
+                ], batch_size=batch_size)
+    
+    
+    @timed()
+    def materialize_modified_schedules(self, ids=None, batch_size=None):
+        '''
+        Computes and stores the periodic schedules of the given (default all) modified loans
+        in LoanTapeSchedule, replacing their previous rows.
+        '''
+        batch_size = batch_size or settings.LOAN_UPLOAD_BATCH_SIZE
+        fields = ('id', 'start_date', 'original_principal', 'amortization_term_month', 'mortgage_term_month',
+                  'interest_rate', 'compounding_frequency', 'payment_frequency', 'cpr')
+        
+        with transaction.atomic():
+            for loans in self._fetch_in_batches(LoanTape, 'id', ids, fields, batch_size):
+                LoanTapeSchedule.objects.filter(loan_id__in=[loan['id'] for loan in loans]).delete()
+                
+                schedule = create_portfolio_periodic_amortization(prepare_modified_loan_tape(loans))
+                rows = zip(schedule['loan_id'],
+                           schedule['Period'],
+                           pd.to_datetime(schedule['Date'], format="%d/%m/%Y").dt.date,
+                           schedule['Opening Balance'],
+                           schedule['Amount'],
+                           schedule['Interest'],
+                           schedule['Principal'],
+                           schedule['Prepayment'],
+                           schedule['Closing Balance'],
+                           schedule['Maturity'])
+                objs = [LoanTapeSchedule(loan_id=loan_id, period=period, payment_date=payment_date,
+                                         opening_balance=opening_balance, payment=payment, interest=interest,
+                                         principal=principal, prepayment=prepayment, 
+                                         closing_balance=closing_balance, maturity=maturity)
+                        for loan_id, period, payment_date, opening_balance, payment, interest, principal, prepayment, closing_balance, maturity in rows]
+                
+                LoanTapeSchedule.objects.bulk_create(objs, batch_size=batch_size)
+    
+    
+    def _fetch_in_batches(self, model, key, keys, fields, batch_size):
+        '''
+        Yields lists of `fields` dicts of the rows whose `key` is in `keys` (all rows when None)
+        '''
+        if keys is None:
+            queryset = model.objects.order_by(key).values(*fields)
+            for start in range(0, queryset.count(), batch_size):
+                yield list(queryset[start:start + batch_size])
+            return
+        
+        keys = list(keys)
+        for start in range(0, len(keys), batch_size):
+            loans = list(model.objects.filter(**{f"{key}__in": keys[start:start + batch_size]}).values(*fields))
+            if loans:
+                yield loans
@@ -0,0 +1,157 @@
+import json
+import platform
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from loan import views
+from loan.loans_lib import LoansTape
+from loan.models import LoanInput, LoanTape
+from loan.schedule_cache import schedule_cache
+from loan.schedule_store import schedule_store
+from commons.helpers import (
+    prepare_calculated_loan_details,
+    create_amortization_schedule,
+    prepare_modified_calculated_loan_details,
+    prepare_modified_loan_tape,
+    create_periodic_amortization,
+    convert_to_daily_amortization
+)
+from commons.portfolio import (
+    create_portfolio_amortization_schedule,
+    create_portfolio_periodic_amortization,
+    consolidate_portfolio_cash_flows
+)
+from commons.synthetic import generate_simplified_tape, generate_modified_tape
+
+
+# The page cache of the benchmarked views, in memory instead of the page_cache directory
+BENCHMARK_CACHES = {**settings.CACHES,
+                    settings.LOAN_PAGE_CACHE: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                               'LOCATION': 'benchmark-loan-pages'}}
+
+
+class Command(BaseCommand):
+    help = "Times the schedule helpers, uploads and views on synthetic loan tapes of several sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000],
+                            help="Number of loans of each synthetic tape")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Number of timed runs of each benchmark")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None,
+                            help="JSON file for the results (benchmark_<timestamp>.json by default)")
+
+    def handle(self, *args, **options):
+        output = options['output'] or f"benchmark_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+        results = {'created': datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(),
+                   'repeat': options['repeat'],
+                   'sizes': {}}
+
+        # NOTE: Runs against a throwaway test database, schedule cache and store and an in-memory
+        # page cache, so real data is never touched
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        old_directories = schedule_cache.directory, schedule_store.directory
+        try:
+            with tempfile.TemporaryDirectory() as directory, override_settings(CACHES=BENCHMARK_CACHES):
+                schedule_cache.directory = Path(directory) / 'schedule_cache'
+                schedule_store.directory = Path(directory) / 'schedule_store'
+                try:
+                    for size in options['sizes']:
+                        results['sizes'][size] = self._run_size(size, options['repeat'], options['seed'])
+                finally:
+                    # Drops the in-memory schedules of the test database, while only the temporary files can go
+                    schedule_cache.clear()
+        finally:
+            schedule_cache.directory, schedule_store.directory = old_directories
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(f"Results saved to {output}"))
+
+    def _run_size(self, size, repeat, seed):
+        LoanInput.objects.all().delete()
+        LoanTape.objects.all().delete()
+        lt = LoansTape()
+        timings = {}
+
+        def bench(name, function, setup=None):
+            runs = []
+            for _ in range(repeat):
+                if setup:
+                    setup()
+                started = time.perf_counter()
+                function()
+                runs.append(time.perf_counter() - started)
+
+            timings[name] = {'min': min(runs), 'median': statistics.median(runs), 'max': max(runs)}
+            self.stdout.write(f"{size:>8} {name:<40} {timings[name]['median'] * 1000:>10.1f} ms")
+
+        simplified_csv = generate_simplified_tape(size, seed=seed).to_csv(index=False).encode()
+        modified_csv = generate_modified_tape(size, seed=seed).to_csv(index=False).encode()
+
+        # Uploads
+        bench('upload_simplify_file', lambda: lt.upload_simplify_file(SimpleUploadedFile('tape.csv', simplified_csv)),
+              setup=lambda: LoanInput.objects.all().delete())
+        bench('upload_modified_file', lambda: lt.upload_modified_file(SimpleUploadedFile('tape.csv', modified_csv)),
+              setup=lambda: LoanTape.objects.all().delete())
+
+        # Simplified helpers
+        records = list(LoanInput.objects.values('loan_number', 'loan_amount', 'interest_rate', 'start_date',
+                                                'term', 'payment_frequency', 'cpr'))
+        loans_df = prepare_calculated_loan_details(records)
+        bench('prepare_calculated_loan_details', lambda: prepare_calculated_loan_details(records))
+        bench('create_amortization_schedule', lambda: [create_amortization_schedule(loans_df.iloc[[i]])
+                                                       for i in range(len(loans_df))])
+        bench('create_portfolio_amortization_schedule', lambda: create_portfolio_amortization_schedule(loans_df))
+        bench('consolidate_portfolio_cash_flows', lambda: consolidate_portfolio_cash_flows(loans_df))
+
+        # Modified helpers
+        modified = list(LoanTape.objects.values('id', 'start_date', 'original_principal', 'amortization_term_month',
+                                                'mortgage_term_month', 'interest_rate', 'compounding_frequency',
+                                                'payment_frequency', 'cpr'))
+        details = [prepare_modified_calculated_loan_details(loan) for loan in modified]
+        bench('prepare_modified_calculated_loan_details',
+              lambda: [prepare_modified_calculated_loan_details(loan) for loan in modified])
+        bench('create_periodic_amortization', lambda: [create_periodic_amortization(loans, extra)
+                                                       for loans, extra in details])
+        tape_df = prepare_modified_loan_tape(modified)
+        bench('prepare_modified_loan_tape', lambda: prepare_modified_loan_tape(modified))
+        bench('create_portfolio_periodic_amortization', lambda: create_portfolio_periodic_amortization(tape_df))
+        periodic = [create_periodic_amortization(loans, extra) for loans, extra in details]
+        bench('convert_to_daily_amortization', lambda: [convert_to_daily_amortization(df) for df in periodic])
+
+        # Views, with cold schedule and page caches
+        def clear_caches():
+            schedule_cache.clear()
+            caches[settings.LOAN_PAGE_CACHE].clear()
+
+        factory = RequestFactory()
+        loan_id = LoanTape.objects.order_by('id').values_list('id', flat=True).first()
+        view_requests = {
+            'view filter_loans simplified list': {'type': '1'},
+            'view filter_loans simplified loan': {'type': '1', 'loan_number': '1'},
+            'view filter_loans consolidate': {'type': '1', 'consolidate': 'on'},
+            'view filter_loans modified list': {'type': '2'},
+            'view filter_loans modified loan': {'type': '2', 'loan_number': str(loan_id)},
+        }
+        for name, data in view_requests.items():
+            bench(name, lambda data=data: views.filter_loans(factory.post('/loans/list/', data)),
+                  setup=clear_caches)
+
+        bench('view download_loan_schedule',
+              lambda: views.download_loan_schedule(factory.get(f'/loans/list/{loan_id}/download/'), loan_id),
+              setup=clear_caches)
+
+        return timings
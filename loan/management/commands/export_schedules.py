@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from loan.loans_lib import LoansTape
+from commons.exports import iter_csv
+
+
+class Command(BaseCommand):
+    help = "Exports the schedules of every Simplify loan, read slice by slice from the schedule store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='schedules.csv',
+                            help="CSV file to write")
+        parser.add_argument('--chunk-rows', type=int, default=100000,
+                            help="Schedule rows read from the store at a time")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        store = LoansTape().get_schedule_store()
+        self.stdout.write(f"Schedule store {store.path.name}: {store.loans} loans, {len(store)} rows "
+                          f"({time.perf_counter() - started:.2f}s)")
+
+        with open(options['output'], 'wb') as file:
+            for block in iter_csv(store.iter_frames(options['chunk_rows'])):
+                file.write(block)
+
+        self.stdout.write(self.style.SUCCESS(f"Schedules saved to {options['output']} "
+                                             f"in {time.perf_counter() - started:.2f}s"))
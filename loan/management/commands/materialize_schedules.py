@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from loan.loans_lib import LoansTape
+from loan.models import LoanSchedule, LoanTapeSchedule
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the stored schedule tables (LoanSchedule, LoanTapeSchedule) of every loan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tape', choices=['simplified', 'modified', 'all'], default='all',
+                            help="Which loans to materialize (LoanInput, LoanTape or both)")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Number of loans per batch")
+
+    def handle(self, *args, **options):
+        lt = LoansTape()
+
+        if options['tape'] in ('simplified', 'all'):
+            started = time.perf_counter()
+            lt.materialize_simplified_schedules(batch_size=options['batch_size'])
+            self.stdout.write(f"LoanSchedule: {LoanSchedule.objects.count()} rows "
+                              f"in {time.perf_counter() - started:.2f}s")
+
+        if options['tape'] in ('modified', 'all'):
+            started = time.perf_counter()
+            lt.materialize_modified_schedules(batch_size=options['batch_size'])
+            self.stdout.write(f"LoanTapeSchedule: {LoanTapeSchedule.objects.count()} rows "
+                              f"in {time.perf_counter() - started:.2f}s")
+
+        self.stdout.write(self.style.SUCCESS("Schedules materialized"))
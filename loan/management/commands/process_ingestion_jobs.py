@@ -0,0 +1,44 @@
+import os
+import socket
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from loan.ingestion import claim_next_job, run_job
+from loan.models import IngestionJob
+
+
+class Command(BaseCommand):
+    help = "Worker that saves queued upload jobs. Start as many as needed, each job is claimed by one worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of polling")
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help="Seconds to wait between polls of an empty queue")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(f"Worker {worker} waiting for jobs")
+
+        while True:
+            job = claim_next_job(worker)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Job {job.pk}: {job.file.name}")
+            try:
+                job = run_job(job, options['batch_size'], options['chunk_size'])
+            except KeyboardInterrupt:
+                # NOTE: Not requeued, chunks saved so far would be saved twice for modified tapes
+                IngestionJob.objects.filter(pk=job.pk).update(status=IngestionJob.FAILED, error="Worker interrupted",
+                                                              finished_at=timezone.now())
+                raise
+
+            style = self.style.SUCCESS if job.status == IngestionJob.DONE else self.style.ERROR
+            self.stdout.write(style(f"Job {job.pk} {job.status}: {job.rows_processed} rows "
+                                    f"({job.rows_per_second:,.0f} rows/sec)"))
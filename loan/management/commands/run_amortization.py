@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from loan.loans_lib import LoansTape
+from commons.batch import run_simplified_chunk, run_modified_chunk
+
+
+class Command(BaseCommand):
+    help = "Computes the amortization schedules of the whole portfolio across a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tape', choices=['simplified', 'modified', 'all'], default='all',
+                            help="Which loans to run (LoanInput, LoanTape or both)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Number of worker processes")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of loans per chunk")
+        parser.add_argument('--output', default=None,
+                            help="Output directory, one npz file per chunk")
+
+    def handle(self, *args, **options):
+        output = Path(options['output'] or settings.BASE_DIR / 'amortization_runs' / datetime.now().strftime('%Y%m%d%H%M%S'))
+        output.mkdir(parents=True, exist_ok=True)
+        chunk_size = options['chunk_size']
+
+        lt = LoansTape()
+        jobs = []
+        # NOTE: Compact tapes, so the chunks sent to the workers pickle as plain arrays
+        if options['tape'] in ('simplified', 'all'):
+            jobs += self._chunks('simplified', run_simplified_chunk, lt.get_simplified_tape(), chunk_size, output)
+
+        if options['tape'] in ('modified', 'all'):
+            jobs += self._chunks('modified', run_modified_chunk, lt.get_modified_tape(), chunk_size, output)
+
+        # Workers only compute and write files, they never share the parent's database connection
+        connections.close_all()
+
+        started = time.perf_counter()
+        total_loans = total_rows = 0
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(function, chunk, path): path for function, chunk, path in jobs}
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                loans, rows, seconds = future.result()
+                total_loans += loans
+                total_rows += rows
+                self.stdout.write(f"[{done}/{len(jobs)}] {futures[future].name}: {loans} loans, {rows} rows "
+                                  f"in {seconds:.2f}s ({loans / seconds if seconds else 0:,.0f} loans/sec)")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{total_loans} loans, {total_rows} rows in {elapsed:.2f}s "
+            f"({total_loans / elapsed if elapsed else 0:,.0f} loans/sec) -> {output}"))
+
+    def _chunks(self, tape, function, loans, chunk_size, output):
+        return [(function, loans[start:start + chunk_size], output / f"{tape}_{start // chunk_size:05d}.npz")
+                for start in range(0, len(loans), chunk_size)]
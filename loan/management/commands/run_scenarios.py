@@ -0,0 +1,32 @@
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from loan.loans_lib import LoansTape
+
+
+class Command(BaseCommand):
+    help = "Consolidated cash flows of the simplified loans under a grid of CPR multipliers and rate shocks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cpr-multipliers', type=float, nargs='+', default=[0.5, 1, 1.5, 2],
+                            help="Factors applied to every loan's CPR")
+        parser.add_argument('--rate-shocks', type=float, nargs='+', default=[-0.01, 0, 0.01, 0.02],
+                            help="Amounts added to every loan's annual interest rate (0.01 = +100bp)")
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Number of loans stepped at a time")
+        parser.add_argument('--output', default=None,
+                            help="CSV file of the curves (scenarios_<timestamp>.csv by default)")
+
+    def handle(self, *args, **options):
+        output = options['output'] or f"scenarios_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+
+        started = time.perf_counter()
+        curves = LoansTape().get_simplified_scenario_cash_flows(options['cpr_multipliers'], options['rate_shocks'],
+                                                                options['chunk_size'])
+        seconds = time.perf_counter() - started
+
+        curves.to_csv(output, index=False)
+
+        summary = curves.groupby(['cpr_multiplier', 'rate_shock'])[['Payment', 'Prepayment', 'Interest']].sum()
+        self.stdout.write(summary.to_string(float_format="{:,.2f}".format))
+        self.stdout.write(self.style.SUCCESS(f"{len(summary)} scenarios in {seconds:.2f}s, saved to {output}"))
@@ -0,0 +1,60 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from commons import instrumentation
+
+
+class ServerTimingMiddleware():
+    '''
+    Collects the stages timed while handling a request and returns them in a
+    Server-Timing header, with the whole view recorded as view.<url name>.
+    Sync and async capable, so async views are not adapted into a sync thread under ASGI.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not instrumentation.is_enabled():
+            return self.get_response(request)
+
+        token = instrumentation.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stages = instrumentation.finish_request(token)
+
+        return self._add_server_timing(request, response, stages, time.perf_counter() - started)
+
+
+    async def __acall__(self, request):
+        if not instrumentation.is_enabled():
+            return await self.get_response(request)
+
+        token = instrumentation.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stages = instrumentation.finish_request(token)
+
+        return self._add_server_timing(request, response, stages, time.perf_counter() - started)
+
+
+    def _add_server_timing(self, request, response, stages, elapsed):
+        # NOTE: Streamed responses are timed until the headers are ready, the chunks are generated later
+        match = request.resolver_match
+        name = f"view.{match.view_name}" if match and match.view_name else "view"
+        instrumentation.record_stage(name, elapsed)
+
+        stages['total'] = (elapsed, None, 1)
+        response['Server-Timing'] = instrumentation.server_timing(stages)
+        return response
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.16 on 2026-10-18 07:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loan', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanTapeSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.IntegerField()),
+                ('payment_date', models.DateField()),
+                ('opening_balance', models.FloatField()),
+                ('payment', models.FloatField()),
+                ('interest', models.FloatField()),
+                ('principal', models.FloatField()),
+                ('prepayment', models.FloatField()),
+                ('closing_balance', models.FloatField()),
+                ('maturity', models.FloatField()),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedule', to='loan.loantape')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['payment_date'], name='loan_loanta_payment_ced26d_idx'), models.Index(fields=['loan', 'period'], name='loan_loanta_loan_id_db5e57_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.IntegerField()),
+                ('payment_date', models.DateField()),
+                ('opening_balance', models.FloatField()),
+                ('payment', models.FloatField()),
+                ('interest', models.FloatField()),
+                ('principal', models.FloatField()),
+                ('prepayment', models.FloatField()),
+                ('closing_balance', models.FloatField()),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedule', to='loan.loaninput')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['payment_date'], name='loan_loansc_payment_b68e9f_idx'), models.Index(fields=['loan', 'period'], name='loan_loansc_loan_id_b3da92_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loan', '0003_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioCashFlow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_date', models.DateField(unique=True)),
+                ('payments', models.IntegerField(default=0)),
+                ('principal_remaining', models.BigIntegerField(default=0)),
+                ('payment', models.BigIntegerField(default=0)),
+                ('prepayment', models.BigIntegerField(default=0)),
+                ('interest', models.BigIntegerField(default=0)),
+                ('principal', models.BigIntegerField(default=0)),
+                ('closing_balance', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PortfolioCashFlowState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stale', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:22
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_dataset_version(apps, schema_editor):
+    # NOTE: Created at migration time, so every database starts from its own version token
+    apps.get_model('loan', 'DatasetVersion').objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loan', '0004_portfoliocashflow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_dataset_version, migrations.RunPython.noop),
+    ]
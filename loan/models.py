@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Siplify samples
 class LoanInput(models.Model):
@@ -22,4 +23,94 @@ class LoanTape(models.Model):
     interest_rate = models.FloatField()
     compounding_frequency = models.CharField(max_length=20)
     payment_frequency = models.CharField(max_length=20)
-    cpr = models.FloatField()
\ No newline at end of file
+    cpr = models.FloatField()
+
+class ScheduleRow(models.Model):
+    period = models.IntegerField()
+    payment_date = models.DateField()
+    opening_balance = models.FloatField()
+    payment = models.FloatField()
+    interest = models.FloatField()
+    principal = models.FloatField()
+    prepayment = models.FloatField()
+    closing_balance = models.FloatField()
+
+    class Meta:
+        abstract = True
+
+# Materialized schedules of the Simplify samples
+class LoanSchedule(ScheduleRow):
+    loan = models.ForeignKey(LoanInput, on_delete=models.CASCADE, related_name='schedule')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['payment_date']),
+            models.Index(fields=['loan', 'period']),
+        ]
+
+# Materialized periodic schedules of the Modified samples
+class LoanTapeSchedule(ScheduleRow):
+    loan = models.ForeignKey(LoanTape, on_delete=models.CASCADE, related_name='schedule')
+    maturity = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['payment_date']),
+            models.Index(fields=['loan', 'period']),
+        ]
+
+# Uploaded tapes waiting to be (or being) saved by the process_ingestion_jobs workers
+class IngestionJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    SIMPLIFIED = '1'
+    MODIFIED = '2'
+    TYPES = [(SIMPLIFIED, 'Simplified Sample'), (MODIFIED, 'Modified Sample')]
+
+    type = models.CharField(max_length=1, choices=TYPES)
+    file = models.FileField(upload_to='uploads/%Y/%m/%d/')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    worker = models.CharField(max_length=100, blank=True)
+    rows_processed = models.IntegerField(default=0)
+    inserted = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    rejected = models.IntegerField(default=0)
+    rows_per_second = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.pk} {self.status}"
+
+# Cash flows of the whole Simplify portfolio per payment date, in cents, updated by uploads
+class PortfolioCashFlow(models.Model):
+    payment_date = models.DateField(unique=True)
+    payments = models.IntegerField(default=0)
+    principal_remaining = models.BigIntegerField(default=0)
+    payment = models.BigIntegerField(default=0)
+    prepayment = models.BigIntegerField(default=0)
+    interest = models.BigIntegerField(default=0)
+    principal = models.BigIntegerField(default=0)
+    closing_balance = models.BigIntegerField(default=0)
+
+# Single row telling whether PortfolioCashFlow missed a change and must be rebuilt
+class PortfolioCashFlowState(models.Model):
+    stale = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+# Single row counting the writes to LoanInput/LoanTape, keys the HTTP validators and page cache of the loan views
+class DatasetVersion(models.Model):
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class ComputeOverloaded(Exception):
+    '''
+    Raised when every worker is busy and the queue is full, or a job waited in the queue too long
+    '''
+
+
+class ComputeLimiter():
+    '''
+    Runs CPU-bound work of async views on a bounded thread pool. At most
+    `workers` jobs run at once and `queue_size` more wait for a worker;
+    anything beyond that is refused straight away with ComputeOverloaded.
+    '''
+
+    def __init__(self, workers, queue_size, queue_timeout) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+
+    async def run(self, function, *args):
+        '''
+        Runs `function(*args)` on a worker and returns its result
+        '''
+        self._admit()
+        try:
+            return await self._submit(self.queue_timeout, function, *args)
+        finally:
+            self._release()
+
+
+    def iterate(self, iterator):
+        '''
+        Async iterator over a blocking `iterator`, each item computed on a worker.
+        Used for streaming responses: the stream counts as one pending job until it
+        is exhausted or closed, and raises ComputeOverloaded here when the pool is full.
+        '''
+        self._admit()
+        return _Stream(self, iterator)
+
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'queue_size': self.queue_size, 'pending': self._pending}
+
+
+    async def _submit(self, timeout, function, *args):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # NOTE: The request context goes along, so stages timed on the worker reach its Server-Timing header
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), context.run, _run_job,
+                                                                deadline, function, args)
+
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                raise ComputeOverloaded(f"{self._pending} jobs pending")
+            self._pending += 1
+
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='loan-compute')
+            return self._executor
+
+
+class _Stream():
+    '''
+    Async iterator of `ComputeLimiter.iterate`, holding its pending job until the
+    items run out, one fails, or the stream is closed or garbage collected
+    '''
+    _done = object()
+
+    def __init__(self, limiter, iterator) -> None:
+        self._limiter = limiter
+        self._iterator = iterator
+        # NOTE: Called once at most, also when a response is dropped before streaming
+        self._release = weakref.finalize(self, limiter._release)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            item = await self._limiter._submit(None, next, self._iterator, self._done)
+        except BaseException:
+            self._release()
+            raise
+
+        if item is self._done:
+            self._release()
+            raise StopAsyncIteration
+        return item
+
+    async def aclose(self):
+        self._release()
+
+
+def _run_job(deadline, function, args):
+    # NOTE: Jobs that waited in the queue past their deadline are dropped, the client has been waiting too long
+    if deadline is not None and time.monotonic() > deadline:
+        raise ComputeOverloaded("queued past the timeout")
+
+    # NOTE: Worker threads never see request_started/finished, so stale connections are closed here
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+compute_limiter = ComputeLimiter(settings.LOAN_COMPUTE['WORKERS'],
+                                 settings.LOAN_COMPUTE['QUEUE_SIZE'],
+                                 settings.LOAN_COMPUTE['QUEUE_TIMEOUT'])
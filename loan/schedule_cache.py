@@ -0,0 +1,158 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from django.conf import settings
+
+
+# NOTE: Bump when the schedule helpers change their output, so entries written by older code are never read
+SCHEDULE_VERSION = 2
+
+
+class ScheduleCache():
+    '''
+    Two tier (in-process LRU and on-disk npz) cache of amortization schedules.
+    Entries are keyed by the loan identity, the kind of schedule and a hash of the
+    loan parameters, so a loan whose parameters change never hits a stale entry.
+    '''
+
+    def __init__(self, directory, memory_bytes, disk_bytes) -> None:
+        self.directory = Path(directory)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+
+    def get_or_create(self, identity, kind, params, build):
+        '''
+        Returns the cached schedule of `identity`, calling `build` to create it on a miss
+        '''
+        key = f"{identity}-{kind}-{self._digest(params)}"
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return self._memory[key][0].copy()
+
+        df = self._read(key)
+        if df is not None:
+            self._count('disk_hits')
+        else:
+            self._count('misses')
+            df = build()
+            self._write(key, df)
+
+        self._remember(key, df)
+        return df.copy()
+
+
+    def invalidate(self, identity):
+        '''
+        Drops every cached schedule of `identity` from both tiers
+        '''
+        prefix = f"{identity}-"
+
+        with self._lock:
+            for key in [key for key in self._memory if key.startswith(prefix)]:
+                self._memory_size -= self._memory.pop(key)[1]
+
+        for path in self.directory.glob(f"{prefix}*.npz"):
+            path.unlink(missing_ok=True)
+
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+
+        for path in self.directory.glob("*.npz"):
+            path.unlink(missing_ok=True)
+
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_size
+
+        requests = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = round((requests - stats['misses']) / requests, 4) if requests else 0
+        return stats
+
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+    def _digest(self, params):
+        params = sorted((str(name), str(value)) for name, value in params.items())
+        params.append(('version', str(SCHEDULE_VERSION)))
+        return hashlib.sha1(repr(params).encode()).hexdigest()
+
+
+    def _remember(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= self._memory.pop(key)[1]
+
+            self._memory[key] = (df, size)
+            self._memory_size += size
+
+            while self._memory_size > self.memory_bytes and self._memory:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_size -= evicted_size
+
+
+    def _read(self, key):
+        from commons.exports import load_frame_npz
+
+        path = self.directory / f"{key}.npz"
+
+        try:
+            df = load_frame_npz(path)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        # Bump the modified time so disk eviction drops the least recently used files first
+        os.utime(path)
+
+        return df
+
+
+    def _write(self, key, df):
+        from commons.exports import save_frame_npz
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        save_frame_npz(self.directory / f"{key}.npz", df)
+        self._evict_disk()
+
+
+    def _evict_disk(self):
+        files = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= self.disk_bytes:
+                break
+
+            path.unlink(missing_ok=True)
+            size -= file_size
+
+
+schedule_cache = ScheduleCache(settings.LOAN_SCHEDULE_CACHE['DIRECTORY'],
+                               settings.LOAN_SCHEDULE_CACHE['MEMORY_BYTES'],
+                               settings.LOAN_SCHEDULE_CACHE['DISK_BYTES'])
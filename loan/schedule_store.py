@@ -0,0 +1,256 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from commons.helpers import prepare_calculated_loan_details, format_schedule_dates
+from commons.portfolio import portfolio_schedule_arrays, cash_flow_frame, SCHEDULE_COLUMNS, CONSOLIDATED_COLUMNS
+from commons.cents import to_cents
+from commons.rollups import CashFlowCube
+
+
+# NOTE: Bump when the stored columns or the schedule helpers change, older stores are then rebuilt
+STORE_VERSION = 4
+
+# One file per column, one value per schedule row
+ROW_COLUMNS = {'period': np.int32,
+               'date': np.int32,
+               **{name: np.float64 for name in CONSOLIDATED_COLUMNS}}
+
+# One value per loan, offsets has one more: loan i's rows are offsets[i]:offsets[i + 1]
+LOAN_COLUMNS = {'loan_number': np.int64,
+                'interest_rate': np.float64,
+                'monthly_interest_rate': np.float64}
+
+
+class ScheduleStore():
+    '''
+    On-disk column files of the schedules of every loan of a simplified tape, one
+    directory per tape version (a hash of its contents). Directories are written
+    once, under a temporary name, and only read afterwards.
+    '''
+
+    def __init__(self, directory, versions) -> None:
+        self.directory = Path(directory)
+        self.versions = versions
+
+
+    def get_or_build(self, tape, chunk_size=1000):
+        '''
+        Returns the StoredSchedules of a simplified tape (SIMPLIFIED_TAPE_DTYPE, sorted
+        by loan number), computing them `chunk_size` loans at a time if they are not stored yet
+        '''
+        path = self.directory / tape_version(tape)
+
+        if not path.exists():
+            self._build(path, tape, chunk_size)
+            self._evict()
+
+        return StoredSchedules(path)
+
+
+    def _build(self, path, tape, chunk_size):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        building = Path(tempfile.mkdtemp(dir=self.directory, prefix='.building-'))
+
+        try:
+            with contextlib.ExitStack() as stack:
+                files = {name: stack.enter_context(open(building / f"{name}.bin", 'wb'))
+                         for name in [*ROW_COLUMNS, *LOAN_COLUMNS]}
+                offsets, first_day, last_day = self._write_columns(files, tape, chunk_size)
+
+            np.asarray(offsets, dtype=np.int64).tofile(building / "offsets.bin")
+            (building / "index.json").write_text(json.dumps({'rows': int(offsets[-1]), 'loans': len(tape),
+                                                            'first_day': first_day, 'last_day': last_day}))
+            StoredSchedules(building).build_cube().save(building / "rollups.npz")
+
+            # NOTE: Another process may have stored the same version meanwhile, both are identical
+            os.rename(building, path)
+        except OSError:
+            if not path.exists():
+                raise
+        finally:
+            shutil.rmtree(building, ignore_errors=True)
+
+
+    def _write_columns(self, files, tape, chunk_size):
+        '''
+        Appends the schedules of the tape to the column `files`, `chunk_size` loans at a time.
+        Returns the row offsets of the loans and the first and last payment days.
+        '''
+        offsets = [0]
+        first_day, last_day = np.iinfo(np.int32).max, np.iinfo(np.int32).min
+
+        for start in range(0, len(tape), chunk_size):
+            loans_df = prepare_calculated_loan_details(tape[start:start + chunk_size])
+            arrays = portfolio_schedule_arrays(loans_df)
+
+            for name, dtype in ROW_COLUMNS.items():
+                files[name].write(arrays[name].astype(dtype).tobytes())
+            # Same arithmetic as the 'Monthly Interest Rate' column of the schedule helpers
+            monthly_rate = np.round(loans_df['monthly_interest_rate'].to_numpy(dtype=float) / 100 * 100, 2)
+            loan_columns = {'loan_number': loans_df['loan_number'],
+                            'interest_rate': loans_df['interest_rate'],
+                            'monthly_interest_rate': monthly_rate}
+            for name, dtype in LOAN_COLUMNS.items():
+                files[name].write(np.asarray(loan_columns[name], dtype=dtype).tobytes())
+            offsets.extend(offsets[-1] + np.cumsum(np.bincount(arrays['loan_index'], minlength=len(loans_df))))
+            first_day = min(first_day, int(arrays['date'].min()))
+            last_day = max(last_day, int(arrays['date'].max()))
+
+        return offsets, first_day, last_day
+
+
+    def _evict(self):
+        stored = sorted((path.stat().st_mtime, path) for path in self.directory.iterdir()
+                        if path.is_dir() and not path.name.startswith('.'))
+
+        for _, path in stored[:-self.versions]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class StoredSchedules():
+    '''
+    Read-only view of a stored tape version. Columns are memory-mapped, so only the
+    slices that are read are loaded, and the pages stay shared between processes.
+    '''
+
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+        index = json.loads((self.path / "index.json").read_text())
+        self.rows = index['rows']
+        self.loans = index['loans']
+        self.first_day = index['first_day']
+        self.last_day = index['last_day']
+        self.columns = {name: self._map(name, dtype, self.rows) for name, dtype in ROW_COLUMNS.items()}
+        self.loan_columns = {name: self._map(name, dtype, self.loans) for name, dtype in LOAN_COLUMNS.items()}
+        self.offsets = self._map('offsets', np.int64, self.loans + 1)
+
+
+    def __len__(self):
+        return self.rows
+
+
+    def loan_rows(self, loan_number):
+        '''
+        Returns the slice of the rows of a loan, None if it is not stored
+        '''
+        loan_numbers = self.loan_columns['loan_number']
+        index = np.searchsorted(loan_numbers, loan_number)
+        if index == self.loans or loan_numbers[index] != loan_number:
+            return None
+
+        return slice(int(self.offsets[index]), int(self.offsets[index + 1]))
+
+
+    def loan_schedule(self, loan_number):
+        '''
+        Returns the schedule of a loan as `create_amortization_schedule` does, None if it is not stored
+        '''
+        rows = self.loan_rows(loan_number)
+        if rows is None:
+            return None
+
+        return self.frame(rows).drop('loan_number', axis=1)
+
+
+    def frame(self, rows):
+        '''
+        DataFrame of a slice of rows, in the format of `create_portfolio_amortization_schedule`
+        '''
+        loans = np.searchsorted(self.offsets, np.arange(rows.start, rows.stop), side='right') - 1
+        df = pd.DataFrame({'loan_number': self.loan_columns['loan_number'][loans],
+                           'Period': self.columns['period'][rows].astype(np.int64),
+                           'Date': format_schedule_dates(self.columns['date'][rows].astype('datetime64[D]'))})
+        for name in CONSOLIDATED_COLUMNS:
+            df[name] = self.columns[name][rows]
+        # Period 0 rows show no rates
+        paying = df['Period'].to_numpy() > 0
+        df['Interest Rate'] = np.where(paying, self.loan_columns['interest_rate'][loans], 0)
+        df['Monthly Interest Rate'] = np.where(paying, self.loan_columns['monthly_interest_rate'][loans], 0)
+
+        return df[['loan_number'] + SCHEDULE_COLUMNS]
+
+
+    def iter_frames(self, chunk_rows=100000):
+        '''
+        Yields every stored row, `chunk_rows` at a time, for exports
+        '''
+        for start in range(0, self.rows, chunk_rows):
+            yield self.frame(slice(start, min(start + chunk_rows, self.rows)))
+
+
+    def cash_flows(self, until=None, chunk_rows=1000000):
+        '''
+        Returns the cash flows summed by date, in the format of `consolidate_portfolio_cash_flows`,
+        only the `until` date when given. Rows are read `chunk_rows` at a time.
+        '''
+        return cash_flow_frame(*self.daily_totals(until, chunk_rows), self.first_day)
+
+
+    def rollup(self, granularity, date=None):
+        '''
+        Returns the cash flows rolled up by day, month, quarter or year from the rollup
+        cube stored with this version, only the bucket holding `date` when given
+        '''
+        return CashFlowCube.load(self.path / "rollups.npz").frame(granularity, date)
+
+
+    def build_cube(self):
+        '''
+        Rolls every stored row up into the CashFlowCube of this version
+        '''
+        totals, payments = self.daily_totals()
+        days = np.flatnonzero(payments)
+
+        return CashFlowCube.from_daily(days + self.first_day, totals[:, days], payments[days])
+
+
+    def daily_totals(self, until=None, chunk_rows=1000000):
+        '''
+        Returns the (CONSOLIDATED_COLUMNS, day) cents totals and payment counts of every
+        day from `first_day`, only the `until` date when given
+        '''
+        until = None if until is None else np.datetime64(until, 'D').astype(np.int64)
+        n_days = max(self.last_day - self.first_day + 1, 0)
+        totals = np.zeros((len(CONSOLIDATED_COLUMNS), n_days), dtype=np.int64)
+        payments = np.zeros(n_days, dtype=np.int64)
+
+        for start in range(0, self.rows, chunk_rows):
+            rows = slice(start, min(start + chunk_rows, self.rows))
+            days = np.asarray(self.columns['date'][rows], dtype=np.int64) - self.first_day
+            selected = slice(None) if until is None else days == until - self.first_day
+
+            payments += np.bincount(days[selected], minlength=n_days)
+            # NOTE: Sums of cents stay exact in float64 weights up to 2^53 cents
+            for total, name in zip(totals, CONSOLIDATED_COLUMNS):
+                total += np.bincount(days[selected], to_cents(self.columns[name][rows][selected]),
+                                     minlength=n_days).astype(np.int64)
+
+        return totals, payments
+
+
+    def _map(self, name, dtype, length):
+        # NOTE: Empty files cannot be memory-mapped
+        if not length:
+            return np.zeros(0, dtype=dtype)
+
+        return np.memmap(self.path / f"{name}.bin", dtype=dtype, mode='r', shape=(length,))
+
+
+def tape_version(tape):
+    '''
+    Names a tape version after a hash of its records
+    '''
+    digest = hashlib.sha256(f"{STORE_VERSION}-{tape.dtype.descr}".encode())
+    digest.update(np.ascontiguousarray(tape).tobytes())
+    return digest.hexdigest()[:20]
+
+
+schedule_store = ScheduleStore(settings.LOAN_SCHEDULE_STORE['DIRECTORY'],
+                               settings.LOAN_SCHEDULE_STORE['VERSIONS'])
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import LoanInput, LoanTape
+from .schedule_cache import schedule_cache
+from .dataset import bump_dataset_version
+
+
+@receiver([post_save, post_delete], sender=LoanInput)
+def invalidate_simplified_schedules(sender, instance, **kwargs):
+    schedule_cache.invalidate(f"loaninput-{instance.loan_number}")
+
+
+@receiver([post_save, post_delete], sender=LoanTape)
+def invalidate_modified_schedules(sender, instance, **kwargs):
+    schedule_cache.invalidate(f"loantape-{instance.pk}")
+
+
+@receiver([post_save, post_delete], sender=LoanInput)
+@receiver([post_save, post_delete], sender=LoanTape)
+def count_dataset_version(sender, instance, **kwargs):
+    bump_dataset_version()
+
+
+@receiver([post_save, post_delete], sender=LoanInput)
+def invalidate_portfolio_cash_flows(sender, instance, **kwargs):
+    # NOTE: Uploads merge their own changes, QuerySet.update() bypasses signals and needs mark_stale()
+    if settings.LOAN_PORTFOLIO_AGGREGATES:
+        from .aggregates import mark_stale
+        mark_stale()
+
+
+@receiver(post_save, sender=LoanInput)
+def materialize_simplified_schedule(sender, instance, raw=False, **kwargs):
+    if settings.LOAN_MATERIALIZE_SCHEDULES and not raw:
+        from .loans_lib import LoansTape
+        LoansTape().materialize_simplified_schedules([instance.loan_number])
+
+
+@receiver(post_save, sender=LoanTape)
+def materialize_modified_schedule(sender, instance, raw=False, **kwargs):
+    if settings.LOAN_MATERIALIZE_SCHEDULES and not raw:
+        from .loans_lib import LoansTape
+        LoansTape().materialize_modified_schedules([instance.pk])
@@ -1,3 +1,684 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import tempfile
+import threading
+from unittest import mock
+import numpy as np
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpResponse
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from commons.helpers import (
+    prepare_calculated_loan_details,
+    calculate_loan_details,
+    create_amortization_schedule,
+    generate_dates,
+    generate_schedule_dates,
+    format_schedule_dates,
+    prepare_modified_calculated_loan_details,
+    prepare_modified_loan_tape,
+    create_periodic_amortization,
+    convert_to_daily_amortization
+)
+from commons.portfolio import (
+    create_portfolio_amortization_schedule,
+    create_portfolio_periodic_amortization,
+    split_portfolio_schedule,
+    consolidate_portfolio_cash_flows,
+    portfolio_positions,
+    CONSOLIDATED_COLUMNS
+)
+from commons.scenarios import scenario_cash_flows
+from commons.cents import to_cents, from_cents, round_cents, sum_cents
+from commons.tape import SIMPLIFIED_TAPE_DTYPE, simplified_tape
+from commons.constants import PAYMENT_FREQUENCY_CODES
+from commons.kernel import simplified_schedule, modified_schedule
+from commons.rollups import rollup_cash_flows
+from loan.loans_lib import LoansTape
+from loan.models import LoanInput, LoanTape, IngestionJob
+from loan.views import loan_tables
+from loan.ingestion import claim_next_job, run_job, enqueue_upload
+from loan.aggregates import is_stale, rebuild_cash_flows, track_simplified_changes
+from loan.schedule_cache import ScheduleCache
+from loan.schedule_store import ScheduleStore
+from loan.offload import ComputeLimiter, ComputeOverloaded
+from commons import instrumentation
+from loan.middleware import ServerTimingMiddleware
 
-# Create your tests here.
+
+# Bucket labels of 'dd/mm/yyyy' schedule dates, by rollup granularity
+ROLLUP_BUCKETS = {'month': lambda dates: dates.str[6:] + '/' + dates.str[3:5],
+                  'quarter': lambda dates: dates.str[6:] + '/Q' + ((dates.str[3:5].astype(int) + 2) // 3).astype(str),
+                  'year': lambda dates: dates.str[6:]}
+
+# Pages rendered by the tests are cached in memory, not in the page_cache directory
+TEST_CACHES = {**settings.CACHES,
+               settings.LOAN_PAGE_CACHE: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                          'LOCATION': 'test-loan-pages'}}
+
+
+def simplified_loan_records():
+    loans = []
+    for loan_number, (amount, rate, start_date, term, frequency, cpr) in enumerate([
+            (35000, 0.08, datetime.date(2023, 9, 1), 36, 'Monthly', 0.05),
+            (40000, 0.08, datetime.date(2023, 10, 1), 12, 'Monthly', 0.05),
+            (125000, 0.0725, datetime.date(2024, 1, 31), 60, 'Monthly', 0.2),
+            (9000, 0.125, datetime.date(2023, 5, 17), 24, 'Weekly', 0.6),
+            (71445, 0.125, datetime.date(2023, 2, 9), 1, 'biweekly', 0.6),
+            (500000, 0.03, datetime.date(2024, 2, 29), 120, 'Semimonthly', 0.0)], start=1):
+        loans.append({'loan_number': loan_number, 'loan_amount': float(amount),
+                      'interest_rate': rate, 'start_date': start_date, 'term': term,
+                      'payment_frequency': frequency, 'cpr': cpr})
+
+    return loans
+
+
+def simplified_loans():
+    return prepare_calculated_loan_details(simplified_loan_records())
+
+
+class PortfolioScheduleTest(SimpleTestCase):
+
+    def test_matches_single_loan_schedule(self):
+        loans_df = simplified_loans()
+        schedules = split_portfolio_schedule(create_portfolio_amortization_schedule(loans_df))
+
+        for _, loan in loans_df.iterrows():
+            expected = create_amortization_schedule(pd.DataFrame([loan]))
+            pd.testing.assert_frame_equal(schedules[loan['loan_number']], expected,
+                                          check_dtype=False, check_exact=True)
+
+    def test_consolidated_cash_flows(self):
+        loans_df = simplified_loans()
+        schedule = create_portfolio_amortization_schedule(loans_df)
+        schedule['Date'] = pd.to_datetime(schedule['Date'], format="%d/%m/%Y").dt.strftime("%Y/%m/%d")
+        expected = schedule.drop(['loan_number', 'Period', 'Interest Rate', 'Monthly Interest Rate'], axis=1)
+        # Totals are the exact sums of the schedules' amounts rounded to the cent
+        expected[CONSOLIDATED_COLUMNS] = to_cents(expected[CONSOLIDATED_COLUMNS])
+        expected = expected.groupby('Date').sum().reset_index()
+        expected[CONSOLIDATED_COLUMNS] = from_cents(expected[CONSOLIDATED_COLUMNS])
+
+        pd.testing.assert_frame_equal(consolidate_portfolio_cash_flows(loans_df), expected)
+
+        until = consolidate_portfolio_cash_flows(loans_df, until=datetime.date(2024, 3, 1))
+        pd.testing.assert_frame_equal(until, expected[expected['Date'] <= "2024/03/01"])
+
+
+class CentsTest(SimpleTestCase):
+
+    def test_rounding_matches_np_round(self):
+        amounts = np.array([0.125, 0.135, 2.675, 1.005, -0.125, 1234.5649999, 99.994999, 1e9 + 0.015,
+                            79740.425, 16814.495])
+        self.assertEqual(from_cents(to_cents(amounts)).tolist(), np.round(amounts, 2).tolist())
+        # Schedules round numpy floats, which round like np.round, not like round() on Python floats
+        self.assertEqual([round(amount, 2) for amount in amounts[-2:]], [79740.42, 16814.5])
+        self.assertEqual(round_cents(amounts[-2:]).tolist(), [79740.42, 16814.5])
+
+    def test_sums_reconcile_to_the_cent(self):
+        amounts = np.full(1_000_000, 0.1)
+        self.assertNotEqual(amounts.sum(), 100000.0)
+        self.assertEqual(sum_cents(amounts), 100000.0)
+
+
+class PeriodicScheduleTest(SimpleTestCase):
+
+    def test_batch_matches_single_loan_schedule(self):
+        loans = [{'id': 7, 'start_date': datetime.date(2024, 1, 31), 'original_principal': 10000.0,
+                  'amortization_term_month': 60, 'mortgage_term_month': 24, 'interest_rate': 0.05,
+                  'compounding_frequency': 'Semi-Annual', 'payment_frequency': 'Monthly', 'cpr': 0.05},
+                 {'id': 9, 'start_date': datetime.date(2023, 6, 15), 'original_principal': 2500.0,
+                  'amortization_term_month': 12, 'mortgage_term_month': 12, 'interest_rate': 0.12,
+                  'compounding_frequency': 'Monthly', 'payment_frequency': 'Bi-Weekly', 'cpr': 0.9}]
+        schedules = split_portfolio_schedule(create_portfolio_periodic_amortization(
+            prepare_modified_loan_tape(loans)).rename(columns={'loan_id': 'loan_number'}))
+
+        for loan in loans:
+            loans_df, details_df = prepare_modified_calculated_loan_details(loan)
+            expected = create_periodic_amortization(loans_df, details_df)
+            pd.testing.assert_frame_equal(schedules[loan['id']], expected, check_dtype=False)
+
+
+class KernelTest(SimpleTestCase):
+
+    def test_simplified_schedule_matches_dataframe_schedule(self):
+        for loan in simplified_loan_records():
+            expected = create_amortization_schedule(prepare_calculated_loan_details([loan]))
+            pd.testing.assert_frame_equal(simplified_schedule(**loan).to_frame(), expected)
+
+            rows = simplified_schedule(**loan, first_period=2, last_period=5)
+            self.assertEqual([row.period for row in rows], expected['Period'].tolist()[2:6])
+            self.assertEqual(list(rows.column('closing_balance')), expected['Closing Ballance'].tolist()[2:6])
+
+    def test_modified_schedule_matches_dataframe_schedule(self):
+        loan = {'start_date': datetime.date(2024, 1, 31), 'original_principal': 10000.0,
+                'amortization_term_month': 60, 'mortgage_term_month': 24, 'interest_rate': 0.05,
+                'compounding_frequency': 'Semi-Annual', 'payment_frequency': 'Monthly', 'cpr': 0.05}
+        expected = create_periodic_amortization(*prepare_modified_calculated_loan_details(loan))
+
+        pd.testing.assert_frame_equal(modified_schedule(**loan).to_frame(), expected)
+
+
+class ScheduleDatesTest(SimpleTestCase):
+
+    def test_matches_generate_dates(self):
+        for interval in ['weekly', 'biweekly', 'semimonthly', 'monthly']:
+            start_date = "31/01/2024"
+            expected = []
+            for _ in range(30):
+                start_date = generate_dates(start_date, interval=interval)
+                expected.append(start_date)
+
+            dates = generate_schedule_dates(datetime.date(2024, 1, 31), interval, 30)
+            self.assertEqual(list(format_schedule_dates(dates)), expected)
+
+
+class UploadTest(TestCase):
+
+    def tape(self, rows):
+        df = pd.DataFrame(rows, columns=['loan number', 'loan amount', 'interest_rate', 'start_date',
+                                         'term ', 'payment frequency', 'CPR (Conditional Prepayment Rate)'])
+        return SimpleUploadedFile("tape.csv", df.to_csv(index=False).encode())
+
+    def test_upload_simplify_file_upserts(self):
+        summary = LoansTape().upload_simplify_file(self.tape([
+            (1, 35000, 0.08, '2023-09-01', 36, 'Monthly', 0.05),
+            (2, 40000, 0.08, '2023-10-01', 12, 'Monthly', 0.05),
+            ('x', 40000, 0.08, '2023-10-01', 12, 'Monthly', 0.05)]), batch_size=1, chunk_size=2)
+        self.assertEqual((summary['inserted'], summary['updated'], summary['rejected']), (2, 0, 1))
+
+        summary = LoansTape().upload_simplify_file(self.tape([
+            (2, 45000, 0.08, '2023-10-01', 12, 'Monthly', 0.05),
+            (3, 40000, 0.08, '2023-11-01', 48, 'Monthly', 0.05)]))
+        self.assertEqual((summary['inserted'], summary['updated'], summary['rejected']), (1, 1, 0))
+        self.assertEqual(LoanInput.objects.count(), 3)
+        self.assertEqual(LoanInput.objects.get(loan_number=2).loan_amount, 45000)
+
+    def test_compact_tape_matches_records(self):
+        LoansTape().upload_simplify_file(self.tape([
+            (1, 35000, 0.08, '2023-09-01', 36, 'Monthly', 0.05),
+            (2, 9000, 0.125, '2023-05-17', 24, 'Weekly', 0.6)]))
+        lt = LoansTape()
+        tape = lt.get_simplified_tape()
+
+        self.assertEqual(tape.dtype, SIMPLIFIED_TAPE_DTYPE)
+        self.assertEqual(tape['payment_frequency'].tolist(), [PAYMENT_FREQUENCY_CODES['MONTHLY'],
+                                                              PAYMENT_FREQUENCY_CODES['WEEKLY']])
+        pd.testing.assert_frame_equal(create_portfolio_amortization_schedule(prepare_calculated_loan_details(tape)),
+                                      create_portfolio_amortization_schedule(lt.get_simplified_loan_list()))
+
+    def test_upload_view_queues_job_for_worker(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(MEDIA_ROOT=directory):
+            response = self.client.post('/loans/upload/', {'type': '1', 'file': self.tape([
+                (1, 35000, 0.08, '2023-09-01', 36, 'Monthly', 0.05),
+                ('x', 40000, 0.08, '2023-10-01', 12, 'Monthly', 0.05)])})
+            job = response.context['job']
+            self.assertEqual(LoanInput.objects.count(), 0)
+
+            self.assertEqual(claim_next_job('test').pk, job.pk)
+            self.assertIsNone(claim_next_job('test'))
+            run_job(IngestionJob.objects.get(pk=job.pk))
+
+            status = self.client.get(f'/loans/jobs/{job.pk}/').json()
+            self.assertEqual((status['status'], status['rows_processed'], status['inserted'], status['rejected']),
+                             ('done', 2, 1, 1))
+            self.assertEqual(LoanInput.objects.count(), 1)
+
+    def test_stale_running_jobs_are_requeued(self):
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        crashed = IngestionJob.objects.create(type=IngestionJob.SIMPLIFIED, file='uploads/simplified.csv',
+                                              status=IngestionJob.RUNNING, worker='gone:1', rows_processed=500,
+                                              started_at=long_ago, heartbeat_at=long_ago)
+        partial = IngestionJob.objects.create(type=IngestionJob.MODIFIED, file='uploads/modified.csv',
+                                              status=IngestionJob.RUNNING, worker='gone:2', rows_processed=500,
+                                              started_at=long_ago, heartbeat_at=long_ago)
+        IngestionJob.objects.create(type=IngestionJob.SIMPLIFIED, file='uploads/running.csv',
+                                    status=IngestionJob.RUNNING, worker='alive:3',
+                                    started_at=long_ago, heartbeat_at=timezone.now())
+
+        job = claim_next_job('test')
+        self.assertEqual((job.pk, job.worker), (crashed.pk, 'test'))
+        self.assertEqual(IngestionJob.objects.get(pk=partial.pk).status, IngestionJob.FAILED)
+        self.assertIsNone(claim_next_job('test'))
+
+        with self.assertRaises(ValueError):
+            enqueue_upload('3', SimpleUploadedFile('tape.csv', b''))
+
+    def test_upload_merges_portfolio_cash_flows(self):
+        lt = LoansTape()
+        lt.upload_simplify_file(self.tape([
+            (1, 35000, 0.08, '2023-09-01', 36, 'Monthly', 0.05),
+            (2, 40000, 0.08, '2023-10-01', 12, 'Monthly', 0.05)]))
+        lt.get_consolidated_simplified_loans()
+        self.assertFalse(is_stale())
+
+        lt.upload_simplify_file(self.tape([
+            (2, 45000, 0.09, '2023-10-15', 24, 'Weekly', 0.1),
+            (3, 9000, 0.125, '2023-05-17', 24, 'Weekly', 0.6)]), chunk_size=1)
+        self.assertFalse(is_stale())
+        expected = consolidate_portfolio_cash_flows(lt.get_simplified_loan_list())
+        pd.testing.assert_frame_equal(lt.get_consolidated_simplified_loans(), expected)
+        pd.testing.assert_frame_equal(lt.get_consolidated_simplified_loans(date='2023-10-15'),
+                                      expected[expected['Date'] == '2023/10/15'].reset_index(drop=True))
+        with mock.patch.object(LoansTape, 'get_schedule_store') as get_schedule_store:
+            pd.testing.assert_frame_equal(lt.get_consolidated_simplified_loans(granularity='quarter'),
+                                          rollup_cash_flows(expected, 'quarter'))
+            pd.testing.assert_frame_equal(lt.get_consolidated_simplified_loans(date='2024-05-17', granularity='month'),
+                                          rollup_cash_flows(expected, 'month', datetime.date(2024, 5, 17)))
+        get_schedule_store.assert_not_called()
+
+        LoanInput.objects.get(loan_number=3).delete()
+        self.assertTrue(is_stale())
+        pd.testing.assert_frame_equal(lt.get_consolidated_simplified_loans(),
+                                      consolidate_portfolio_cash_flows(lt.get_simplified_loan_list()))
+
+    def test_merge_after_a_rebuild_marks_stale(self):
+        lt = LoansTape()
+        lt.upload_simplify_file(self.tape([(1, 35000, 0.08, '2023-09-01', 36, 'Monthly', 0.05)]))
+        lt.get_consolidated_simplified_loans()
+
+        merge = track_simplified_changes([1])
+        rebuild_cash_flows()
+        LoanInput.objects.filter(loan_number=1).update(loan_amount=30000)
+        merge([1])
+        self.assertTrue(is_stale())
+
+    def test_upload_materializes_schedules(self):
+        LoansTape().upload_simplify_file(self.tape([
+            (1, 35000, 0.08, '2023-09-01', 36, 'Monthly', 0.05),
+            (2, 40000, 0.08, '2023-09-01', 12, 'Monthly', 0.05)]))
+        lt = LoansTape()
+        loans = lt.get_simplified_loan_list()
+
+        schedule = lt.get_materialized_schedule(1)
+        expected = create_amortization_schedule(loans[loans['loan_number'] == 1])
+        self.assertEqual(len(schedule), len(expected))
+        np.testing.assert_allclose(schedule['closing_balance'], expected['Closing Ballance'])
+
+        date = '2024-03-01'
+        with self.settings(LOAN_MATERIALIZE_SCHEDULES=False):
+            expected = lt.get_consolidated_simplified_loans(loans, date)
+        pd.testing.assert_frame_equal(lt.get_consolidated_simplified_loans(loans, date).reset_index(drop=True),
+                                      expected.reset_index(drop=True), check_dtype=False)
+
+    def test_dated_consolidation_without_materialized_schedules(self):
+        # NOTE: bulk_create sends no post_save, so nothing is materialized
+        LoanInput.objects.bulk_create([LoanInput(loan_number=1, loan_amount=35000, interest_rate=0.08,
+                                                 start_date=datetime.date(2023, 9, 1), term=36,
+                                                 payment_frequency='Monthly', cpr=0.05)])
+        lt = LoansTape()
+        loans = lt.get_simplified_loan_list()
+        self.assertFalse(lt.has_materialized_schedules())
+
+        consolidated = lt.get_consolidated_simplified_loans(loans, '2024-03-01')
+        self.assertEqual(consolidated['Date'].tolist(), ['2024/03/01'])
+
+
+    def test_dated_consolidation_of_a_subset_of_the_loans(self):
+        LoansTape().upload_simplify_file(self.tape([
+            (1, 35000, 0.08, '2023-09-01', 36, 'Monthly', 0.05),
+            (2, 40000, 0.08, '2023-09-01', 12, 'Monthly', 0.05)]))
+        lt = LoansTape()
+        loans = lt.get_simplified_loan_list()
+        subset = loans[loans['loan_number'] == 2]
+        self.assertTrue(lt.has_materialized_schedules())
+
+        expected = consolidate_portfolio_cash_flows(subset, until=datetime.date(2024, 3, 1))
+        expected = expected[expected['Date'] == '2024/03/01'].reset_index(drop=True)
+        pd.testing.assert_frame_equal(lt.get_consolidated_simplified_loans(subset, '2024-03-01'), expected,
+                                      check_dtype=False)
+
+class ScheduleCacheTest(SimpleTestCase):
+
+    def test_memory_and_disk_tiers(self):
+        loan_info = simplified_loans().head(1)
+        params = loan_info.iloc[0].to_dict()
+        build = lambda: create_amortization_schedule(loan_info)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ScheduleCache(directory, memory_bytes=1, disk_bytes=10 * 1024 * 1024)
+            expected = cache.get_or_create("loaninput-1", 'periodic', params, build)
+            cached = cache.get_or_create("loaninput-1", 'periodic', params, build)
+            pd.testing.assert_frame_equal(cached, expected)
+
+            cache.invalidate("loaninput-1")
+            cache.get_or_create("loaninput-1", 'periodic', params, build)
+
+            stats = cache.stats()
+            self.assertEqual((stats['disk_hits'], stats['misses']), (1, 2))
+
+
+class DailyAmortizationTest(SimpleTestCase):
+
+    def test_daily_rows_follow_calendar(self):
+        loan = {'start_date': datetime.date(2024, 1, 13), 'original_principal': 10000.0,
+                'amortization_term_month': 360, 'mortgage_term_month': 12, 'interest_rate': 0.05,
+                'compounding_frequency': 'Monthly', 'payment_frequency': 'Monthly', 'cpr': 0.05}
+        loans_df, details_df = prepare_modified_calculated_loan_details(loan)
+        periodic_df = create_periodic_amortization(loans_df, details_df)
+        daily_df = convert_to_daily_amortization(periodic_df)
+
+        # 13/01/2024 through 13/01/2025, one row per day
+        self.assertEqual(len(daily_df), 367)
+        self.assertEqual(daily_df['date'].iloc[-1], "01/13/2025")
+        self.assertEqual(daily_df.groupby('Period').size().tolist()[:3], [32, 29, 31])
+        self.assertAlmostEqual(daily_df['payment'].sum(), periodic_df['Amount'].sum())
+        self.assertEqual(daily_df['closing_balance'].iloc[-1], periodic_df['Closing Balance'].iloc[-1])
+
+
+class ScheduleApiTest(TestCase):
+
+    def test_schedule_pages_match_full_schedule(self):
+        loan = simplified_loans().iloc[[2]]
+        LoanInput.objects.create(loan_number=3, loan_amount=125000, interest_rate=0.0725,
+                                 start_date=datetime.date(2024, 1, 31), term=60,
+                                 payment_frequency='Monthly', cpr=0.2)
+
+        rows, url = [], '/loans/api/simplified/3/schedule/?limit=7'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 7)
+            rows += page['results']
+            url = page['next']
+
+        expected = create_amortization_schedule(loan)
+        self.assertEqual([row['period'] for row in rows], expected['Period'].tolist())
+        self.assertEqual([row['closing_balance'] for row in rows], expected['Closing Ballance'].tolist())
+        self.assertEqual(self.client.get('/loans/api/simplified/4/schedule/').status_code, 404)
+
+    def test_single_loan_views_schedule_one_loan(self):
+        LoanInput.objects.create(loan_number=3, loan_amount=125000, interest_rate=0.0725,
+                                 start_date=datetime.date(2024, 1, 31), term=60,
+                                 payment_frequency='Monthly', cpr=0.2)
+        modified = {'start_date': datetime.date(2024, 1, 31), 'original_principal': 10000.0,
+                    'amortization_term_month': 60, 'mortgage_term_month': 24, 'interest_rate': 0.05,
+                    'compounding_frequency': 'Semi-Annual', 'payment_frequency': 'Monthly', 'cpr': 0.05}
+        loan = LoanTape.objects.create(**modified)
+        lt = LoansTape()
+
+        schedule, label = lt.get_simplified_loan_by_loan_number('3')
+        self.assertEqual(label, "Amortization Schedule")
+        pd.testing.assert_frame_equal(schedule, create_amortization_schedule(simplified_loans().iloc[[2]]),
+                                      check_dtype=False)
+        self.assertTrue(lt.get_simplified_loan_by_loan_number('4')[0].empty)
+
+        pd.testing.assert_frame_equal(lt.get_modified_schedule(loan.pk),
+                                      create_periodic_amortization(*prepare_modified_calculated_loan_details(modified)),
+                                      check_dtype=False)
+        self.assertIsNone(lt.get_modified_schedule(loan.pk + 1))
+
+    def test_empty_loans_page(self):
+        self.assertEqual(self.client.get('/loans/api/simplified/').json(), {'results': [], 'next': None})
+
+        LoanInput.objects.create(loan_number=3, loan_amount=125000, interest_rate=0.0725,
+                                 start_date=datetime.date(2024, 1, 31), term=60,
+                                 payment_frequency='Monthly', cpr=0.2)
+        self.assertEqual(self.client.get('/loans/api/simplified/?after=3').json()['results'], [])
+
+
+class ComputeLimiterTest(SimpleTestCase):
+
+    def test_refuses_when_full_and_drops_stale_jobs(self):
+        limiter = ComputeLimiter(workers=1, queue_size=1, queue_timeout=0.1)
+        release = threading.Event()
+
+        async def run():
+            running = asyncio.ensure_future(limiter.run(release.wait))
+            queued = asyncio.ensure_future(limiter.run(sum, [1, 2]))
+            await asyncio.sleep(0.01)
+
+            with self.assertRaises(ComputeOverloaded):
+                await limiter.run(sum, [1, 2])
+
+            await asyncio.sleep(0.2)
+            release.set()
+            self.assertTrue(await running)
+            with self.assertRaises(ComputeOverloaded):
+                await queued
+
+            self.assertEqual(await limiter.run(sum, [1, 2]), 3)
+            self.assertEqual(limiter.stats()['pending'], 0)
+
+        asyncio.run(run())
+
+    def test_streams_hold_a_pending_job(self):
+        limiter = ComputeLimiter(workers=1, queue_size=0, queue_timeout=1)
+
+        async def run():
+            stream = limiter.iterate(iter([1, 2]))
+            with self.assertRaises(ComputeOverloaded):
+                await limiter.run(sum, [1, 2])
+            with self.assertRaises(ComputeOverloaded):
+                limiter.iterate(iter([3]))
+
+            self.assertEqual([item async for item in stream], [1, 2])
+            self.assertEqual(limiter.stats()['pending'], 0)
+
+            # A stream dropped before it is sent gives its place back
+            limiter.iterate(iter([3]))
+            self.assertEqual(limiter.stats()['pending'], 0)
+
+        asyncio.run(run())
+
+
+class PortfolioPositionsTest(SimpleTestCase):
+
+    def test_positions_match_stepped_schedules(self):
+        loans = simplified_loans()
+        schedule = create_portfolio_amortization_schedule(loans)
+        schedule['date'] = pd.to_datetime(schedule['Date'], format="%d/%m/%Y")
+
+        for date in ['2023-12-31', '2024-03-01', '2026-01-01', '2040-01-01']:
+            expected = schedule[schedule['date'] <= date].groupby('loan_number').tail(1)
+            for exact, places in ((True, 7), (False, 1)):
+                positions = portfolio_positions(loans, date, exact)
+                self.assertEqual(positions['loan_number'].tolist(), expected['loan_number'].tolist())
+                self.assertEqual(positions['Period'].tolist(), expected['Period'].tolist())
+                self.assertEqual(positions['Date'].tolist(), expected['Date'].tolist())
+                np.testing.assert_almost_equal(positions['Closing Ballance'].to_numpy(),
+                                               expected['Closing Ballance'].to_numpy(), places)
+
+    def test_position_totals_are_summed_in_cents(self):
+        loans = simplified_loans()
+        positions, totals = LoansTape().get_simplified_positions(loans, '2024-03-01', exact=True)
+        paid = positions[positions['Date'] == '01/03/2024']
+
+        self.assertEqual(totals['loans'], len(loans))
+        self.assertEqual(totals['balance'], from_cents(to_cents(positions['Closing Ballance']).sum()))
+        for name, column in (('payment', 'Payment'), ('interest', 'Interest'), ('principal', 'Principal')):
+            self.assertEqual(totals[name], from_cents(to_cents(paid[column]).sum()))
+
+
+class ScenarioCashFlowsTest(SimpleTestCase):
+
+    def test_scenarios_match_shocked_portfolios(self):
+        loans = pd.DataFrame([{'loan_number': 1, 'loan_amount': 35000.0, 'interest_rate': 0.08,
+                               'start_date': datetime.date(2023, 9, 1), 'term': 36,
+                               'payment_frequency': 'Monthly', 'cpr': 0.05},
+                              {'loan_number': 2, 'loan_amount': 9000.0, 'interest_rate': 0.125,
+                               'start_date': datetime.date(2023, 5, 17), 'term': 24,
+                               'payment_frequency': 'Weekly', 'cpr': 0.6}])
+        curves = scenario_cash_flows(loans, [1, 2], [0, 0.01], chunk_size=1)
+
+        for multiplier, shock in [(1, 0), (2, 0.01)]:
+            shocked = loans.assign(cpr=np.clip(loans['cpr'] * multiplier, 0, 1), interest_rate=loans['interest_rate'] + shock)
+            expected = consolidate_portfolio_cash_flows(calculate_loan_details(shocked))
+            curve = curves[(curves['cpr_multiplier'] == multiplier) & (curves['rate_shock'] == shock)]
+            pd.testing.assert_frame_equal(curve.drop(columns=['cpr_multiplier', 'rate_shock']).reset_index(drop=True),
+                                          expected, check_exact=False, atol=1e-6)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class InstrumentationTest(TestCase):
+
+    def test_stages_reach_header_and_metrics(self):
+        LoanInput.objects.create(loan_number=1, loan_amount=35000, interest_rate=0.08,
+                                 start_date=datetime.date(2023, 9, 1), term=36,
+                                 payment_frequency='Monthly', cpr=0.05)
+        instrumentation.metrics.clear()
+
+        response = self.client.post('/loans/list/', {'type': '1', 'loan_number': '1'})
+        timing = response['Server-Timing']
+        self.assertIn('loans_lib.LoansTape.get_simplified_loan_by_loan_number;dur=', timing)
+        self.assertNotIn('get_simplified_loan_list', timing)
+        self.assertIn('to_html;dur=', timing)
+        self.assertRegex(timing, r'to_html;dur=[0-9.]+;desc="rows=35 calls=1"')
+
+        stages = self.client.get('/loans/metrics/').json()['stages']
+        self.assertEqual(stages['view.get_simplified_loans_list']['count'], 1)
+        self.assertLessEqual(stages['to_html']['p50_ms'], stages['to_html']['p95_ms'])
+
+    def test_async_views_keep_the_async_chain(self):
+        async def get_response(request):
+            instrumentation.record_stage('work', 0.001)
+            return HttpResponse()
+
+        middleware = ServerTimingMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        response = asyncio.run(middleware(RequestFactory().get('/loans/async/list/')))
+        self.assertIn('work;dur=', response['Server-Timing'])
+
+    def test_disabled_records_nothing(self):
+        instrumentation.configure(False)
+        self.addCleanup(instrumentation.configure, True)
+        instrumentation.metrics.clear()
+
+        response = self.client.get('/loans/cache/stats/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(instrumentation.metrics.summary(), {})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ConditionalCacheTest(TestCase):
+
+    def test_download_revalidates_on_the_dataset_version(self):
+        loan = LoanTape.objects.create(start_date=datetime.date(2024, 1, 31), original_principal=10000.0,
+                                       amortization_term_month=60, mortgage_term_month=24, interest_rate=0.05,
+                                       compounding_frequency='Semi-Annual', payment_frequency='Monthly', cpr=0.05)
+        url = f'/loans/list/{loan.pk}/download/'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url + '?format=csv', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        loan.cpr = 0.1
+        loan.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertNotEqual(changed.content, response.content)
+
+    def test_tables_are_rendered_once_per_version(self):
+        LoanInput.objects.create(loan_number=1, loan_amount=35000, interest_rate=0.08,
+                                 start_date=datetime.date(2023, 9, 1), term=36,
+                                 payment_frequency='Monthly', cpr=0.05)
+
+        with mock.patch('loan.views.loan_tables', wraps=loan_tables) as render_tables:
+            first = self.client.get('/loans/list/', {'type': '1', 'loan_number': '1'})
+            posted = self.client.post('/loans/list/', {'type': '1', 'loan_number': '1'})
+            self.assertEqual(render_tables.call_count, 1)
+            self.assertEqual(posted.content, first.content)
+            self.assertEqual(self.client.get('/loans/list/', {'type': '1', 'loan_number': '1'},
+                                             HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+            LoansTape().upload_simplify_file(SimpleUploadedFile("tape.csv", (
+                b"loan number,loan amount,interest_rate,start_date,term ,payment frequency,"
+                b"CPR (Conditional Prepayment Rate)\n1,40000,0.08,2023-09-01,36,Monthly,0.05\n")))
+            changed = self.client.get('/loans/list/', {'type': '1', 'loan_number': '1'},
+                                      HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(changed.status_code, 200)
+            self.assertEqual(render_tables.call_count, 2)
+
+
+class ScheduleStoreTest(SimpleTestCase):
+
+    def test_store_matches_portfolio_engines(self):
+        rows = [(1, 35000.0, 0.08, datetime.date(2023, 9, 1), 36, 'Monthly', 0.05),
+                (3, 125000.0, 0.0725, datetime.date(2024, 1, 31), 60, 'Monthly', 0.2),
+                (4, 9000.0, 0.125, datetime.date(2023, 5, 17), 24, 'Weekly', 0.6),
+                (6, 500000.0, 0.03, datetime.date(2024, 2, 29), 120, 'Semimonthly', 0.0)]
+        tape = simplified_tape(rows)
+        loans_df = prepare_calculated_loan_details(tape)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = ScheduleStore(directory, versions=1)
+            stored = store.get_or_build(tape, chunk_size=3)
+            self.assertEqual(store.get_or_build(tape).path, stored.path)
+
+            pd.testing.assert_frame_equal(pd.concat(stored.iter_frames(chunk_rows=50), ignore_index=True),
+                                          create_portfolio_amortization_schedule(loans_df), check_dtype=False)
+            pd.testing.assert_frame_equal(stored.loan_schedule(4), create_amortization_schedule(loans_df.iloc[[2]]),
+                                          check_dtype=False)
+            self.assertIsNone(stored.loan_schedule(2))
+
+            expected = consolidate_portfolio_cash_flows(loans_df)
+            pd.testing.assert_frame_equal(stored.cash_flows(chunk_rows=50), expected)
+            pd.testing.assert_frame_equal(stored.cash_flows(datetime.date(2024, 3, 1)),
+                                          expected[expected['Date'] == '2024/03/01'].reset_index(drop=True))
+
+            changed = store.get_or_build(simplified_tape(rows[:2]))
+            self.assertNotEqual(changed.path, stored.path)
+            self.assertFalse(stored.path.exists())
+
+
+    def test_rollups_sum_the_flows_and_carry_the_balances(self):
+        rows = [(1, 35000.0, 0.08, datetime.date(2023, 9, 1), 36, 'Monthly', 0.05),
+                (4, 9000.0, 0.125, datetime.date(2023, 5, 17), 24, 'Weekly', 0.6)]
+        tape = simplified_tape(rows)
+        loans_df = prepare_calculated_loan_details(tape)
+        daily = consolidate_portfolio_cash_flows(loans_df)
+        flows = ['Payment', 'Prepayment', 'Interest', 'Principal']
+
+        with tempfile.TemporaryDirectory() as directory:
+            stored = ScheduleStore(directory, versions=1).get_or_build(tape)
+            pd.testing.assert_frame_equal(stored.rollup('day'), daily)
+
+            for granularity, bucket in ROLLUP_BUCKETS.items():
+                expected = pd.DataFrame(to_cents(daily[flows]), columns=flows).groupby(
+                    bucket(daily['Date'].str[8:] + '/' + daily['Date'].str[5:7] + '/' + daily['Date'].str[:4]).to_numpy(),
+                    sort=False).sum()
+                rollup = stored.rollup(granularity)
+                self.assertEqual(rollup['Date'].tolist(), expected.index.tolist())
+                np.testing.assert_array_equal(rollup[flows].to_numpy(), from_cents(expected.to_numpy()))
+                self.assert_carried_balances(rollup, loans_df, bucket)
+
+            self.assertEqual(stored.rollup('quarter', datetime.date(2024, 5, 17))['Date'].tolist(), ['2024/Q2'])
+            with self.assertRaises(ValueError):
+                stored.rollup('week')
+
+    def test_rollup_balances_include_loans_paying_on_other_days(self):
+        loans_df = prepare_calculated_loan_details([
+            {'loan_number': 1, 'loan_amount': 100000.0, 'interest_rate': 0.08, 'start_date': datetime.date(2024, 1, 1),
+             'term': 12, 'payment_frequency': 'Monthly', 'cpr': 0.05},
+            {'loan_number': 2, 'loan_amount': 1000.0, 'interest_rate': 0.08, 'start_date': datetime.date(2024, 1, 15),
+             'term': 12, 'payment_frequency': 'Monthly', 'cpr': 0.05},
+            {'loan_number': 3, 'loan_amount': 9000.0, 'interest_rate': 0.125, 'start_date': datetime.date(2023, 12, 17),
+             'term': 24, 'payment_frequency': 'Weekly', 'cpr': 0.6}])
+        consolidated = consolidate_portfolio_cash_flows(loans_df)
+
+        for granularity, bucket in ROLLUP_BUCKETS.items():
+            self.assert_carried_balances(rollup_cash_flows(consolidated, granularity), loans_df, bucket)
+
+        # The loans pay on the 1st and the 15th, February closes with the balances of both
+        february = rollup_cash_flows(consolidate_portfolio_cash_flows(loans_df.iloc[:2]), 'month', datetime.date(2024, 2, 1))
+        first, second = (create_amortization_schedule(loans_df.iloc[[index]]) for index in range(2))
+        self.assertEqual(february['Closing Ballance'].tolist(),
+                         [round(first['Closing Ballance'][1] + second['Closing Ballance'][1], 2)])
+
+    def assert_carried_balances(self, rollup, loans_df, bucket):
+        # Closing balance of every loan at the end of each bucket, the last one of a loan carried forward
+        closings = []
+        for index in range(len(loans_df)):
+            schedule = create_amortization_schedule(loans_df.iloc[[index]])
+            closings.append(schedule.groupby(bucket(schedule['Date']).to_numpy())['Closing Ballance'].last())
+        closings = pd.concat(closings, axis=1).sort_index().ffill().fillna(0)
+        closing = to_cents(closings.to_numpy()).sum(axis=1)
+
+        self.assertEqual(rollup['Date'].tolist(), closings.index.tolist())
+        np.testing.assert_array_equal(rollup['Closing Ballance'].to_numpy(), from_cents(closing))
+        np.testing.assert_array_equal(rollup['Principal Remaining'].to_numpy(), from_cents(np.r_[0, closing[:-1]]))
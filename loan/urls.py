@@ -5,5 +5,16 @@ urlpatterns = [
     path('upload/', views.upload_file, name='upload_file'),
     path('list/', views.filter_loans, name='get_simplified_loans_list'),
     path('list/<int:loan_id>/download/', views.download_loan_schedule, name='download_loan_schedule'),
+    path('async/upload/', views.upload_file_async, name='upload_file_async'),
+    path('async/list/', views.filter_loans_async, name='get_simplified_loans_list_async'),
+    path('async/list/<int:loan_id>/download/', views.download_loan_schedule_async, name='download_loan_schedule_async'),
+    path('jobs/<int:job_id>/', views.ingestion_job_status, name='ingestion_job_status'),
+    path('cache/stats/', views.schedule_cache_stats, name='schedule_cache_stats'),
+    path('metrics/', views.instrumentation_metrics, name='instrumentation_metrics'),
+    path('api/simplified/', views.api_simplified_loans, name='api_simplified_loans'),
+    path('api/simplified/positions/', views.api_simplified_positions, name='api_simplified_positions'),
+    path('api/simplified/<int:loan_number>/schedule/', views.api_simplified_schedule, name='api_simplified_schedule'),
+    path('api/modified/', views.api_modified_loans, name='api_modified_loans'),
+    path('api/modified/<int:loan_id>/schedule/', views.api_modified_schedule, name='api_modified_schedule'),
     
 ]
@@ -1,23 +1,35 @@
-import pandas as pd
 from datetime import datetime
-from django.shortcuts import render, redirect, HttpResponse
+from io import BytesIO
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponseBadRequest, Http404
+from django.shortcuts import render, redirect, HttpResponse, get_object_or_404
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+from django.views.decorators.http import condition
 from .forms import FileUploadForm, FilterLoanForm
-from .models import LoanInput, LoanTape
-from loan.loans_lib import LoansTape
-from commons.helpers import (
-    prepare_calculated_loan_details, 
-    create_amortization_schedule, 
-    conver_file_to_dataframe,
-    prepare_modified_calculated_loan_details,
-    create_periodic_amortization
-)
-
-lt = LoansTape()
+from .models import LoanInput, LoanTape, IngestionJob
+from loan.schedule_cache import schedule_cache
+from loan.offload import compute_limiter, ComputeOverloaded
+from loan.ingestion import enqueue_upload, job_status
+from loan.dataset import request_etag, cached_page
+from commons import instrumentation
+from commons.instrumentation import stage
+
+# NOTE: Created on first use, so loading the URLs (system checks, manage.py commands) does not import pandas
+lt = SimpleLazyObject(lambda: import_string('loan.loans_lib.LoansTape')())
+
+EXPORT_CONTENT_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+}
+
 
 def upload_file(request):
     
     upload_type = request.POST.get('type')
     form = FileUploadForm()
+    summary = None
     
     if request.method == "POST" and request.FILES['file']:
         form = FileUploadForm(request.POST, request.FILES)
@@ -25,103 +37,346 @@ def upload_file(request):
 
             file = request.FILES['file']
             
+            # NOTE: The file is stored and saved by a worker, the page polls the job status
+            if settings.LOAN_UPLOAD_IN_BACKGROUND:
+                job = enqueue_upload(upload_type, file)
+                return render(request, 'loan/upload_file.html', {'form': FileUploadForm(), 'job': job})
+            
             if upload_type == '1':
                 
-                lt.upload_simplify_file(file)
+                summary = lt.upload_simplify_file(file)
         
             if upload_type == '2':
-                lt.upload_modified_file(file)
+                summary = lt.upload_modified_file(file)
             
             #return redirect("/loans/upload")
     
-    return render(request, 'loan/upload_file.html', {'form': form})
+    return render(request, 'loan/upload_file.html', {'form': form, 'summary': summary})
 
 
+@condition(etag_func=request_etag)
 def filter_loans(request):
     '''
     Returns list of Simplify Loans and filter Loans based on user input
     loan_number: if loan in request return amortization schedule of specific loan number
     consolidate: if in request return consolidated dataframes of all loans grouped by date
+    granularity: day (default), month, quarter or year buckets of the consolidated cash flows
+    Inputs are read from the query string too, so the responses get an ETag and 304s
     '''
     
-    label = "Loan Information"
     form = FilterLoanForm()
-    loan_number = request.POST.get("loan_number")
-    consolidate = request.POST.get("consolidate")
-    date = request.POST.get('date')
-    loan_type = request.POST.get('type')
+    data = request.POST if request.method == 'POST' else request.GET
+    options = {'loan_type': data.get('type'),
+               'loan_number': data.get("loan_number"),
+               'consolidate': data.get("consolidate"),
+               'date': data.get('date'),
+               'granularity': data.get('granularity') or 'day'}
+    
+    # NOTE: The tables are rendered once per version of the loans and form inputs
+    tables = cached_page(request, 'loan_tables', options, lambda: loan_tables(**options))
+    
+    with stage('render'):
+        return render(request, 'loan/simplified_loan.html', {'form': form, **tables,
+                                                             'loan_number': options['loan_number']})
+
+
+def loan_tables(loan_type, loan_number, consolidate, date, granularity):
+    '''
+    Returns the label and the HTML tables of the loans page for the form inputs
+    '''
+    label = "Loan Information"
     details_html = ''
     periodic_html = ''
     loans_html = ''
     
     if loan_type == '1':
-        # Retrieve list of all Loans and convert to Pandas Dataframe
-        loans_df = lt.get_simplified_loan_list()
-
-        if loan_number: 
-            loans_df, label = lt.get_simplified_loan_by_loan_number(loans_df, loan_number)
-    
-        # Return the consolidated dataframes for all loans
-        if consolidate == 'on':
-            
-            loans_df = lt.get_consolidated_simplified_loans(loans_df, date=date)
-            
+        # NOTE: The whole portfolio is consolidated from the stored aggregates, without loading the loans
+        if consolidate == 'on' and not loan_number:
+            loans_df = consolidated_loans(date=date, granularity=granularity)
+        elif loan_number: 
+            # NOTE: Only the requested loan is read and scheduled
+            loans_df, label = lt.get_simplified_loan_by_loan_number(loan_number)
+        else:
+            # Retrieve list of all Loans and convert to Pandas Dataframe
+            loans_df = lt.get_simplified_loan_list()
         
-        loans_html = loans_df.to_html(index=False,
-                                            col_space=120,
-                                            float_format="{:,.2f}".format,
-                                            justify="center",
-                                            classes='table table-striped table-hover table-responsive')
+        loans_html = table_html(loans_df)
     
     if loan_type == '2':
-        # Retrieve list of all Loans and convert to Pandas Dataframe
-        loans_df = lt.get_modified_loan_list()
-        
         if loan_number: 
-            loans_df, details_df, label= lt.get_modified_loan_by_id(loans_df, loan_number)
-            
-            details_html = details_df.to_html(index=False,
-                                col_space=120,
-                                float_format="{:,.2f}".format,
-                                justify="center",
-                                classes='table table-striped table-hover table-responsive')
-
-            periodic_df = lt.create_periodic_amortization(loans_df, details_df)
-            periodic_html = periodic_df.to_html(index=False,
-                                col_space=120,
-                                float_format="{:,.2f}".format,
-                                justify="center",
-                                classes='table table-striped table-hover')
+            loans_df, details_df, label= lt.get_modified_loan_by_id(loan_number)
+        else:
+            # Retrieve list of all Loans and convert to Pandas Dataframe
+            loans_df = lt.get_modified_loan_list()
+        
+        if loan_number and not loans_df.empty: 
+            details_html = table_html(details_df)
+
+            periodic_df = lt.get_modified_schedule(loan_number)
+            periodic_html = table_html(periodic_df, classes='table table-striped table-hover')
                 
-        loans_html = loans_df.to_html(index=False,
-                                    col_space=120,
-                                    float_format="{:,.2f}".format,
-                                    justify="center",
-                                    classes='table table-striped table-hover table-responsive')
+        loans_html = table_html(loans_df)
     
-    
-    return render(request, 'loan/simplified_loan.html', {'form': form, 'loans': loans_html,
-                                                         'details': details_html, 
-                                                         'periodic': periodic_html, 
-                                                         'loan_number': loan_number , 'label': label})
+    return {'loans': loans_html, 'details': details_html, 'periodic': periodic_html, 'label': label}
+
 
+def consolidated_loans(df=None, date=None, granularity='day'):
+    try:
+        return lt.get_consolidated_simplified_loans(df, date=date, granularity=granularity)
+    except ValueError as error:
+        raise BadRequest(str(error))
 
+
+def table_html(df, classes='table table-striped table-hover table-responsive'):
+    '''
+    Renders a DataFrame as the HTML table of the loan pages
+    '''
+    with stage('to_html', rows=len(df)):
+        return df.to_html(index=False,
+                          col_space=120,
+                          float_format="{:,.2f}".format,
+                          justify="center",
+                          classes=classes)
+
+
+@condition(etag_func=request_etag)
 def download_loan_schedule(request, loan_id):
     
-    periodic_df, daily_df, monthly_df = lt.download_amortization_schedule(loan_id)
-    
     # Get the current timestamp for filename
     current_timestamp = datetime.now()
     timestamp_str = current_timestamp.strftime('%Y%m%d%H%M%S')
     file_name = f"modified_loans_{timestamp_str}"
+    
+    # NOTE: A format in the query string streams the export while it is generated
+    export_format = request.GET.get('format')
+    if export_format:
+        return stream_loan_schedule(request, loan_id, export_format, file_name)
+    
+    content = cached_page(request, 'schedule_xlsx', {'loan_id': loan_id}, lambda: schedule_xlsx(loan_id))
+    
     # Create a response object to return the Excel file
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response = HttpResponse(content, content_type=EXPORT_CONTENT_TYPES['xlsx'])
     response['Content-Disposition'] = f'attachment; filename="{file_name}.xlsx"'
+        
+    return response
+
+
+def schedule_xlsx(loan_id):
+    '''
+    Returns the periodic, daily and monthly schedules of a modified loan as the bytes of an Excel workbook
+    '''
+    try:
+        periodic_df, daily_df, monthly_df = lt.download_amortization_schedule(loan_id)
+    except LoanTape.DoesNotExist as error:
+        raise Http404(str(error))
     
     # Use pandas to write the DataFrame to an Excel file
-    with pd.ExcelWriter(response, engine='openpyxl') as writer:
+    import pandas as pd
+    workbook = BytesIO()
+    with pd.ExcelWriter(workbook, engine='openpyxl') as writer:
         periodic_df.to_excel(writer, index=False, sheet_name='periodic')
         daily_df.to_excel(writer, index=False, sheet_name='daily')
         monthly_df.to_excel(writer, index=False, sheet_name='monthly')
-        
+    
+    return workbook.getvalue()
+
+
+def stream_loan_schedule(request, loan_id, export_format, file_name):
+    '''
+    Streams the schedules of a loan as an xlsx workbook (all sheets), or as a csv
+    file of the sheet given by the `sheet` query parameter (periodic, daily or monthly).
+    '''
+    sheet = request.GET.get('sheet', 'daily')
+    
+    if export_format not in EXPORT_CONTENT_TYPES:
+        return HttpResponseBadRequest(f"Unsupported format '{export_format}'.")
+    
+    if sheet not in ('periodic', 'daily', 'monthly'):
+        return HttpResponseBadRequest(f"Unsupported sheet '{sheet}'.")
+    
+    try:
+        schedules = lt.stream_amortization_schedule(loan_id)
+    except LoanTape.DoesNotExist as error:
+        raise Http404(str(error))
+    
+    from commons.exports import iter_csv, iter_xlsx
+    if export_format == 'xlsx':
+        content = iter_xlsx(schedules.items())
+    else:
+        content = iter_csv(schedules[sheet])
+        file_name = f"{file_name}_{sheet}"
+    
+    response = StreamingHttpResponse(content, content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{file_name}.{export_format}"'
+    
+    return response
+
+
+def ingestion_job_status(request, job_id):
+    '''
+    Returns the progress of an upload job
+    '''
+    return JsonResponse(job_status(get_object_or_404(IngestionJob, pk=job_id)))
+
+
+def schedule_cache_stats(request):
+    '''
+    Returns the hit/miss counters of the amortization schedule cache
+    '''
+    return JsonResponse(schedule_cache.stats())
+
+
+def instrumentation_metrics(request):
+    '''
+    Returns the p50/p95 duration and row count of every timed stage, with the cache and compute pool counters
+    '''
+    return JsonResponse({'enabled': instrumentation.is_enabled(),
+                         'stages': instrumentation.metrics.summary(),
+                         'schedule_cache': schedule_cache.stats(),
+                         'compute': compute_limiter.stats()})
+
+
+async def upload_file_async(request):
+    '''
+    `upload_file` with the upload saved on the bounded compute pool
+    '''
+    return await run_limited(upload_file, request)
+
+
+async def filter_loans_async(request):
+    '''
+    `filter_loans` with the schedules computed and rendered on the bounded compute pool
+    '''
+    return await run_limited(filter_loans, request)
+
+
+async def download_loan_schedule_async(request, loan_id):
+    '''
+    `download_loan_schedule` on the bounded compute pool. Streamed exports keep
+    generating their chunks on the pool instead of the event loop.
+    '''
+    response = await run_limited(download_loan_schedule, request, loan_id)
+    
+    if isinstance(response, StreamingHttpResponse) and not response.is_async:
+        # NOTE: The stream keeps a place on the pool until it is sent
+        try:
+            response.streaming_content = compute_limiter.iterate(iter(response.streaming_content))
+        except ComputeOverloaded:
+            response.close()
+            return overloaded_response()
+    
     return response
+
+
+async def run_limited(view, *args):
+    '''
+    Runs a sync view on the compute pool, answering 503 with Retry-After when it is full
+    '''
+    try:
+        return await compute_limiter.run(view, *args)
+    except ComputeOverloaded:
+        return overloaded_response()
+
+
+def overloaded_response():
+    response = HttpResponse("Server busy, please retry later.", status=503)
+    response['Retry-After'] = settings.LOAN_COMPUTE['RETRY_AFTER']
+    return response
+
+
+def api_simplified_loans(request):
+    '''
+    Returns a page of Simplify Loans as JSON, keyed by loan number
+    after: last loan number of the previous page
+    limit: page size
+    '''
+    after, limit = get_page_params(request)
+    loans_df, next_after = lt.get_simplified_loans_page(after, limit)
+    
+    return page_response(request, loans_df.to_dict('records'), next_after)
+
+
+def api_simplified_schedule(request, loan_number):
+    '''
+    Returns a page of the amortization schedule of a Simplify Loan as JSON, keyed by period
+    '''
+    after, limit = get_page_params(request)
+    page = lt.get_simplified_schedule_page(loan_number, after, limit)
+    if page is None:
+        raise Http404(f"No Information for Loan Number {loan_number}")
+    
+    return page_response(request, *page)
+
+
+def api_modified_loans(request):
+    '''
+    Returns a page of Modified Loans as JSON, keyed by id
+    '''
+    after, limit = get_page_params(request)
+    
+    return page_response(request, *lt.get_modified_loans_page(after, limit))
+
+
+def api_modified_schedule(request, loan_id):
+    '''
+    Returns a page of the periodic schedule of a Modified Loan as JSON, keyed by period
+    '''
+    after, limit = get_page_params(request)
+    page = lt.get_modified_schedule_page(loan_id, after, limit)
+    if page is None:
+        raise Http404(f"No Information for Loan {loan_id}")
+    
+    return page_response(request, *page)
+
+
+def api_simplified_positions(request):
+    '''
+    Returns the balance and cash flows of the Simplify Loans at a date as JSON
+    date: ISO date (required)
+    loan_number: also return that loan's schedule row at the date
+    exact: if given, step every period instead of using the closed-form balance
+    '''
+    try:
+        date = datetime.strptime(request.GET['date'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        raise BadRequest("date is required, as YYYY-MM-DD")
+    
+    from commons.helpers import prepare_calculated_loan_details
+    loans_df = prepare_calculated_loan_details(lt.get_simplified_tape())
+    positions, totals = lt.get_simplified_positions(loans_df, date, exact='exact' in request.GET)
+    data = {'date': date, 'totals': totals}
+    
+    loan_number = request.GET.get('loan_number')
+    if loan_number:
+        position = positions[positions['loan_number'].astype(str) == loan_number]
+        if position.empty:
+            raise Http404(f"No Information for Loan Number {loan_number}")
+        data['position'] = position.to_dict('records')[0]
+    
+    return JsonResponse(data)
+
+
+def get_page_params(request):
+    try:
+        after = int(request.GET['after']) if request.GET.get('after') else None
+        limit = int(request.GET.get('limit', settings.LOAN_API_PAGE_SIZE))
+    except ValueError:
+        after, limit = None, 0
+    
+    if limit < 1:
+        raise BadRequest("after and limit must be integers, limit at least 1")
+    
+    return after, min(limit, settings.LOAN_API_MAX_PAGE_SIZE)
+
+
+def page_response(request, results, next_after):
+    '''
+    JSON page with the url of the next page (None on the last page)
+    '''
+    next_url = None
+    if next_after is not None:
+        params = request.GET.copy()
+        params['after'] = next_after
+        next_url = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+    
+    return JsonResponse({'results': results, 'next': next_url})
@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'loan.middleware.ServerTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'vml.urls'
@@ -119,7 +120,81 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded loan tapes waiting for the ingestion workers
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Number of rows saved per bulk_create when uploading a loan tape
+LOAN_UPLOAD_BATCH_SIZE = 1000
+
+# Number of rows read from an uploaded loan tape at a time
+LOAN_UPLOAD_CHUNK_SIZE = 10000
+
+# Amortization schedule cache, an in-process LRU in front of npz files on disk
+LOAN_SCHEDULE_CACHE = {
+    'DIRECTORY': BASE_DIR / 'schedule_cache',
+    'MEMORY_BYTES': 64 * 1024 * 1024,
+    'DISK_BYTES': 512 * 1024 * 1024,
+}
+
+# Number of periods expanded to daily rows at a time when streaming a schedule export
+LOAN_EXPORT_CHUNK_PERIODS = 120
+
+# Store every loan's schedule in LoanSchedule/LoanTapeSchedule when loans are saved
+LOAN_MATERIALIZE_SCHEDULES = True
+
+# Default and largest page of the JSON loan/schedule API
+LOAN_API_PAGE_SIZE = 100
+LOAN_API_MAX_PAGE_SIZE = 1000
+
+# Thread pool running the schedule work of the async views: running jobs, queued jobs
+# beyond which requests get a 503, seconds a job may wait in the queue, Retry-After of a 503
+LOAN_COMPUTE = {
+    'WORKERS': 4,
+    'QUEUE_SIZE': 16,
+    'QUEUE_TIMEOUT': 30,
+    'RETRY_AFTER': 5,
+}
+
+# Queue uploads for the process_ingestion_jobs workers instead of saving them inside the request
+LOAN_UPLOAD_IN_BACKGROUND = True
+
+# Seconds without progress after which a running upload job is taken back from its (crashed) worker
+LOAN_INGESTION_HEARTBEAT_TIMEOUT = 300
+
+# Number of loans stepped at a time (times the number of scenarios) by the scenario engine
+LOAN_SCENARIO_CHUNK_SIZE = 1000
+
+# Time the loan stages (queries, schedules, rendering) for the Server-Timing header and loans/metrics/
+LOAN_INSTRUMENTATION = True
+
+# Keep the per-date cash flows of the Simplify portfolio stored, uploads merging the changes of their loans
+LOAN_PORTFOLIO_AGGREGATES = True
+
+# Memory-mapped column files of every Simplify loan's schedule, one directory per tape version:
+# number of versions kept, loans computed at a time when a version is stored
+LOAN_SCHEDULE_STORE = {
+    'DIRECTORY': BASE_DIR / 'schedule_store',
+    'VERSIONS': 2,
+    'CHUNK_SIZE': 1000,
+}
+
+# Rendered loan tables and schedule downloads, keyed by the version of the loans (file-based, shared by the workers)
+LOAN_PAGE_CACHE = 'loan_pages'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    LOAN_PAGE_CACHE: {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'page_cache',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 500},
+    },
+}